@@ -3,18 +3,22 @@ from .models import *
 
 admin.site.register(Address)
 admin.site.register(Product)
-admin.site.register(Inventory)
+admin.site.register(Stock)
 admin.site.register(AppUser)
 admin.site.register(DocumentType)
 admin.site.register(Document)
+admin.site.register(DocumentSequence)
 admin.site.register(Warehouse)
 admin.site.register(Department)
 admin.site.register(Row)
 admin.site.register(Section)
 admin.site.register(Level)
 admin.site.register(Cell)
+admin.site.register(TopologyVersion)
 admin.site.register(Status)
 admin.site.register(DocumentProduct)
 admin.site.register(DocumentUser)
 admin.site.register(DocumentStatus)
+admin.site.register(DailyDocumentFact)
+admin.site.register(SyncChange)
 
@@ -0,0 +1,589 @@
+import base64
+import datetime
+import hashlib
+import io
+import json
+from functools import wraps
+from django.contrib.auth import authenticate
+from django.core.exceptions import ValidationError
+from django.core.serializers.json import DjangoJSONEncoder
+from django.http import FileResponse, HttpResponse, JsonResponse, StreamingHttpResponse
+from django.middleware.csrf import CsrfViewMiddleware
+from django.views.decorators.csrf import csrf_exempt
+from django.views.decorators.http import require_GET, require_POST
+from .models import *
+from .exports import EXPORTS, ExportError
+from .importers import DocumentImporter
+from .services import LookupService, ScanService, SyncService, UserService
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+
+class ApiError(Exception):
+    def __init__(self, message, status=400):
+        super().__init__(message)
+        self.status = status
+
+
+def api_login_required(view):
+    """
+    Like login_required, but answers 401 instead of redirecting to the login page.
+
+    Besides the session, HTTP Basic credentials are accepted so integrations
+    do not have to go through the login form.
+    """
+    @wraps(view)
+    def wrapper(request, *args, **kwargs):
+        if not request.user.is_authenticated:
+            user = _basic_auth_user(request)
+            if user is None:
+                response = JsonResponse({'error': 'Authentication required'}, status=401)
+                response['WWW-Authenticate'] = 'Basic realm="wms"'
+                return response
+            request.user = user
+            request.api_basic_auth = True
+            request.wms_user = UserService.resolve(user)
+        try:
+            return view(request, *args, **kwargs)
+        except ApiError as e:
+            return JsonResponse({'error': str(e)}, status=e.status)
+    return wrapper
+
+
+def _csrf_rejection(request):
+    """
+    CSRF check for views exempted so that HTTP Basic clients can POST; browser
+    sessions still need the token
+
+    Returns:
+        403 response, or None if the request passes
+    """
+    if getattr(request, 'api_basic_auth', False):
+        return None
+    check = CsrfViewMiddleware(lambda request: None)
+    check.process_request(request)
+    return check.process_view(request, None, (), {})
+
+
+def _basic_auth_user(request):
+    header = request.META.get('HTTP_AUTHORIZATION', '')
+    if not header.startswith('Basic '):
+        return None
+    try:
+        username, password = base64.b64decode(header[6:]).decode().split(':', 1)
+    except (ValueError, UnicodeDecodeError):
+        return None
+    return authenticate(request, username=username, password=password)
+
+
+class Resource:
+    """
+    Read-only JSON listing of a model.
+
+    fields maps the public field names to ORM lookups. Rows are read with
+    values() over the requested lookups only, so the joins follow ?fields=
+    and no model instances are built. nested maps a field name to a child
+    resource fetched with one extra query for the whole page, the way
+    prefetch_related would. filters maps query parameters to ORM lookups.
+
+    Pages are keyset-paginated on the primary key with an opaque cursor.
+    """
+
+    DEFAULT_LIMIT = 100
+    MAX_LIMIT = 1000
+
+    def __init__(self, model, fields, default_fields=None, filters=None, nested=None, parent_field=None):
+        self.model = model
+        self.fields = fields
+        self.default_fields = default_fields or list(fields)
+        self.filters = filters or {}
+        self.nested = nested or {}
+        # Lookup of the parent's primary key when used as a nested resource
+        self.parent_field = parent_field
+
+    def parse_fields(self, request):
+        """
+        Returns:
+            Tuple of (own field names, {nested field: list of its field names or None})
+        """
+        requested = request.GET.get('fields')
+        if not requested:
+            return self.default_fields, {}
+
+        own = []
+        nested = {}
+        for name in (part.strip() for part in requested.split(',')):
+            if not name:
+                continue
+            head, _, sub = name.partition('.')
+            if head in self.nested:
+                nested.setdefault(head, [])
+                if sub:
+                    nested[head].append(sub)
+            elif name in self.fields:
+                own.append(name)
+            else:
+                raise ApiError(f"Unknown field '{name}'")
+        # Nested objects without sub-fields get their defaults
+        nested = {name: (sub or None) for name, sub in nested.items()}
+        return own or ['id'], nested
+
+    def filter(self, queryset, request):
+        for parameter, lookup in self.filters.items():
+            value = request.GET.get(parameter)
+            if value not in (None, ''):
+                try:
+                    queryset = queryset.filter(**{lookup: value})
+                except (ValueError, ValidationError):
+                    raise ApiError(f"Invalid value for '{parameter}'")
+        return queryset
+
+    def rows(self, queryset, names):
+        lookups = [self.fields[name] for name in names]
+        return [dict(zip(names, values)) for values in queryset.values_list(*lookups)]
+
+    def attach_nested(self, rows, nested):
+        ids = [row['id'] for row in rows]
+        for name, sub_fields in nested.items():
+            child = self.nested[name]
+            names = sub_fields or child.default_fields
+            for field in names:
+                if field not in child.fields:
+                    raise ApiError(f"Unknown field '{name}.{field}'")
+            children = {}
+            queryset = child.model.objects.filter(**{f"{child.parent_field}__in": ids}).order_by('pk')
+            lookups = [child.parent_field] + [child.fields[field] for field in names]
+            for values in queryset.values_list(*lookups):
+                children.setdefault(values[0], []).append(dict(zip(names, values[1:])))
+            for row in rows:
+                row[name] = children.get(row['id'], [])
+
+    def list(self, request):
+        names, nested = self.parse_fields(request)
+        if nested and 'id' not in names:
+            names = ['id'] + names
+        limit = _limit(request, self.DEFAULT_LIMIT, self.MAX_LIMIT)
+
+        queryset = self.filter(self.model.objects.all(), request).order_by('pk')
+        cursor = request.GET.get('cursor')
+        if cursor:
+            queryset = queryset.filter(pk__gt=_decode_cursor(cursor))
+
+        # The primary key drives the cursor even when it is not requested
+        lookups = ['pk'] + [self.fields[name] for name in names]
+        page = list(queryset.values_list(*lookups)[:limit + 1])
+        next_cursor = None
+        if len(page) > limit:
+            page = page[:limit]
+            next_cursor = _encode_cursor(page[-1][0])
+        rows = [dict(zip(names, values[1:])) for values in page]
+
+        if nested:
+            self.attach_nested(rows, nested)
+        return etag_response(request, {'results': rows, 'next_cursor': next_cursor})
+
+    def detail(self, request, pk):
+        names, nested = self.parse_fields(request)
+        if nested and 'id' not in names:
+            names = ['id'] + names
+        rows = self.rows(self.model.objects.filter(pk=pk), names)
+        if not rows:
+            raise ApiError('Not found', status=404)
+        if nested:
+            self.attach_nested(rows, nested)
+        return etag_response(request, rows[0])
+
+
+def _limit(request, default, maximum):
+    try:
+        limit = int(request.GET.get('limit', default))
+    except ValueError:
+        raise ApiError("limit must be an integer")
+    return max(1, min(limit, maximum))
+
+
+def _encode_cursor(pk):
+    return base64.urlsafe_b64encode(str(pk).encode()).decode()
+
+
+def _decode_cursor(cursor):
+    try:
+        return int(base64.urlsafe_b64decode(cursor.encode()).decode())
+    except (ValueError, UnicodeDecodeError):
+        raise ApiError("Invalid cursor")
+
+
+def etag_response(request, data):
+    """
+    JSON response with a strong ETag over its body, or 304 when the client
+    already holds it (If-None-Match)
+    """
+    body = json.dumps(data, cls=DjangoJSONEncoder, ensure_ascii=False).encode()
+    etag = f'"{hashlib.sha1(body).hexdigest()}"'
+    if etag in (tag.strip() for tag in request.META.get('HTTP_IF_NONE_MATCH', '').split(',')):
+        response = HttpResponse(status=304)
+    else:
+        response = HttpResponse(body, content_type='application/json')
+    response['ETag'] = etag
+    response['Cache-Control'] = 'private, no-cache'
+    return response
+
+
+DOCUMENT_LINES = Resource(
+    DocumentProduct,
+    fields={
+        'id': 'id',
+        'product': 'product_id',
+        'product_name': 'product__name',
+        'product_ean': 'product__ean',
+        'amount_required': 'amount_required',
+        'amount_added': 'amount_added',
+        'unit_price': 'unit_price',
+        'cell': 'cell_id',
+        'cell_path': 'cell__path',
+        'expiration_date': 'expiration_date',
+        'serial': 'serial',
+    },
+    default_fields=['id', 'product', 'amount_required', 'amount_added', 'unit_price', 'cell', 'expiration_date', 'serial'],
+    parent_field='document_id',
+)
+
+DOCUMENTS = Resource(
+    Document,
+    fields={
+        'id': 'id',
+        'barcode': 'barcode',
+        'document_number': 'document_number',
+        'document_type': 'document_type__symbol',
+        'document_type_name': 'document_type__name',
+        'origin_department': 'origin_department_id',
+        'origin_department_name': 'origin_department__name',
+        'destinate_department': 'destinate_department_id',
+        'destinate_department_name': 'destinate_department__name',
+        'origin_cell': 'origin_cell_id',
+        'linked_document': 'linked_document_id',
+        'current_status': 'current_status',
+        'total_quantity': 'total_quantity',
+        'total_weight': 'total_weight',
+        'total_price': 'total_price',
+        'priority': 'priority',
+        'carrier': 'carrier',
+        'created_at': 'created_at',
+        'updated_at': 'updated_at',
+        'required_at': 'required_at',
+    },
+    default_fields=['id', 'barcode', 'document_type', 'origin_department', 'destinate_department',
+                    'current_status', 'total_quantity', 'created_at', 'updated_at'],
+    filters={
+        'doc_type': 'document_type__symbol',
+        'department': 'origin_department_id',
+        'status': 'current_status',
+        'updated_since': 'updated_at__gte',
+    },
+    nested={'lines': DOCUMENT_LINES},
+)
+
+STOCK = Resource(
+    Stock,
+    fields={
+        'id': 'id',
+        'product': 'product_id',
+        'product_name': 'product__name',
+        'product_ean': 'product__ean',
+        'cell': 'cell_id',
+        'cell_path': 'cell__path',
+        'department': 'cell__department_id',
+        'warehouse': 'cell__warehouse_id',
+        'expiration_date': 'expiration_date',
+        'serial': 'serial',
+        'quantity': 'quantity',
+        'moved_at': 'moved_at',
+    },
+    default_fields=['id', 'product', 'cell', 'expiration_date', 'serial', 'quantity'],
+    filters={
+        'product': 'product_id',
+        'ean': 'product__ean',
+        'cell': 'cell_id',
+        'department': 'cell__department_id',
+        'warehouse': 'cell__warehouse_id',
+        'moved_since': 'moved_at__gte',
+    },
+)
+
+PRODUCTS = Resource(
+    Product,
+    fields={
+        'id': 'id',
+        'name': 'name',
+        'ean': 'ean',
+        'scu': 'scu',
+        'unit_price': 'unit_price',
+        'weight': 'weight',
+        'description': 'description',
+    },
+    filters={
+        'ean': 'ean',
+        'name': 'name__icontains',
+    },
+)
+
+WAREHOUSES = Resource(
+    Warehouse,
+    fields={
+        'id': 'id',
+        'name': 'name',
+        'code': 'code',
+        'main_department': 'main_department_id',
+    },
+)
+
+DEPARTMENTS = Resource(
+    Department,
+    fields={
+        'id': 'id',
+        'number': 'number',
+        'name': 'name',
+        'warehouse': 'warehouse_id',
+        'default_cell': 'default_cell_id',
+    },
+    filters={
+        'warehouse': 'warehouse_id',
+    },
+)
+
+CELLS = Resource(
+    Cell,
+    fields={
+        'id': 'id',
+        'number': 'number',
+        'barcode': 'barcode',
+        'type': 'type',
+        'path': 'path',
+        'level': 'level_id',
+        'department': 'department_id',
+        'warehouse': 'warehouse_id',
+    },
+    filters={
+        'department': 'department_id',
+        'warehouse': 'warehouse_id',
+        'barcode': 'barcode',
+    },
+)
+
+
+@require_GET
+@api_login_required
+def documents(request):
+    return DOCUMENTS.list(request)
+
+
+@require_GET
+@api_login_required
+def document(request, document_id):
+    return DOCUMENTS.detail(request, document_id)
+
+
+@require_GET
+@api_login_required
+def stock(request):
+    return STOCK.list(request)
+
+
+@require_GET
+@api_login_required
+def products(request):
+    return PRODUCTS.list(request)
+
+
+@require_GET
+@api_login_required
+def product(request, product_id):
+    return PRODUCTS.detail(request, product_id)
+
+
+@require_GET
+@api_login_required
+def warehouses(request):
+    return WAREHOUSES.list(request)
+
+
+@require_GET
+@api_login_required
+def departments(request):
+    return DEPARTMENTS.list(request)
+
+
+@require_GET
+@api_login_required
+def cells(request):
+    return CELLS.list(request)
+
+
+@require_GET
+@api_login_required
+def scan(request):
+    """Resolve ?code= to the product (EAN), cell or document it identifies"""
+    result = ScanService.resolve_scan(request.GET.get('code'))
+    if result is None:
+        return JsonResponse({'type': None, 'error': 'Unknown code'}, status=404)
+    return JsonResponse(result)
+
+
+@require_GET
+@api_login_required
+def lookup(request, kind):
+    """
+    Typeahead for the document form selectors: ?q= plus department (products
+    excepted), for= and status= for documents, warehouse= for users
+    """
+    q = request.GET.get('q', '')
+    limit = _limit(request, LookupService.LIMIT, 100)
+    department_id = _int_param(request, 'department')
+    if kind == 'products':
+        results = LookupService.products(q, limit=limit)
+    elif kind == 'cells':
+        results = LookupService.cells(q, department_id=department_id, limit=limit)
+    elif kind == 'addresses':
+        results = LookupService.addresses(q, limit=limit)
+    elif kind == 'users':
+        results = LookupService.users(q, warehouse_id=_int_param(request, 'warehouse'), limit=limit)
+    elif kind == 'documents':
+        results = LookupService.documents(
+            q,
+            for_symbol=request.GET.get('for'),
+            department_id=department_id,
+            status=request.GET.get('status'),
+            limit=limit
+        )
+    else:
+        raise ApiError(f"Unknown lookup '{kind}'", status=404)
+    return JsonResponse({'results': results})
+
+
+@csrf_exempt
+@require_POST
+@api_login_required
+def import_documents(request):
+    """
+    Import documents from an uploaded CSV, NDJSON or JSON file (field 'file'),
+    see DocumentImporter for the columns. Answers with the created documents
+    and a per-row error report.
+    """
+    rejection = _csrf_rejection(request)
+    if rejection is not None:
+        return rejection
+
+    upload = request.FILES.get('file')
+    if upload is None:
+        raise ApiError("Upload the file in the 'file' field")
+    if request.wms_user is None:
+        raise ApiError('Only warehouse users can import documents', status=403)
+    app_user = AppUser.objects.get(pk=request.wms_user.id)
+
+    format = request.POST.get('format') or DocumentImporter.detect_format(upload.name)
+    if format not in DocumentImporter.FORMATS:
+        raise ApiError(f"Unknown format '{format}'")
+
+    importer = DocumentImporter(app_user, dry_run=request.POST.get('dry_run') == '1')
+    report = importer.run(io.TextIOWrapper(upload, encoding='utf-8-sig', newline=''), format)
+    return JsonResponse(report)
+
+
+def _date_param(request, name):
+    value = request.GET.get(name)
+    if not value:
+        return None
+    try:
+        return datetime.date.fromisoformat(value)
+    except ValueError:
+        raise ApiError(f"Invalid date '{value}' for {name}, use YYYY-MM-DD")
+
+
+def _int_param(request, name):
+    value = request.GET.get(name)
+    if not value:
+        return None
+    try:
+        return int(value)
+    except ValueError:
+        raise ApiError(f"Invalid {name} '{value}'")
+
+
+@require_GET
+@api_login_required
+def export(request, name):
+    """
+    Stream a month-end extract ('documents', 'movements' or 'stock') as CSV,
+    or as XLSX with ?format=xlsx when openpyxl is installed.
+    Filters: from, to (YYYY-MM-DD, inclusive), department, doc_type
+    """
+    extract = EXPORTS.get(name)
+    if extract is None:
+        raise ApiError(f"Unknown export '{name}'", status=404)
+    if request.wms_user is None or not request.wms_user.is_manager:
+        raise ApiError('Only managers can export data', status=403)
+
+    filters = {
+        'date_from': _date_param(request, 'from'),
+        'date_to': _date_param(request, 'to'),
+        'department_id': _int_param(request, 'department'),
+        'doc_type': request.GET.get('doc_type') or None,
+    }
+    if filters['doc_type'] and not extract.document_type_field:
+        raise ApiError(f"The {name} export cannot be filtered by doc_type")
+    filename = f"{name}-{filters['date_from'] or 'start'}-{filters['date_to'] or datetime.date.today()}"
+
+    format = request.GET.get('format', 'csv')
+    if format == 'xlsx':
+        try:
+            file = extract.xlsx_file(**filters)
+        except ExportError as e:
+            raise ApiError(str(e), status=406)
+        return FileResponse(
+            file,
+            as_attachment=True,
+            filename=f"{filename}.xlsx",
+            content_type='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
+        )
+    if format != 'csv':
+        raise ApiError(f"Unknown format '{format}'")
+
+    response = StreamingHttpResponse(extract.csv_lines(**filters), content_type='text/csv; charset=utf-8')
+    response['Content-Disposition'] = f'attachment; filename="{filename}.csv"'
+    return response
+
+
+def _msgpack_default(value):
+    # Same representation of decimals and dates as DjangoJSONEncoder
+    return DjangoJSONEncoder().default(value)
+
+
+@require_GET
+@api_login_required
+def sync(request):
+    """
+    Delta sync for handheld terminals: ?since=<token> returns the products,
+    cells and open documents changed since that token, without it a full snapshot.
+    Send Accept: application/x-msgpack or ?format=msgpack for a msgpack body.
+    """
+    since = request.GET.get('since')
+    if since:
+        try:
+            since = int(since)
+        except ValueError:
+            # Unknown token: fall back to a snapshot
+            since = None
+    else:
+        since = None
+
+    payload = SyncService.get_changes(since)
+
+    wants_msgpack = request.GET.get('format') == 'msgpack' or 'application/x-msgpack' in request.META.get('HTTP_ACCEPT', '')
+    if wants_msgpack:
+        if msgpack is None:
+            raise ApiError('msgpack is not available on this server, use JSON', status=406)
+        return HttpResponse(msgpack.packb(payload, default=_msgpack_default), content_type='application/x-msgpack')
+    return JsonResponse(payload, json_dumps_params={'separators': (',', ':'), 'ensure_ascii': False})
@@ -0,0 +1,10 @@
+from django.apps import AppConfig
+
+
+class WmsprototypeConfig(AppConfig):
+    default_auto_field = 'django.db.models.BigAutoField'
+    name = 'wmsprototype'
+
+    def ready(self):
+        # Connect the signal handlers
+        from . import signals
@@ -0,0 +1,444 @@
+import contextlib
+import datetime
+import io
+import random
+import statistics
+import time
+from decimal import Decimal
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.db import connection, transaction
+from django.test import Client
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+from .models import *
+from .services import (
+    AnalyticsService, BulkDocumentWriter, DocumentService, ScanService, TopologyCache, UserService
+)
+
+
+class BenchmarkError(Exception):
+    pass
+
+
+class SyntheticWarehouse:
+    """
+    Builds a warehouse of configurable size with bulk inserts:
+    departments x rows x sections x levels x cells, a product catalogue,
+    stock buckets spread over the cells and a history of documents.
+
+    Bulk inserts send no signals, so the denormalized cell columns, the
+    topology version and the analytics facts are filled in here.
+    """
+
+    BATCH_SIZE = 1000
+    # Document history mix, as (symbol, weight); issues outnumber receipts
+    HISTORY_SYMBOLS = [
+        ('PZ', 3),
+        ('FV', 6),
+        ('RW-', 1),
+        ('NN+', 1),
+        ('NN-', 1),
+        ('IC-', 1),
+        ('FVO', 2),
+    ]
+
+    def __init__(self, warehouses=1, departments=2, rows=4, sections=5, levels=4, cells=4,
+                 products=1000, stock=5000, documents=2000, lines=10, days=90, seed=0):
+        """
+        Args:
+            warehouses: Number of warehouses
+            departments: Departments per warehouse
+            rows, sections, levels, cells: Rows per department, sections per row,
+                levels per section and cells per level
+            products: Number of products
+            stock: Number of stock buckets (product, cell, expiration date)
+            documents: Number of documents in the history
+            lines: Average lines per document
+            days: Days the history is spread over, ending today
+            seed: Seed of the random generator, the same seed builds the same data
+        """
+        self.sizes = {
+            'warehouses': warehouses,
+            'departments': departments,
+            'rows': rows,
+            'sections': sections,
+            'levels': levels,
+            'cells': cells,
+            'products': products,
+            'stock': stock,
+            'documents': documents,
+            'lines': lines,
+            'days': days,
+        }
+        self.random = random.Random(seed)
+        self.now = timezone.now()
+        self.departments = []
+        self.cell_ids = []
+        self.product_ids = []
+        self.manager = None
+        self.worker = None
+
+    def build(self):
+        """
+        Returns:
+            Dictionary of the row counts created
+        """
+        with transaction.atomic():
+            self._build_topology()
+            self._build_products()
+            self._build_stock()
+            self._build_users()
+        self._build_history()
+        AnalyticsService.rebuild_facts()
+        return {
+            'warehouses': self.sizes['warehouses'],
+            'departments': len(self.departments),
+            'cells': len(self.cell_ids),
+            'products': len(self.product_ids),
+            'stock': Stock.objects.filter(cell_id__in=self.cell_ids).count(),
+            'documents': Document.objects.filter(origin_department__in=self.departments).count(),
+            'document_lines': DocumentProduct.objects.filter(document__origin_department__in=self.departments).count(),
+        }
+
+    def _build_topology(self):
+        sizes = self.sizes
+        address = Address.objects.create(
+            first_line='Benchmark 1', city='Benchmark', postcode='00000', country='SK'
+        )
+        warehouses = Warehouse.objects.bulk_create([
+            Warehouse(name=f'Benchmark {w}', code=f'BENCH-{w}', address=address)
+            for w in range(1, sizes['warehouses'] + 1)
+        ])
+        self.departments = Department.objects.bulk_create([
+            Department(number=f'{w}{d:02d}', name=f'Benchmark {w}/{d}', is_not_topologed=False, warehouse=warehouse)
+            for w, warehouse in enumerate(warehouses, 1)
+            for d in range(1, sizes['departments'] + 1)
+        ])
+        rows = Row.objects.bulk_create([
+            Row(number=r, department=department)
+            for department in self.departments
+            for r in range(1, sizes['rows'] + 1)
+        ], batch_size=self.BATCH_SIZE)
+        sections = Section.objects.bulk_create([
+            Section(number=s, row=row)
+            for row in rows
+            for s in range(1, sizes['sections'] + 1)
+        ], batch_size=self.BATCH_SIZE)
+        levels = Level.objects.bulk_create([
+            Level(number=str(l), section=section)
+            for section in sections
+            for l in range(1, sizes['levels'] + 1)
+        ], batch_size=self.BATCH_SIZE)
+
+        # Department and warehouse are known from the objects created above,
+        # the denormalized columns are written with the cells
+        departments = {department.id: department for department in self.departments}
+        rows_by_id = {row.id: row for row in rows}
+        sections_by_id = {section.id: section for section in sections}
+        cells = []
+        for level in levels:
+            section = sections_by_id[level.section_id]
+            row = rows_by_id[section.row_id]
+            department = departments[row.department_id]
+            for c in range(1, sizes['cells'] + 1):
+                cells.append(Cell(
+                    number=c,
+                    barcode=f'BC{len(cells) + 1:010d}',
+                    type='Shelf',
+                    level=level,
+                    department=department,
+                    warehouse_id=department.warehouse_id,
+                    path=f'{c}-{level.number}-{section.number}-{row.number}-{department.number}',
+                ))
+        cells = Cell.objects.bulk_create(cells, batch_size=self.BATCH_SIZE)
+        self.cell_ids = [cell.id for cell in cells]
+
+        default_cells = {}
+        for cell in cells:
+            default_cells.setdefault(cell.department_id, cell.id)
+        for department in self.departments:
+            department.default_cell_id = default_cells.get(department.id)
+        Department.objects.bulk_update(self.departments, ['default_cell'])
+        for warehouse in warehouses:
+            warehouse.main_department = next(d for d in self.departments if d.warehouse_id == warehouse.id)
+        Warehouse.objects.bulk_update(warehouses, ['main_department'])
+        TopologyCache.bump_version()
+
+    def _build_products(self):
+        products = Product.objects.bulk_create([
+            Product(
+                name=f'Benchmark product {p:07d}',
+                unit_price=Decimal(self.random.randint(10, 20000)) / 100,
+                weight=self.random.randint(50, 5000),
+                ean=f'29{p:011d}',
+                scu=f'BENCH{p:07d}',
+            )
+            for p in range(1, self.sizes['products'] + 1)
+        ], batch_size=self.BATCH_SIZE)
+        self.product_ids = [product.id for product in products]
+
+    def _build_stock(self):
+        buckets = set()
+        wanted = min(self.sizes['stock'], len(self.product_ids) * len(self.cell_ids))
+        today = self.now.date()
+        while len(buckets) < wanted:
+            expiration_date = None
+            if self.random.random() < 0.5:
+                expiration_date = today + datetime.timedelta(days=self.random.randint(-10, 180))
+            buckets.add((self.random.choice(self.product_ids), self.random.choice(self.cell_ids), expiration_date))
+
+        stock = []
+        for product_id, cell_id, expiration_date in buckets:
+            placed_at = self.now - datetime.timedelta(days=self.random.randint(0, self.sizes['days']))
+            stock.append(Stock(
+                product_id=product_id,
+                cell_id=cell_id,
+                expiration_date=expiration_date,
+                quantity=self.random.randint(1, 200),
+                placed_at=placed_at,
+                moved_at=placed_at,
+                checked_at=placed_at,
+            ))
+        Stock.objects.bulk_create(stock, batch_size=self.BATCH_SIZE)
+
+    def _build_users(self):
+        warehouse_id = self.departments[0].warehouse_id
+        for role, name in (('ZAM', 'manager'), ('PRC', 'worker')):
+            user = User.objects.create_user(username=f'benchmark_{name}', password=None)
+            app_user = AppUser.objects.create(user=user, role=role, warehouse_id=warehouse_id)
+            setattr(self, name, app_user)
+
+    def _build_history(self):
+        """Spread the document history over the last days, one BulkDocumentWriter batch per day"""
+        count = self.sizes['documents']
+        days = max(self.sizes['days'], 1)
+        symbols, weights = zip(*self.HISTORY_SYMBOLS)
+        document_types = {symbol: DocumentService.get_document_type(symbol) for symbol in symbols}
+        prices = dict(Product.objects.filter(id__in=self.product_ids).values_list('id', 'unit_price'))
+        cells_by_department = {}
+        for cell_id, department_id in Cell.objects.filter(id__in=self.cell_ids).values_list('id', 'department_id'):
+            cells_by_department.setdefault(department_id, []).append(cell_id)
+
+        # Documents are not posted, the stock built above stands for their
+        # result; stock documents are only marked posted for the analytics facts
+        writer = BulkDocumentWriter(self.manager, post=False)
+        for day in range(days):
+            batch = []
+            for i in range(count * (day + 1) // days - count * day // days):
+                department = self.random.choice(self.departments)
+                document = Document(
+                    document_type=document_types[self.random.choices(symbols, weights)[0]],
+                    origin_department=department,
+                    created_by=self.random.choice([self.manager, self.worker]),
+                )
+                lines = []
+                for j in range(self.random.randint(1, max(2 * self.sizes['lines'] - 1, 1))):
+                    product_id = self.random.choice(self.product_ids)
+                    quantity = self.random.randint(1, 50)
+                    lines.append(DocumentProduct(
+                        product_id=product_id,
+                        amount_required=quantity,
+                        amount_added=quantity,
+                        cell_id=self.random.choice(cells_by_department[department.id]),
+                        unit_price=prices[product_id],
+                    ))
+                batch.append((document, lines))
+            created_at = self.now - datetime.timedelta(days=days - 1 - day, minutes=self.random.randint(0, 600))
+            for document, lines in batch:
+                if document.document_type.group == 'Sklád':
+                    document.posted_at = created_at
+            writer.write(batch, now=created_at)
+
+
+class Benchmark:
+    """
+    Times the key paths against a SyntheticWarehouse and counts their queries.
+
+    Views are requested through the test Client as the warehouse's manager,
+    services are called directly. Each case is set up outside the timed
+    section, run `warmup` times untimed and then `iterations` times.
+    """
+
+    CASES = [
+        'create_document',
+        'apply_changes',
+        'close_inventory',
+        'list_documents',
+        'list_documents_filtered',
+        'view_product',
+        'analytics',
+        'analytics_cached',
+    ]
+
+    def __init__(self, warehouse, iterations=10, warmup=1, lines=None, seed=0):
+        """
+        Args:
+            warehouse: Built SyntheticWarehouse
+            iterations: Timed runs per case
+            warmup: Untimed runs per case, filling the process caches
+            lines: Lines of the created and posted documents (default: the warehouse's average)
+            seed: Seed of the random generator
+        """
+        self.warehouse = warehouse
+        self.iterations = iterations
+        self.warmup = warmup
+        self.lines = lines or warehouse.sizes['lines']
+        self.random = random.Random(seed)
+        self.client = Client()
+        self.client.force_login(warehouse.manager.user)
+        self.stock = list(Stock.objects.filter(
+            cell_id__in=warehouse.cell_ids
+        ).values_list('product_id', 'cell_id', 'cell__department_id'))
+        if not self.stock:
+            raise BenchmarkError('The warehouse has no stock to benchmark with')
+
+    def run(self, cases=None):
+        """
+        Returns:
+            Dictionary of case name -> timings in milliseconds and query counts
+        """
+        results = {}
+        for name in cases or self.CASES:
+            if name not in self.CASES:
+                raise BenchmarkError(f'Unknown benchmark case {name}')
+            results[name] = self.measure(getattr(self, f'case_{name}'))
+        return results
+
+    def measure(self, case):
+        """
+        Run a case, which returns the callable to time after its untimed setup
+
+        Returns:
+            Dictionary with the run count, latency percentiles and query counts
+        """
+        timings = []
+        queries = []
+        for i in range(self.warmup + self.iterations):
+            timed = case()
+            with CaptureQueriesContext(connection) as captured:
+                start = time.perf_counter()
+                # The views still print debug lines, keep them out of the report
+                with contextlib.redirect_stdout(io.StringIO()):
+                    timed()
+                elapsed = time.perf_counter() - start
+            if i >= self.warmup:
+                timings.append(elapsed * 1000)
+                queries.append(len(captured))
+
+        timings.sort()
+        return {
+            'iterations': len(timings),
+            'min_ms': round(timings[0], 3),
+            'median_ms': round(statistics.median(timings), 3),
+            'p95_ms': round(timings[min(len(timings) - 1, int(len(timings) * 0.95))], 3),
+            'max_ms': round(timings[-1], 3),
+            'mean_ms': round(statistics.fmean(timings), 3),
+            'queries': statistics.median_low(queries),
+            'queries_max': max(queries),
+        }
+
+    def _get(self, url, data=None):
+        response = self.client.get(url, data)
+        if response.status_code != 200:
+            raise BenchmarkError(f'GET {url} returned {response.status_code}')
+
+    def _stock_lines(self, department_id=None):
+        stock = [row for row in self.stock if department_id is None or row[2] == department_id] or self.stock
+        return [self.random.choice(stock) for i in range(self.lines)]
+
+    def case_create_document(self):
+        """POST a PZ receipt with its lines through the document form, posting included"""
+        department = self.random.choice(self.warehouse.departments)
+        data = {
+            'origin_department': department.id,
+            'description': 'Benchmark',
+            'documentproduct_set-TOTAL_FORMS': self.lines,
+            'documentproduct_set-INITIAL_FORMS': 0,
+            'documentproduct_set-MIN_NUM_FORMS': 0,
+            'documentproduct_set-MAX_NUM_FORMS': 1000,
+        }
+        for i, (product_id, cell_id, department_id) in enumerate(self._stock_lines(department.id)):
+            data.update({
+                f'documentproduct_set-{i}-product': product_id,
+                f'documentproduct_set-{i}-amount_required': 5,
+                f'documentproduct_set-{i}-amount_added': 5,
+                f'documentproduct_set-{i}-cell': cell_id,
+                f'documentproduct_set-{i}-unit_price': '1.00',
+            })
+        url = reverse('create_specific_document', kwargs={'doc_type': 'PZ'})
+        last_id = Document.objects.order_by('-id').values_list('id', flat=True).first()
+
+        def timed():
+            response = self.client.post(url, data)
+            if response.status_code != 200 or not Document.objects.filter(id__gt=last_id or 0).exists():
+                raise BenchmarkError(f'POST {url} did not create a document')
+        return timed
+
+    def case_apply_changes(self):
+        """Post an unposted FV issue to stock"""
+        department = self.random.choice(self.warehouse.departments)
+        lines = [
+            DocumentProduct(product_id=product_id, cell_id=cell_id, amount_required=1, amount_added=1, unit_price=Decimal('1.00'))
+            for product_id, cell_id, department_id in self._stock_lines(department.id)
+        ]
+        document, = BulkDocumentWriter(self.warehouse.manager, post=False).write([
+            (Document(document_type=DocumentService.get_document_type('FV'), origin_department=department), lines)
+        ])
+        return lambda: DocumentService.apply_changes(document)
+
+    def case_close_inventory(self):
+        """Close an ICO count of a stocked cell where every other line deviates"""
+        product_id, cell_id, department_id = self.random.choice(self.stock)
+        request = self._request()
+        document = DocumentService.prepare_document_for_first_save(Document(
+            document_type=DocumentService.get_document_type('ICO'),
+            origin_department_id=department_id,
+            origin_cell_id=cell_id,
+            created_by=self.warehouse.manager,
+        ), request=request)
+        # Count the lines the way the count screen saves them, so the signals
+        # keep the document totals in step
+        with DocumentService.collect_totals():
+            for i, line in enumerate(document.documentproduct_set.order_by('id')):
+                line.document = document
+                line.amount_added = line.amount_required + (0 if i % 2 == 0 else 1 if i % 4 == 1 else -1)
+                line.save()
+        return lambda: DocumentService.close_inventory(document, request)
+
+    def case_list_documents(self):
+        return lambda: self._get(reverse('list_documents'))
+
+    def case_list_documents_filtered(self):
+        params = {
+            'doc_type': DocumentService.get_document_type('FV').id,
+            'department': self.random.choice(self.warehouse.departments).id,
+        }
+        return lambda: self._get(reverse('list_documents'), params)
+
+    def case_view_product(self):
+        product_id, cell_id, department_id = self.random.choice(self.stock)
+        return lambda: self._get(reverse('view_product', kwargs={'product_id': product_id}))
+
+    def case_analytics(self):
+        """Dashboard with the widgets recomputed"""
+        cache.clear()
+        return lambda: self._get(reverse('analytics'))
+
+    def case_analytics_cached(self):
+        return lambda: self._get(reverse('analytics'))
+
+    def _request(self):
+        """Stand-in for the request services take the acting user from"""
+        user = self.warehouse.manager.user
+        return type('BenchmarkRequest', (), {'user': user, 'wms_user': UserService.resolve(user)})()
+
+
+def reset_caches():
+    """Drop process and shared caches, which may hold rows the benchmark rolled back"""
+    cache.clear()
+    TopologyCache.invalidate()
+    ScanService._cache.clear()
+    UserService._cache.clear()
+    DocumentService._document_types.clear()
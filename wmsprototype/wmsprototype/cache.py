@@ -0,0 +1,194 @@
+import threading
+import time
+from collections import OrderedDict
+from django.conf import settings
+from django.core.cache import cache
+
+
+class WidgetCache:
+    """
+    Cache for dashboard widgets with a per-widget TTL and stale-while-revalidate semantics.
+
+    Each entry is stored as (value, fresh_until, generation) and kept well past
+    its TTL. When an entry turns stale, the first request to take the widget's
+    lock recomputes it while every other request keeps serving the stale value,
+    so a burst of logins costs one aggregation instead of one per user. Only a
+    cold entry makes the other requests wait, briefly, for the one computing it.
+
+    Document posting bumps a global generation, which marks every entry stale
+    without dropping it. Only cache.get/set/add/incr/delete are used, so it
+    works with the locmem, file, database and memcached/redis backends alike.
+    Entries, locks and the generation are shared only by the processes that
+    share the backend: with the default LocMemCache every worker process has
+    its own, and a posting in one worker leaves the others serving their
+    widgets until the TTL runs out.
+
+    TTLs in seconds can be overridden per widget with the WMS_WIDGET_TTLS setting.
+    """
+
+    TTLS = {
+        'suspicious_operations': 60,
+        'daily_minus_totals': 300,
+        'daily_fv_totals': 300,
+        'product_freshness': 120,
+        'open_documents': 30,
+    }
+    DEFAULT_TTL = 60
+    # How long stale values stay servable after their TTL
+    STALE_GRACE = 600
+    # Upper bound for one recomputation; an expired lock lets another request retry
+    LOCK_TIMEOUT = 30
+    # How long requests wait for a cold entry someone else is computing
+    COLD_WAIT = 2.0
+    COLD_POLL_INTERVAL = 0.05
+
+    KEY_PREFIX = 'wms:widget'
+    GENERATION_KEY = 'wms:widget:generation'
+
+    @classmethod
+    def ttl(cls, widget):
+        overrides = getattr(settings, 'WMS_WIDGET_TTLS', {})
+        return overrides.get(widget, cls.TTLS.get(widget, cls.DEFAULT_TTL))
+
+    @classmethod
+    def key(cls, widget, warehouse_id, role):
+        return f"{cls.KEY_PREFIX}:{widget}:{warehouse_id}:{role}"
+
+    @classmethod
+    def generation(cls):
+        generation = cache.get(cls.GENERATION_KEY)
+        if generation is None:
+            cache.add(cls.GENERATION_KEY, 1, timeout=None)
+            generation = cache.get(cls.GENERATION_KEY, 1)
+        return generation
+
+    @classmethod
+    def invalidate(cls):
+        """Mark every widget stale, e.g. after a document was posted"""
+        try:
+            cache.incr(cls.GENERATION_KEY)
+        except ValueError:
+            # Key evicted or never set: any new value differs from the stored generations
+            cache.set(cls.GENERATION_KEY, time.time_ns(), timeout=None)
+
+    @classmethod
+    def get(cls, widget, compute, warehouse_id=None, role=None):
+        """
+        Get a widget's value, recomputing it with compute() when stale
+
+        Args:
+            widget: Widget name, also selects the TTL
+            compute: Callable returning the widget value; it must be picklable
+            warehouse_id: Warehouse the value is computed for
+            role: AppUser role the value is computed for
+
+        Returns:
+            The cached or freshly computed value
+        """
+        key = cls.key(widget, warehouse_id, role)
+        generation = cls.generation()
+        entry = cache.get(key)
+
+        if entry is not None:
+            value, fresh_until, entry_generation = entry
+            if fresh_until > time.time() and entry_generation == generation:
+                return value
+            if not cache.add(f"{key}:lock", 1, timeout=cls.LOCK_TIMEOUT):
+                # Someone else is recomputing, serve the stale value meanwhile
+                return value
+            return cls._recompute(widget, key, compute, generation)
+
+        if cache.add(f"{key}:lock", 1, timeout=cls.LOCK_TIMEOUT):
+            return cls._recompute(widget, key, compute, generation)
+
+        # Cold entry being computed by another request: wait for it, then give up
+        deadline = time.monotonic() + cls.COLD_WAIT
+        while time.monotonic() < deadline:
+            time.sleep(cls.COLD_POLL_INTERVAL)
+            entry = cache.get(key)
+            if entry is not None:
+                return entry[0]
+        return compute()
+
+    @classmethod
+    def _recompute(cls, widget, key, compute, generation):
+        try:
+            value = compute()
+            ttl = cls.ttl(widget)
+            cache.set(key, (value, time.time() + ttl, generation), timeout=ttl + cls.STALE_GRACE)
+            return value
+        finally:
+            cache.delete(f"{key}:lock")
+
+
+class LRUCache:
+    """
+    Thread-safe in-process LRU cache with an optional per-entry TTL.
+
+    Entries can carry a tag, e.g. the model and primary key they were built
+    from, so that everything derived from an object can be evicted when it
+    changes without knowing the keys it was cached under.
+    """
+
+    def __init__(self, maxsize=10000, ttl=None):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._tags = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key, default=None):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return default
+            value, expires_at, tag = entry
+            if expires_at is not None and expires_at < time.monotonic():
+                self._remove(key)
+                self.misses += 1
+                return default
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def set(self, key, value, tag=None):
+        expires_at = time.monotonic() + self.ttl if self.ttl is not None else None
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key] = (value, expires_at, tag)
+            if tag is not None:
+                self._tags.setdefault(tag, set()).add(key)
+            while len(self._entries) > self.maxsize:
+                self._remove(next(iter(self._entries)))
+
+    def delete(self, key):
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+
+    def delete_tag(self, tag):
+        """Evict every entry stored with this tag"""
+        with self._lock:
+            for key in list(self._tags.get(tag, ())):
+                self._remove(key)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._tags.clear()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def _remove(self, key):
+        value, expires_at, tag = self._entries.pop(key)
+        if tag is not None:
+            keys = self._tags.get(tag)
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del self._tags[tag]
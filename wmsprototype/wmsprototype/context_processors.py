@@ -0,0 +1,7 @@
+def wms_user(request):
+    """Add the request's WmsUser and whether it is a manager to every template"""
+    wms_user = getattr(request, 'wms_user', None)
+    return {
+        'wms_user': wms_user,
+        'is_current_user_manager': wms_user is not None and wms_user.is_manager,
+    }
@@ -0,0 +1,213 @@
+import csv
+import datetime
+import tempfile
+from django.db.models import Case, CharField, F, IntegerField, When
+from django.utils import timezone
+from .models import *
+from .services import PostingEngine
+
+try:
+    import openpyxl
+except ImportError:
+    openpyxl = None
+
+
+class ExportError(Exception):
+    pass
+
+
+class Echo:
+    """File-like object whose write() hands the line back, for csv.writer in a generator"""
+
+    def write(self, value):
+        return value
+
+
+class Export:
+    """
+    A tabular extract read with values_list(...).iterator(), so rows come from
+    the database in chunks as tuples and are written out as they arrive.
+
+    columns: list of (header, lookup)
+    date_field: lookup the --from/--to range applies to
+    department_field: lookup the department filter applies to
+    """
+
+    CHUNK_SIZE = 5000
+
+    def __init__(self, name, queryset, columns, date_field, department_field, document_type_field=None):
+        self.name = name
+        self.queryset = queryset
+        self.columns = columns
+        self.date_field = date_field
+        self.department_field = department_field
+        self.document_type_field = document_type_field
+
+    @property
+    def headers(self):
+        return [header for header, lookup in self.columns]
+
+    def rows(self, date_from=None, date_to=None, department_id=None, doc_type=None):
+        """
+        Yield the rows as tuples, datetimes converted to local time
+
+        Args:
+            date_from: First day (inclusive)
+            date_to: Last day (inclusive)
+            department_id: Only rows of this department
+            doc_type: Only rows of documents of this type symbol
+        """
+        queryset = self.queryset()
+        # Compare against local day boundaries so the date index stays usable
+        if date_from:
+            queryset = queryset.filter(**{f"{self.date_field}__gte": _start_of_day(date_from)})
+        if date_to:
+            queryset = queryset.filter(**{f"{self.date_field}__lt": _start_of_day(date_to + datetime.timedelta(days=1))})
+        if department_id:
+            queryset = queryset.filter(**{self.department_field: department_id})
+        if doc_type:
+            if not self.document_type_field:
+                raise ExportError(f"The {self.name} export cannot be filtered by document type")
+            queryset = queryset.filter(**{self.document_type_field: doc_type})
+
+        lookups = [lookup for header, lookup in self.columns]
+        for row in queryset.values_list(*lookups).iterator(chunk_size=self.CHUNK_SIZE):
+            yield tuple(
+                timezone.localtime(value).strftime('%Y-%m-%d %H:%M:%S') if isinstance(value, datetime.datetime) else value
+                for value in row
+            )
+
+    def csv_lines(self, **filters):
+        """Yield the export as CSV text, header first, one line at a time"""
+        writer = csv.writer(Echo())
+        yield writer.writerow(self.headers)
+        for row in self.rows(**filters):
+            yield writer.writerow(row)
+
+    def write_csv(self, stream, **filters):
+        for line in self.csv_lines(**filters):
+            stream.write(line)
+
+    def write_xlsx(self, path, **filters):
+        """
+        Write the export as an XLSX file using openpyxl's write-only mode,
+        which flushes rows to disk instead of building the sheet in memory
+        """
+        if openpyxl is None:
+            raise ExportError('XLSX export needs the openpyxl package, use CSV instead')
+        workbook = openpyxl.Workbook(write_only=True)
+        sheet = workbook.create_sheet(self.name)
+        sheet.append(self.headers)
+        for row in self.rows(**filters):
+            sheet.append(row)
+        workbook.save(path)
+
+    def xlsx_file(self, **filters):
+        """Write the XLSX to a temporary file and return it opened for reading"""
+        file = tempfile.TemporaryFile(suffix='.xlsx')
+        self.write_xlsx(file, **filters)
+        file.seek(0)
+        return file
+
+
+def _start_of_day(date):
+    return timezone.make_aware(datetime.datetime.combine(date, datetime.time.min))
+
+
+def _signed_quantity():
+    # Receipts add to stock, issues take from it; other documents do not move stock
+    return Case(
+        When(document__document_type__symbol__in=PostingEngine.RECEIPT_SYMBOLS, then=F('amount_required')),
+        When(document__document_type__symbol__in=PostingEngine.ISSUE_SYMBOLS, then=-F('amount_required')),
+        default=0,
+        output_field=IntegerField()
+    )
+
+
+def _posting_cell_path():
+    # The cell PostingEngine moves the stock in: BO and WM+ go to the
+    # department's default cell, everything else to the line's cell
+    return Case(
+        When(
+            document__document_type__symbol__in=PostingEngine.DEFAULT_CELL_SYMBOLS,
+            then=F('document__origin_department__default_cell__path')
+        ),
+        default=F('cell__path'),
+        output_field=CharField()
+    )
+
+
+DOCUMENT_LINE_COLUMNS = [
+    ('document_id', 'document_id'),
+    ('barcode', 'document__barcode'),
+    ('document_type', 'document__document_type__symbol'),
+    ('status', 'document__current_status'),
+    ('created_at', 'document__created_at'),
+    ('origin_department', 'document__origin_department__number'),
+    ('destinate_department', 'document__destinate_department__number'),
+    ('product_id', 'product_id'),
+    ('ean', 'product__ean'),
+    ('product', 'product__name'),
+    ('amount_required', 'amount_required'),
+    ('amount_added', 'amount_added'),
+    ('unit_price', 'unit_price'),
+    ('cell', 'cell__path'),
+    ('expiration_date', 'expiration_date'),
+    ('serial', 'serial'),
+]
+
+EXPORTS = {
+    'documents': Export(
+        'documents',
+        lambda: DocumentProduct.objects.order_by('document__created_at', 'document_id', 'id'),
+        DOCUMENT_LINE_COLUMNS,
+        date_field='document__created_at',
+        department_field='document__origin_department_id',
+        document_type_field='document__document_type__symbol',
+    ),
+    'movements': Export(
+        'movements',
+        lambda: DocumentProduct.objects.filter(
+            document__document_type__symbol__in=PostingEngine.RECEIPT_SYMBOLS + PostingEngine.ISSUE_SYMBOLS
+        ).annotate(
+            movement=_signed_quantity(),
+            posting_cell=_posting_cell_path()
+        ).order_by('document__created_at', 'document_id', 'id'),
+        [
+            ('created_at', 'document__created_at'),
+            ('barcode', 'document__barcode'),
+            ('document_type', 'document__document_type__symbol'),
+            ('department', 'document__origin_department__number'),
+            ('ean', 'product__ean'),
+            ('product', 'product__name'),
+            ('cell', 'posting_cell'),
+            ('expiration_date', 'expiration_date'),
+            ('serial', 'serial'),
+            ('quantity', 'movement'),
+            ('unit_price', 'unit_price'),
+        ],
+        date_field='document__created_at',
+        department_field='document__origin_department_id',
+        document_type_field='document__document_type__symbol',
+    ),
+    'stock': Export(
+        'stock',
+        lambda: Stock.objects.filter(quantity__gt=0).order_by('cell__path', 'product_id', 'expiration_date', 'serial'),
+        [
+            ('warehouse', 'cell__warehouse__name'),
+            ('department', 'cell__department__number'),
+            ('cell', 'cell__path'),
+            ('cell_barcode', 'cell__barcode'),
+            ('ean', 'product__ean'),
+            ('product', 'product__name'),
+            ('expiration_date', 'expiration_date'),
+            ('serial', 'serial'),
+            ('quantity', 'quantity'),
+            ('unit_price', 'product__unit_price'),
+            ('placed_at', 'placed_at'),
+            ('moved_at', 'moved_at'),
+        ],
+        date_field='moved_at',
+        department_field='cell__department_id',
+    ),
+}
@@ -1,5 +1,7 @@
 from django import forms
 from django.contrib.auth.forms import AuthenticationForm
+from django.core.exceptions import ValidationError
+from django.urls import reverse
 from .models import Document, DocumentProduct, Status, AppUser, Department, Product
 
 
@@ -13,6 +15,39 @@ class LoginForm(AuthenticationForm):
     )
 
 
+class LookupSelect(forms.Select):
+    """
+    Select that renders only its selected option instead of the whole
+    queryset; the page fills in the other options from the typeahead
+    endpoint (api_lookup) named by data-lookup. The field still validates
+    the submitted id against its queryset, one row at a time.
+    """
+
+    def __init__(self, lookup, attrs=None):
+        super().__init__(attrs)
+        self.lookup = lookup
+
+    def get_context(self, name, value, attrs):
+        context = super().get_context(name, value, attrs)
+        context['widget']['attrs']['data-lookup'] = reverse('api_lookup', args=[self.lookup])
+        return context
+
+    def optgroups(self, name, value, attrs=None):
+        choices = self.choices
+        selected = [v for v in value if v not in (None, '')]
+        options = [('', choices.field.empty_label or '')]
+        if selected:
+            try:
+                options += [choices.choice(obj) for obj in choices.queryset.filter(pk__in=selected)]
+            except (ValueError, ValidationError):
+                pass
+        self.choices = options
+        try:
+            return super().optgroups(name, value, attrs)
+        finally:
+            self.choices = choices
+
+
 class DocumentForm(forms.ModelForm):
     """Form for Document model with improved validation and layout"""
     
@@ -33,6 +68,11 @@ class DocumentForm(forms.ModelForm):
         widgets = {
             'description': forms.Textarea(attrs={'rows': 3}),
             'required_at': forms.DateTimeInput(attrs={'type': 'datetime-local'}),
+            'address': LookupSelect('addresses'),
+            'verified_by': LookupSelect('users'),
+            'origin_cell': LookupSelect('cells'),
+            'destinate_cell': LookupSelect('cells'),
+            'linked_document': LookupSelect('documents'),
         }
     
     def __init__(self, *args, **kwargs):
@@ -120,7 +160,7 @@ class DocumentProductForm(forms.ModelForm):
     
     product = forms.ModelChoiceField(
         queryset=Product.objects.all(),
-        widget=forms.Select(attrs={'class': 'form-select product-select'})
+        widget=LookupSelect('products', attrs={'class': 'form-select product-select'})
     )
     
     class Meta:
@@ -132,6 +172,7 @@ class DocumentProductForm(forms.ModelForm):
             'expiration_date': forms.DateInput(attrs={'type': 'date', 'class': 'form-control'}),
             'serial': forms.TextInput(attrs={'class': 'form-control'}),
             'unit_price': forms.NumberInput(attrs={'class': 'form-control', 'step': '0.01'}),
+            'cell': LookupSelect('cells', attrs={'class': 'form-select'}),
         }
 
 
@@ -0,0 +1,306 @@
+import csv
+import datetime
+import json
+from decimal import Decimal, InvalidOperation
+from django.db import DatabaseError
+from .models import *
+from .services import BulkDocumentWriter, DocumentService, PostingEngine
+
+
+class ImportRowError(Exception):
+    pass
+
+
+class DocumentImporter:
+    """
+    Imports documents such as supplier advance notices (PZ) or customer
+    orders (FVO) from CSV or JSON, one document line per row.
+
+    Columns:
+        reference            groups rows into documents; rows of one document must be contiguous
+        document_type        document type symbol, e.g. PZ or FVO
+        origin_department    department number
+        destinate_department department number (optional)
+        description          (optional)
+        ean                  product EAN
+        quantity             positive integer
+        cell                 cell barcode (optional, defaults to the department's default cell)
+        expiration_date      YYYY-MM-DD (optional)
+        serial               (optional)
+        unit_price           (optional, defaults to the product's price)
+
+    Rows are read one at a time and checked against product, cell and
+    department maps loaded once, so the file is never held in memory.
+    Valid documents are written by BulkDocumentWriter in chunks, each in its
+    own transaction. A document with an invalid row is skipped and reported
+    with all its rows; the rest of the file is still imported.
+    """
+
+    FORMATS = ['csv', 'ndjson', 'json']
+    # Counted from stock, not imported
+    REJECTED_SYMBOLS = ["ICO", "IPO"]
+    CHUNK_DOCUMENTS = 200
+    CHUNK_LINES = 5000
+
+    def __init__(self, user, post=True, dry_run=False, chunk_documents=CHUNK_DOCUMENTS):
+        """
+        Args:
+            user: AppUser the documents are created by
+            post: Post imported Sklád documents to stock
+            dry_run: Only validate, write nothing
+            chunk_documents: Documents per transaction
+        """
+        self.writer = BulkDocumentWriter(user, post=post)
+        self.dry_run = dry_run
+        self.chunk_documents = chunk_documents
+        self.created = []
+        self.errors = []
+        self.rows = 0
+
+        self.products = {
+            ean: (product_id, unit_price)
+            for ean, product_id, unit_price in Product.objects.exclude(ean=None).values_list('ean', 'id', 'unit_price')
+        }
+        self.cells = {
+            barcode: (cell_id, department_id)
+            for barcode, cell_id, department_id in Cell.objects.exclude(barcode=None).values_list('barcode', 'id', 'department_id')
+        }
+        self.departments = {
+            department.number: department
+            for department in Department.objects.select_related('warehouse')
+        }
+
+    # Parsing
+
+    @staticmethod
+    def detect_format(filename):
+        extension = filename.rsplit('.', 1)[-1].lower()
+        if extension in ('ndjson', 'jsonl'):
+            return 'ndjson'
+        return extension if extension in DocumentImporter.FORMATS else 'csv'
+
+    @staticmethod
+    def read_rows(stream, format):
+        """
+        Yield (row number, dict) from a text stream
+
+        CSV and NDJSON (one object per line) are parsed incrementally;
+        a JSON array is loaded in one piece.
+        """
+        if format == 'csv':
+            for number, row in enumerate(csv.DictReader(stream), start=2):
+                yield number, row
+        elif format == 'ndjson':
+            for number, line in enumerate(stream, start=1):
+                if line.strip():
+                    try:
+                        yield number, json.loads(line)
+                    except json.JSONDecodeError as e:
+                        yield number, ImportRowError(f"Invalid JSON: {e.msg}")
+        else:
+            for number, row in enumerate(json.load(stream), start=1):
+                yield number, row
+
+    # Validation
+
+    @staticmethod
+    def _value(row, column):
+        value = row.get(column)
+        if value is None:
+            return ''
+        return str(value).strip()
+
+    def _department(self, number, column):
+        department = self.departments.get(number)
+        if department is None:
+            raise ImportRowError(f"Unknown {column} '{number}'")
+        return department
+
+    def parse_header(self, row):
+        """Build the unsaved Document from the first row of a reference"""
+        symbol = self._value(row, 'document_type')
+        if symbol in self.REJECTED_SYMBOLS:
+            raise ImportRowError(f"{symbol} documents are generated from stock and cannot be imported")
+        try:
+            document_type = DocumentService.get_document_type(symbol)
+        except DocumentType.DoesNotExist:
+            raise ImportRowError(f"Unknown document_type '{symbol}'")
+
+        destinate = self._value(row, 'destinate_department')
+        return Document(
+            document_type = document_type,
+            origin_department = self._department(self._value(row, 'origin_department'), 'origin_department'),
+            destinate_department = self._department(destinate, 'destinate_department') if destinate else None,
+            description = self._value(row, 'description') or None
+        )
+
+    def parse_line(self, row, document):
+        """Build the unsaved DocumentProduct of a row"""
+        ean = self._value(row, 'ean')
+        if ean not in self.products:
+            raise ImportRowError(f"Unknown product EAN '{ean}'")
+        product_id, unit_price = self.products[ean]
+
+        try:
+            quantity = int(self._value(row, 'quantity'))
+        except ValueError:
+            raise ImportRowError(f"Invalid quantity '{self._value(row, 'quantity')}'")
+        if quantity <= 0:
+            raise ImportRowError("quantity must be positive")
+
+        barcode = self._value(row, 'cell')
+        if barcode:
+            if barcode not in self.cells:
+                raise ImportRowError(f"Unknown cell '{barcode}'")
+            cell_id, department_id = self.cells[barcode]
+            if department_id != document.origin_department_id:
+                raise ImportRowError(f"Cell '{barcode}' is not in department {document.origin_department.number}")
+        else:
+            cell_id = document.origin_department.default_cell_id
+            symbol = document.document_type.symbol
+            posts_to_cell = symbol in PostingEngine.RECEIPT_SYMBOLS + PostingEngine.ISSUE_SYMBOLS
+            if cell_id is None and posts_to_cell and symbol not in PostingEngine.DEFAULT_CELL_SYMBOLS:
+                raise ImportRowError("cell is required, the department has no default cell")
+
+        expiration_date = self._value(row, 'expiration_date')
+        if expiration_date:
+            try:
+                expiration_date = datetime.date.fromisoformat(expiration_date)
+            except ValueError:
+                raise ImportRowError(f"Invalid expiration_date '{expiration_date}'")
+
+        price = self._value(row, 'unit_price')
+        if price:
+            try:
+                unit_price = Decimal(price)
+            except InvalidOperation:
+                raise ImportRowError(f"Invalid unit_price '{price}'")
+
+        return DocumentProduct(
+            product_id = product_id,
+            amount_required = quantity,
+            cell_id = cell_id,
+            expiration_date = expiration_date or None,
+            serial = self._value(row, 'serial') or None,
+            unit_price = unit_price
+        )
+
+    # Import
+
+    def run(self, stream, format='csv'):
+        """
+        Import a file
+
+        Args:
+            stream: Text stream of the file
+            format: 'csv', 'ndjson' or 'json'
+
+        Returns:
+            Dictionary with the number of rows read, the created documents
+            (reference, id, barcode) and the row errors (row, reference, error)
+        """
+        pending = []
+        pending_lines = 0
+        seen = set()
+        current = None
+
+        def close(group):
+            nonlocal pending_lines
+            if group is None:
+                return
+            if group['errors']:
+                for number, message in group['errors']:
+                    self.errors.append({'row': number, 'reference': group['reference'], 'error': message})
+                # Rows that were fine still belong to a rejected document
+                failed = {number for number, message in group['errors']}
+                for number in group['rows']:
+                    if number not in failed:
+                        self.errors.append({'row': number, 'reference': group['reference'], 'error': 'Document rejected because of other rows'})
+                return
+            pending.append(group)
+            pending_lines += len(group['lines'])
+
+        try:
+            for number, row in self.read_rows(stream, format):
+                self.rows += 1
+                if isinstance(row, ImportRowError):
+                    self.errors.append({'row': number, 'reference': None, 'error': str(row)})
+                    continue
+                if not isinstance(row, dict):
+                    self.errors.append({'row': number, 'reference': None, 'error': 'Row is not an object'})
+                    continue
+
+                reference = self._value(row, 'reference')
+                if not reference:
+                    self.errors.append({'row': number, 'reference': None, 'error': 'reference is required'})
+                    continue
+
+                if current is None or current['reference'] != reference:
+                    if reference in seen:
+                        self.errors.append({'row': number, 'reference': reference, 'error': 'Rows of a document must be contiguous'})
+                        continue
+                    close(current)
+                    if len(pending) >= self.chunk_documents or pending_lines >= self.CHUNK_LINES:
+                        self.flush(pending)
+                        pending = []
+                        pending_lines = 0
+                    seen.add(reference)
+                    current = {'reference': reference, 'document': None, 'lines': [], 'rows': [], 'errors': []}
+                    try:
+                        current['document'] = self.parse_header(row)
+                    except ImportRowError as e:
+                        current['errors'].append((number, str(e)))
+
+                current['rows'].append(number)
+                if current['document'] is None:
+                    continue
+                try:
+                    current['lines'].append(self.parse_line(row, current['document']))
+                except ImportRowError as e:
+                    current['errors'].append((number, str(e)))
+        except (csv.Error, json.JSONDecodeError, UnicodeDecodeError) as e:
+            self.errors.append({'row': self.rows + 1, 'reference': None, 'error': f"Unreadable file: {e}"})
+
+        close(current)
+        self.flush(pending)
+        return self.report()
+
+    def flush(self, groups):
+        """Write a chunk of validated documents, isolating the ones the database rejects"""
+        if not groups or self.dry_run:
+            return
+        try:
+            self._write(groups)
+        except (DatabaseError, ValueError):
+            # Retry one by one so that a single bad document does not sink its chunk
+            for group in groups:
+                try:
+                    self._write([group])
+                except (DatabaseError, ValueError) as e:
+                    for number in group['rows']:
+                        self.errors.append({'row': number, 'reference': group['reference'], 'error': str(e)})
+
+    def _write(self, groups):
+        # write() fills the unsaved instances in place, start from fresh copies on retries
+        documents = [(self._copy(group['document']), [self._copy(line) for line in group['lines']]) for group in groups]
+        saved = self.writer.write(documents)
+        for group, document in zip(groups, saved):
+            self.created.append({'reference': group['reference'], 'id': document.id, 'barcode': document.barcode})
+
+    @staticmethod
+    def _copy(instance):
+        copy = type(instance)()
+        for field in instance._meta.concrete_fields:
+            setattr(copy, field.attname, getattr(instance, field.attname))
+        # Keep the related instances parse_header resolved, to avoid refetching them
+        for name in ('document_type', 'origin_department', 'destinate_department'):
+            if hasattr(instance, name) and instance._meta.get_field(name).is_cached(instance):
+                setattr(copy, name, getattr(instance, name))
+        return copy
+
+    def report(self):
+        return {
+            'rows': self.rows,
+            'created': self.created,
+            'errors': sorted(self.errors, key=lambda error: error['row']),
+        }
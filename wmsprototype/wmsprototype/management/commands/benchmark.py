@@ -0,0 +1,156 @@
+import json
+import platform
+import subprocess
+import time
+import django
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.test.utils import override_settings, setup_test_environment, teardown_test_environment
+from django.utils import timezone
+from wmsprototype.benchmarks import Benchmark, BenchmarkError, SyntheticWarehouse, reset_caches
+
+class Command(BaseCommand):
+    help = (
+        'Builds a synthetic warehouse of the given size, times document creation, posting, inventory closing, '
+        'the document list, the product page and analytics, and reports latencies and query counts as JSON. '
+        'Everything runs in one transaction that is rolled back'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--warehouses', type=int, default=1)
+        parser.add_argument('--departments', type=int, default=2, help='Departments per warehouse (default: 2)')
+        parser.add_argument('--rows', type=int, default=4, help='Rows per department (default: 4)')
+        parser.add_argument('--sections', type=int, default=5, help='Sections per row (default: 5)')
+        parser.add_argument('--levels', type=int, default=4, help='Levels per section (default: 4)')
+        parser.add_argument('--cells', type=int, default=4, help='Cells per level (default: 4)')
+        parser.add_argument('--products', type=int, default=1000, help='Number of products (default: 1000)')
+        parser.add_argument('--stock', type=int, default=5000, help='Number of stock buckets (default: 5000)')
+        parser.add_argument('--documents', type=int, default=2000, help='Documents in the history (default: 2000)')
+        parser.add_argument('--lines', type=int, default=10, help='Average lines per document (default: 10)')
+        parser.add_argument('--days', type=int, default=90, help='Days the history is spread over (default: 90)')
+        parser.add_argument('--iterations', type=int, default=10, help='Timed runs per case (default: 10)')
+        parser.add_argument('--warmup', type=int, default=1, help='Untimed runs per case (default: 1)')
+        parser.add_argument('--seed', type=int, default=0, help='Random seed, the same seed builds the same data')
+        parser.add_argument(
+            '--case',
+            dest='cases',
+            action='append',
+            choices=Benchmark.CASES,
+            help='Run only this case, can be repeated'
+        )
+        parser.add_argument(
+            '-o', '--output',
+            help='Write the JSON report to this file instead of standard output'
+        )
+        parser.add_argument(
+            '--compare',
+            help='JSON report of an earlier run to print the differences against'
+        )
+
+    def handle(self, *args, **options):
+        baseline = None
+        if options['compare']:
+            try:
+                with open(options['compare'], encoding='utf-8') as stream:
+                    baseline = json.load(stream)
+            except (OSError, ValueError) as e:
+                raise CommandError(f"Cannot read {options['compare']}: {e}")
+
+        verbosity = options['verbosity']
+        warehouse = SyntheticWarehouse(
+            warehouses=options['warehouses'],
+            departments=options['departments'],
+            rows=options['rows'],
+            sections=options['sections'],
+            levels=options['levels'],
+            cells=options['cells'],
+            products=options['products'],
+            stock=options['stock'],
+            documents=options['documents'],
+            lines=options['lines'],
+            days=options['days'],
+            seed=options['seed'],
+        )
+
+        # The synthetic warehouse is built next to the existing data and rolled
+        # back at the end, so the timings include what the database already holds
+        setup_test_environment()
+        try:
+            reset_caches()
+            # Time the views as deployed, without the per-request query instrumentation
+            with override_settings(WMS_QUERY_INSTRUMENTATION=False), transaction.atomic():
+                self.log(verbosity, 'Building the synthetic warehouse')
+                start = time.perf_counter()
+                fixtures = warehouse.build()
+                fixtures['build_seconds'] = round(time.perf_counter() - start, 3)
+                self.log(verbosity, ', '.join(f'{value} {name}' for name, value in fixtures.items()))
+
+                benchmark = Benchmark(warehouse, iterations=options['iterations'], warmup=options['warmup'], seed=options['seed'])
+                results = {}
+                for name in options['cases'] or Benchmark.CASES:
+                    self.log(verbosity, f'Running {name}')
+                    results.update(benchmark.run([name]))
+                transaction.set_rollback(True)
+        except BenchmarkError as e:
+            raise CommandError(str(e))
+        finally:
+            teardown_test_environment()
+            # Caches may hold rows that were rolled back
+            reset_caches()
+
+        report = {
+            'meta': {
+                'commit': self.commit(),
+                'created_at': timezone.now().isoformat(),
+                'database': connection.vendor,
+                'debug': settings.DEBUG,
+                'django': django.get_version(),
+                'python': platform.python_version(),
+                'seed': options['seed'],
+                'iterations': options['iterations'],
+                'warmup': options['warmup'],
+            },
+            'sizes': warehouse.sizes,
+            'fixtures': fixtures,
+            'results': results,
+        }
+
+        if options['output']:
+            try:
+                with open(options['output'], 'w', encoding='utf-8') as out:
+                    json.dump(report, out, indent=2)
+            except OSError as e:
+                raise CommandError(str(e))
+            self.print_summary(self.stdout, results, baseline)
+            self.stdout.write(self.style.SUCCESS(f"Wrote the report to {options['output']}"))
+        else:
+            if baseline:
+                self.print_summary(self.stderr, results, baseline)
+            self.stdout.write(json.dumps(report, indent=2))
+
+    def log(self, verbosity, message):
+        # Progress goes to stderr, standard output carries only the report
+        if verbosity >= 1:
+            self.stderr.write(message, style_func=lambda message: message)
+
+    def commit(self):
+        try:
+            return subprocess.run(
+                ['git', 'rev-parse', '--short', 'HEAD'],
+                cwd=settings.BASE_DIR, capture_output=True, text=True, check=True
+            ).stdout.strip()
+        except (OSError, subprocess.CalledProcessError):
+            return None
+
+    def print_summary(self, out, results, baseline=None):
+        """Table of median and p95 latency and queries, with the change against a baseline report"""
+        before = (baseline or {}).get('results', {})
+        out.write(f"{'case':<26}{'median ms':>12}{'p95 ms':>12}{'queries':>9}", style_func=lambda line: line)
+        for name, result in results.items():
+            line = f"{name:<26}{result['median_ms']:>12.2f}{result['p95_ms']:>12.2f}{result['queries']:>9}"
+            previous = before.get(name)
+            if previous:
+                change = (result['median_ms'] / previous['median_ms'] - 1) * 100 if previous['median_ms'] else 0
+                line += f"  {change:+.0f}% median, {result['queries'] - previous['queries']:+d} queries"
+            out.write(line, style_func=lambda line: line)
@@ -0,0 +1,513 @@
+"""
+Bulk document creator module: generates the same document families as the
+other creators with bulk inserts, for histories of millions of lines
+"""
+from django.utils import timezone
+from decimal import Decimal
+import bisect
+import datetime
+import random
+from wmsprototype.models import (
+    Document, DocumentType, DocumentProduct, DocumentStatus, DocumentUser,
+    Department, Product, AppUser, Cell, Status, Stock
+)
+from wmsprototype.services import DocumentService, PostingEngine, SyncService
+
+def create_bulk_documents(command, start_date, end_date, count, max_lines=5, seed=None):
+    """Create BO, PZ, FVO/FV, TRO/WM-/WM+, MMO/MM, ICO/IC+/IC-, RW-, NN+ and NN- documents in bulk"""
+    generator = BulkDocumentGenerator(command, seed=seed, max_lines=max_lines)
+    return generator.generate(start_date, end_date, count)
+
+
+class StockLedger:
+    """
+    In-memory copy of Stock that generated documents are posted to, with the
+    PostingEngine rules: receipts add to a bucket, issues take from it and
+    drop it when it runs empty, missing stock is ignored.
+    """
+
+    def __init__(self, cell_departments):
+        # (product_id, cell_id, expiration_date, serial) -> [stock id, quantity, placed_at, moved_at]
+        self.buckets = {}
+        self.changed = set()
+        # cell_id -> keys of the buckets holding stock, as an insertion-ordered dict
+        self.keys_by_cell = {}
+        # department_id -> keys to draw from at random; emptied ones linger until compact()
+        self.keys_by_department = {}
+        self.cell_departments = cell_departments
+
+        rows = Stock.objects.filter(quantity__gt=0).order_by('id').values_list(
+            'id', 'product_id', 'cell_id', 'expiration_date', 'serial', 'quantity', 'placed_at', 'moved_at'
+        )
+        for stock_id, product_id, cell_id, expiration_date, serial, quantity, placed_at, moved_at in rows.iterator(chunk_size=5000):
+            self.buckets[(product_id, cell_id, expiration_date, serial)] = [stock_id, quantity, placed_at, moved_at]
+            self._stocked((product_id, cell_id, expiration_date, serial))
+
+    def _stocked(self, key):
+        self.keys_by_cell.setdefault(key[1], {})[key] = None
+        department_id = self.cell_departments.get(key[1])
+        if department_id is not None:
+            self.keys_by_department.setdefault(department_id, []).append(key)
+
+    def receive(self, key, amount, at):
+        bucket = self.buckets.get(key)
+        if bucket is None:
+            bucket = self.buckets[key] = [None, 0, at, at]
+        if bucket[1] <= 0:
+            bucket[2] = at
+            self._stocked(key)
+        bucket[1] += amount
+        bucket[3] = at
+        self.changed.add(key)
+
+    def issue(self, key, amount, at):
+        bucket = self.buckets.get(key)
+        if bucket is None or bucket[1] <= 0:
+            return
+        bucket[1] = max(bucket[1] - amount, 0)
+        bucket[3] = at
+        if bucket[1] == 0:
+            del self.keys_by_cell[key[1]][key]
+        self.changed.add(key)
+
+    def compact(self):
+        """Drop emptied and repeated keys from the department lists"""
+        for department_id, keys in self.keys_by_department.items():
+            self.keys_by_department[department_id] = [key for key in dict.fromkeys(keys) if self.quantity(key) > 0]
+
+    def quantity(self, key):
+        bucket = self.buckets.get(key)
+        return bucket[1] if bucket else 0
+
+    def pick(self, rng, keys, count):
+        """Up to count distinct keys with stock, drawn at random from keys"""
+        picked = {}
+        for attempt in range(count * 4):
+            if not keys or len(picked) >= count:
+                break
+            key = rng.choice(keys)
+            if self.quantity(key) > 0:
+                picked[key] = True
+        return list(picked)
+
+    def write(self, batch_size):
+        """
+        Write the changed buckets back: one bulk_update, one bulk_create and
+        a DELETE of the emptied buckets
+
+        Returns:
+            Number of Stock rows touched
+        """
+        to_update = []
+        to_create = []
+        to_delete = []
+        for key in self.changed:
+            stock_id, quantity, placed_at, moved_at = self.buckets[key]
+            if stock_id is None:
+                if quantity > 0:
+                    product_id, cell_id, expiration_date, serial = key
+                    to_create.append(Stock(
+                        product_id=product_id,
+                        cell_id=cell_id,
+                        expiration_date=expiration_date,
+                        serial=serial,
+                        quantity=quantity,
+                        placed_at=placed_at,
+                        moved_at=moved_at,
+                        checked_at=moved_at
+                    ))
+            elif quantity > 0:
+                to_update.append(Stock(pk=stock_id, quantity=quantity, moved_at=moved_at))
+            else:
+                to_delete.append(stock_id)
+
+        Stock.objects.bulk_update(to_update, ['quantity', 'moved_at'], batch_size=batch_size)
+        Stock.objects.bulk_create(to_create, batch_size=batch_size)
+        for start in range(0, len(to_delete), batch_size):
+            Stock.objects.filter(pk__in=to_delete[start:start + batch_size]).delete()
+        return len(to_update) + len(to_create) + len(to_delete)
+
+
+class BulkDocumentGenerator:
+    """
+    Generates a document history in date order against a StockLedger.
+
+    Products, cells, users, statuses and stock are loaded once. Documents
+    are collected in chunks; per chunk the numbers are reserved in one block
+    per (type, department, year), and documents, lines, status history and
+    assignments are each written with bulk_create. Stock is written once at
+    the end.
+    """
+
+    # Lines per bulk_create chunk
+    CHUNK_SIZE = 20000
+    BATCH_SIZE = 2000
+    TASK_SYMBOLS = ["FVO", "ICO", "IPO", "MMO", "TRO"]
+    # Document families generated count times each, by the symbol of the first document
+    FAMILIES = ['PZ', 'FVO', 'TRO', 'MMO', 'ICO', 'RW-', 'NN+', 'NN-']
+
+    def __init__(self, command, seed=None, max_lines=5):
+        self.command = command
+        self.random = random.Random(seed)
+        self.max_lines = max(max_lines, 1)
+        self.now = timezone.now()
+
+        self.document_types = {document_type.symbol: document_type for document_type in DocumentType.objects.all()}
+        self.statuses = {
+            (document_type_id, name): status_id
+            for status_id, document_type_id, name in Status.objects.values_list('id', 'document_type_id', 'name')
+        }
+        self.users = list(AppUser.objects.order_by('id').values_list('id', flat=True))
+        self.products = list(Product.objects.order_by('id').values_list('id', 'unit_price'))
+        self.weights = dict(Product.objects.values_list('id', 'weight'))
+
+        cell_departments = dict(Cell.objects.exclude(department=None).order_by('id').values_list('id', 'department_id'))
+        self.cells_by_department = {}
+        for cell_id, department_id in cell_departments.items():
+            self.cells_by_department.setdefault(department_id, []).append(cell_id)
+        self.departments = [
+            department for department in Department.objects.select_related('warehouse').order_by('id')
+            if department.id in self.cells_by_department
+        ]
+        self.ledger = StockLedger(cell_departments)
+        self.addresses = []
+
+        # Pending chunk
+        self.documents = []
+        self.statuses_to_create = []
+        self.assignments = []
+        self.pending_lines = 0
+        self.ledger.compact()
+        self.created_documents = 0
+        self.created_lines = 0
+
+    def generate(self, start_date, end_date, count):
+        """
+        Returns:
+            Tuple of (documents, lines) created
+        """
+        if not self.departments or not self.products or not self.users:
+            self.command.stdout.write(self.command.style.WARNING(
+                'Bulk generation needs departments with cells, products and users. Skipping.'
+            ))
+            return 0, 0
+        missing = {'BO', 'PZ', 'FVO', 'FV', 'TRO', 'WM+', 'WM-', 'MMO', 'MM', 'ICO', 'IC+', 'IC-', 'RW-', 'NN+', 'NN-'} - set(self.document_types)
+        if missing:
+            raise Exception(f"Missing document types: {', '.join(sorted(missing))}")
+
+        for _ in range(min(10, count)):
+            self.addresses.append(self.command.create_slovak_address())
+
+        # Opening stock of every department, then the families in date order
+        for department in self.departments:
+            if department.default_cell_id:
+                self._receipt('BO', department, start_date, self.max_lines * 4)
+
+        seconds = int((end_date - start_date).total_seconds())
+        events = sorted(
+            (start_date + datetime.timedelta(seconds=self.random.randint(0, seconds)), symbol)
+            for symbol in self.FAMILIES
+            for i in range(count)
+        )
+        for created_at, symbol in events:
+            department = self.random.choice(self.departments)
+            if symbol == 'PZ':
+                self._receipt(symbol, department, created_at, self.random.randint(1, self.max_lines))
+            elif symbol == 'NN+':
+                # Unplanned additions are a product or two found in the warehouse
+                self._receipt(symbol, department, created_at, self.random.randint(1, 2))
+            elif symbol in ('RW-', 'NN-'):
+                self._issue(symbol, department, created_at)
+            elif symbol == 'ICO':
+                self._inventory(department, created_at)
+            else:
+                self._order(symbol, department, created_at)
+            if self.pending_lines >= self.CHUNK_SIZE:
+                self._flush()
+        self._flush()
+
+        touched = self.ledger.write(self.BATCH_SIZE)
+        self.command.stdout.write(f'Wrote {touched} stock rows')
+        return self.created_documents, self.created_lines
+
+    def _add(self, symbol, department, created_at, lines, status='Completed', **fields):
+        """Queue a document with its lines, status history and assignments for the next flush"""
+        document_type = self.document_types[symbol]
+        document = Document(
+            document_type=document_type,
+            origin_department=department,
+            current_status=status,
+            created_by_id=self.random.choice(self.users),
+            created_at=created_at,
+            updated_at=created_at,
+            # Stock documents are posted through the ledger as they are generated
+            posted_at=created_at if document_type.group == 'Sklád' else None,
+            **fields
+        )
+        quantity, price, weight = DocumentService.line_totals(
+            [(DocumentService.line_values(line), 1) for line in lines], self.weights
+        ).get(None, (0, 0, 0))
+        document.total_quantity = quantity
+        document.total_price = float(price) if price else None
+        document.total_weight = weight.quantize(Decimal('0.01')) if weight else None
+        self.documents.append((document, lines))
+        self.pending_lines += len(lines)
+
+        if symbol in self.TASK_SYMBOLS:
+            history = ['Generated'] if status == 'Generated' else ['Generated', status]
+            for name in history:
+                status_id = self.statuses.get((document_type.id, name))
+                if status_id:
+                    self.statuses_to_create.append((document, status_id, document.created_by_id))
+            for user_id in self.random.sample(self.users, min(self.random.randint(1, 2), len(self.users))):
+                self.assignments.append((document, user_id))
+        return document
+
+    def _post(self, symbol, department, lines, created_at):
+        """Apply lines to the ledger the way apply_changes would"""
+        if symbol in PostingEngine.RECEIPT_SYMBOLS:
+            for line in lines:
+                cell_id = department.default_cell_id if symbol in PostingEngine.DEFAULT_CELL_SYMBOLS else line.cell_id
+                self.ledger.receive((line.product_id, cell_id, line.expiration_date, line.serial), line.amount_required, created_at)
+        elif symbol in PostingEngine.ISSUE_SYMBOLS:
+            for line in lines:
+                self.ledger.issue((line.product_id, line.cell_id, line.expiration_date, line.serial), line.amount_required, created_at)
+
+    def _receipt(self, symbol, department, created_at, line_count):
+        cells = self.cells_by_department[department.id]
+        lines = []
+        for product_id, unit_price in self.random.sample(self.products, min(line_count, len(self.products))):
+            quantity = self.random.randint(10, 100)
+            lines.append(DocumentProduct(
+                product_id=product_id,
+                amount_required=quantity,
+                amount_added=quantity,
+                cell_id=department.default_cell_id if symbol in PostingEngine.DEFAULT_CELL_SYMBOLS else self.random.choice(cells),
+                unit_price=unit_price,
+                expiration_date=created_at.date() + datetime.timedelta(days=self.random.randint(30, 180)),
+                serial=f"LOT-{self.random.randint(1000, 9999)}"
+            ))
+        self._add(symbol, department, created_at, lines)
+        self._post(symbol, department, lines, created_at)
+
+    def _stock_lines(self, department, line_count, amount_added=True):
+        """Lines over random stocked buckets of a department, for at most what each bucket holds"""
+        lines = []
+        keys = self.ledger.pick(self.random, self.ledger.keys_by_department.get(department.id, []), line_count)
+        for product_id, cell_id, expiration_date, serial in keys:
+            # Most lines clear their bucket, so buckets are used up about as fast as receipts open them
+            available = self.ledger.quantity((product_id, cell_id, expiration_date, serial))
+            quantity = available if self.random.random() < 0.67 else self.random.randint(1, available)
+            lines.append(DocumentProduct(
+                product_id=product_id,
+                amount_required=quantity,
+                amount_added=quantity if amount_added else 0,
+                cell_id=cell_id,
+                unit_price=self._price(product_id),
+                expiration_date=expiration_date,
+                serial=serial
+            ))
+        return lines
+
+    def _price(self, product_id):
+        # products is ordered by id
+        i = bisect.bisect_left(self.products, (product_id,))
+        return self.products[i][1] if i < len(self.products) and self.products[i][0] == product_id else None
+
+    def _copy_lines(self, lines, cell_id=None):
+        """Fulfilled copies of lines, moved to cell_id if given; lines that end up in the same bucket are merged"""
+        copies = {}
+        for line in lines:
+            key = (line.product_id, cell_id or line.cell_id, line.expiration_date, line.serial)
+            copy = copies.get(key)
+            if copy:
+                copy.amount_required += line.amount_required
+                copy.amount_added = copy.amount_required
+                continue
+            copies[key] = DocumentProduct(
+                product_id=line.product_id,
+                amount_required=line.amount_required,
+                amount_added=line.amount_required,
+                cell_id=key[1],
+                unit_price=line.unit_price,
+                expiration_date=line.expiration_date,
+                serial=line.serial
+            )
+        return list(copies.values())
+
+    def _issue(self, symbol, department, created_at):
+        lines = self._stock_lines(department, self.random.randint(1, self.max_lines))
+        if not lines:
+            return
+        self._add(symbol, department, created_at, lines)
+        self._post(symbol, department, lines, created_at)
+
+    def _order(self, symbol, department, created_at):
+        """
+        FVO, TRO or MMO order; half of them are completed by their response
+        documents (FV, WM- and WM+, MM) created up to two days later
+        """
+        lines = self._stock_lines(department, self.random.randint(1, self.max_lines), amount_added=False)
+        if not lines:
+            return
+        response_at = created_at + datetime.timedelta(hours=self.random.randint(1, 48))
+        completed = self.random.random() < 0.5 and response_at <= self.now
+
+        fields = {}
+        destination = None
+        if symbol == 'FVO':
+            fields = {
+                'carrier': f"Carrier-{self.random.randint(100, 999)}",
+                'post_barcode': f"LABEL-{self.random.randint(10000, 99999)}",
+                'address': self.random.choice(self.addresses) if self.addresses else None,
+            }
+        elif symbol == 'TRO':
+            others = [other for other in self.departments if other.id != department.id and other.default_cell_id]
+            if not others:
+                return
+            destination = self.random.choice(others)
+            fields = {'destinate_department': destination}
+        else:
+            fields = {'destinate_cell_id': self.random.choice(self.cells_by_department[department.id])}
+
+        if completed:
+            for line in lines:
+                line.amount_added = line.amount_required
+        order = self._add(
+            symbol, department, created_at, lines,
+            status='Completed' if completed else self.random.choice(['Generated', 'In Progress']),
+            **fields
+        )
+        if not completed:
+            return
+
+        if symbol == 'FVO':
+            responses = [('FV', department, self._copy_lines(lines), fields)]
+        elif symbol == 'TRO':
+            responses = [
+                ('WM-', department, self._copy_lines(lines), {'destinate_department': destination}),
+                ('WM+', destination, self._copy_lines(lines, destination.default_cell_id), {'destinate_department': department}),
+            ]
+        else:
+            responses = [('MM', department, self._copy_lines(lines, fields['destinate_cell_id']), {})]
+        for response_symbol, response_department, response_lines, response_fields in responses:
+            self._add(response_symbol, response_department, response_at, response_lines, linked_document=order, **response_fields)
+            self._post(response_symbol, response_department, response_lines, response_at)
+
+    def _inventory(self, department, created_at):
+        """Completed ICO count of a stocked cell, with the IC+/IC- documents posting its deviations"""
+        # Any cell of the department, not the ones holding most buckets
+        cells = self.cells_by_department[department.id]
+        stocked = [cell_id for cell_id in self.random.sample(cells, min(10, len(cells))) if self.ledger.keys_by_cell.get(cell_id)]
+        if not stocked:
+            return
+        cell_id = stocked[0]
+        lines = []
+        surplus = []
+        shortage = []
+        for key in list(self.ledger.keys_by_cell[cell_id]):
+            book = self.ledger.quantity(key)
+            product_id, cell_id, expiration_date, serial = key
+            # Most lines are counted right
+            counted = book
+            if self.random.random() < 0.1:
+                counted = max(book + self.random.choice([1, -1, 2, -2]), 0)
+            line = DocumentProduct(
+                product_id=product_id,
+                amount_required=book,
+                amount_added=counted,
+                cell_id=cell_id,
+                unit_price=self._price(product_id),
+                expiration_date=expiration_date,
+                serial=serial
+            )
+            lines.append(line)
+            if counted != book:
+                (surplus if counted > book else shortage).append(line)
+        if not lines:
+            return
+
+        ico = self._add(
+            'ICO', department, created_at, lines,
+            origin_cell_id=cell_id,
+            description=f"Partial inventory for cell {cell_id}"
+        )
+        for symbol, deviations in (('IC+', surplus), ('IC-', shortage)):
+            if not deviations:
+                continue
+            adjustment_lines = []
+            for line in deviations:
+                difference = abs(line.amount_added - line.amount_required)
+                adjustment_lines.append(DocumentProduct(
+                    product_id=line.product_id,
+                    amount_required=difference,
+                    amount_added=difference,
+                    cell_id=line.cell_id,
+                    unit_price=line.unit_price,
+                    expiration_date=line.expiration_date,
+                    serial=line.serial
+                ))
+            self._add(symbol, department, created_at, adjustment_lines, linked_document=ico)
+            self._post(symbol, department, adjustment_lines, created_at)
+
+    def _flush(self):
+        """Number and write the pending chunk"""
+        if not self.documents:
+            return
+
+        # One block of numbers per document type, department and year, handed out in date order
+        groups = {}
+        for document, lines in self.documents:
+            groups.setdefault(
+                (document.document_type.symbol, document.origin_department_id, document.created_at.year), []
+            ).append(document)
+        for (symbol, department_id, year), group in groups.items():
+            group.sort(key=lambda document: document.created_at)
+            numbers = DocumentService.reserve_document_numbers(
+                group[0].document_type, group[0].origin_department, len(group), year=year
+            )
+            for document, number in zip(group, numbers):
+                document.document_number = number
+                document.barcode = DocumentService.generate_barcode(
+                    document.document_type,
+                    f"{number:04d}",
+                    str(document.created_at.year)[-2:],
+                    f"{document.created_at.month:02d}",
+                    document.origin_department.number
+                )
+
+        # Responses link to orders of the same chunk, so orders go in first
+        documents = [document for document, lines in self.documents]
+        Document.objects.bulk_create(
+            [document for document in documents if document.linked_document is None], batch_size=self.BATCH_SIZE
+        )
+        Document.objects.bulk_create(
+            [document for document in documents if document.linked_document is not None], batch_size=self.BATCH_SIZE
+        )
+
+        lines = []
+        for document, document_lines in self.documents:
+            for line in document_lines:
+                line.document = document
+                lines.append(line)
+        DocumentProduct.objects.bulk_create(lines, batch_size=self.BATCH_SIZE)
+        DocumentStatus.objects.bulk_create([
+            DocumentStatus(document=document, status_id=status_id, user_id=user_id)
+            for document, status_id, user_id in self.statuses_to_create
+        ], batch_size=self.BATCH_SIZE)
+        DocumentUser.objects.bulk_create([
+            DocumentUser(document=document, appuser_id=user_id)
+            for document, user_id in self.assignments
+        ], batch_size=self.BATCH_SIZE)
+        # Bulk inserts send no post_save, log the new documents for terminals here
+        SyncService.record(Document, [document.pk for document in documents])
+
+        self.created_documents += len(documents)
+        self.created_lines += len(lines)
+        self.command.stdout.write(f'Created {self.created_documents} documents, {self.created_lines} lines')
+
+        self.documents = []
+        self.statuses_to_create = []
+        self.assignments = []
+        self.pending_lines = 0
+        self.ledger.compact()
@@ -347,7 +347,7 @@ def create_inventory_resolution(command, doc_type, dept, cell, results, doc_date
         document_type=doc_type,
         document_number=doc_number,
         current_status='Completed',
-        total_quantity=total_qty,
+        total_quantity=0,  # The lines add to it as they are created
         created_by=random.choice(users),
         created_at=doc_date,
         updated_at=doc_date,
@@ -154,7 +154,7 @@ def create_fvo_documents(command, start_date, end_date, count=20):
                 document_type=fv_type,
                 document_number=doc_number,
                 current_status='Completed',
-                total_quantity=total_qty,
+                total_quantity=0,  # The lines add to it as they are created
                 created_by=random.choice(users),
                 created_at=fv_date,
                 updated_at=fv_date,
@@ -345,7 +345,7 @@ def create_tro_documents(command, start_date, end_date, count=15):
                 document_type=wm_minus_type,
                 document_number=wm_minus_number,
                 current_status='Completed',
-                total_quantity=total_qty,
+                total_quantity=0,  # The lines add to it as they are created
                 created_by=random.choice(users),
                 created_at=wm_date,
                 updated_at=wm_date,
@@ -390,7 +390,7 @@ def create_tro_documents(command, start_date, end_date, count=15):
                 document_type=wm_plus_type,
                 document_number=wm_plus_number,
                 current_status='Completed',
-                total_quantity=total_qty,
+                total_quantity=0,  # The lines add to it as they are created
                 created_by=random.choice(users),
                 created_at=wm_plus_date,
                 updated_at=wm_plus_date,
@@ -581,7 +581,7 @@ def create_mmo_documents(command, start_date, end_date, count=15):
                 document_type=mm_type,
                 document_number=mm_number,
                 current_status='Completed',
-                total_quantity=total_qty,
+                total_quantity=0,  # The lines add to it as they are created
                 created_by=random.choice(users),
                 created_at=mm_date,
                 updated_at=mm_date,
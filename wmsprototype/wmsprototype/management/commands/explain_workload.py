@@ -0,0 +1,211 @@
+import re
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.db.models import Max
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from wmsprototype.models import Cell, Department, Document, DocumentType, Product, Stock, Warehouse
+from wmsprototype.services import AnalyticsService, DocumentService, ProductService, ScanService, StockService
+
+class Command(BaseCommand):
+    help = (
+        'Runs EXPLAIN on every statement of a workload and flags full table scans. '
+        'The workload is either a file of captured SQL (one statement per line or ended by ";", '
+        'django.db.backends log lines are accepted) or, by default, the hot queries of the application'
+    )
+
+    # "(0.002) SELECT ...; args=(...); alias=default" as logged by django.db.backends
+    LOG_LINE = re.compile(r'^\(\d+\.\d+\)\s+(?P<sql>.*?);\s*args=.*$')
+    EXPLAINED = ('SELECT', 'UPDATE', 'DELETE', 'WITH')
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--file',
+            help='Captured SQL to replay instead of the built-in workload'
+        )
+        parser.add_argument(
+            '--min-rows',
+            type=int,
+            default=1000,
+            help='Only flag scans of tables with at least this many rows (default: 1000)'
+        )
+        parser.add_argument(
+            '--verbose-plans',
+            action='store_true',
+            help='Print the plan of every statement, not only of the flagged ones'
+        )
+        parser.add_argument(
+            '--fail',
+            action='store_true',
+            help='Exit with an error when a full scan is flagged'
+        )
+
+    def handle(self, *args, **options):
+        if connection.vendor not in ('sqlite', 'postgresql', 'mysql'):
+            raise CommandError(f'EXPLAIN is not supported for {connection.vendor}')
+
+        if options['file']:
+            try:
+                with open(options['file'], encoding='utf-8') as stream:
+                    statements = self.read_statements(stream)
+            except OSError as e:
+                raise CommandError(str(e))
+        else:
+            statements = self.capture_workload()
+
+        # Replay each query shape once, counting how often it ran
+        counts = {}
+        for sql in statements:
+            if sql.lstrip().upper().startswith(self.EXPLAINED):
+                counts[sql] = counts.get(sql, 0) + 1
+        self.stdout.write(f'Explaining {len(counts)} distinct statements of {len(statements)}')
+
+        table_rows = {}
+        flagged = 0
+        for sql, count in counts.items():
+            try:
+                plan = self.explain(sql)
+            except Exception as e:
+                self.stdout.write(self.style.WARNING(f'Could not explain: {e}\n  {sql[:200]}'))
+                continue
+
+            scans = []
+            for table in self.full_scans(plan):
+                if table not in table_rows:
+                    table_rows[table] = self.count_rows(table)
+                if table_rows[table] is None or table_rows[table] >= options['min_rows']:
+                    scans.append(table)
+
+            if scans:
+                flagged += 1
+                self.stdout.write(self.style.ERROR(
+                    f"\nFULL SCAN of {', '.join(sorted(set(scans)))} (ran {count}x)"
+                ))
+            elif options['verbose_plans']:
+                self.stdout.write(f'\nOK (ran {count}x)')
+            else:
+                continue
+            self.stdout.write(f'  {sql}')
+            for line in plan:
+                self.stdout.write(f'    {line}')
+
+        summary = f'\n{flagged} of {len(counts)} statements scan a whole table'
+        if flagged:
+            self.stdout.write(self.style.WARNING(summary))
+            if options['fail']:
+                raise CommandError('Full table scans found')
+        else:
+            self.stdout.write(self.style.SUCCESS(summary))
+
+    def read_statements(self, stream):
+        """Split captured SQL into statements, accepting django.db.backends log lines"""
+        statements = []
+        pending = []
+        for line in stream:
+            line = line.strip()
+            if not line or line.startswith('--'):
+                continue
+            logged = self.LOG_LINE.match(line)
+            if logged:
+                statements.append(logged.group('sql'))
+                continue
+            pending.append(line)
+            if line.endswith(';') or len(pending) == 1 and not line.upper().startswith(self.EXPLAINED):
+                statements.append(' '.join(pending).rstrip(';'))
+                pending = []
+        if pending:
+            statements.append(' '.join(pending).rstrip(';'))
+        return statements
+
+    def capture_workload(self):
+        """
+        Run the queries behind the dashboard, document and product lists,
+        scanning, stock posting and numbering, and capture their SQL.
+        Everything is rolled back.
+        """
+        document = Document.objects.order_by('-id').first()
+        product = Product.objects.exclude(ean=None).first()
+        cell = Cell.objects.exclude(barcode=None).first()
+        department = Department.objects.first()
+        warehouse = Warehouse.objects.first()
+        document_type = DocumentType.objects.first()
+        if not (document and product and department and warehouse):
+            raise CommandError('The built-in workload needs documents, products and departments, use --file')
+
+        ScanService._cache.clear()
+        with CaptureQueriesContext(connection) as queries:
+            with transaction.atomic():
+                DocumentService.get_documents_page()
+                DocumentService.get_documents_page(doc_type_id=document.document_type_id)
+                DocumentService.get_documents_page(department_id=department.id)
+                DocumentService.get_documents_page(doc_type_id=document.document_type_id, department_id=department.id)
+                DocumentService.get_open_documents(warehouse.id)
+                # Numbering falls back to the issued numbers of a type, department and year
+                Document.objects.filter(
+                    document_type=document_type, origin_department=department, created_at__year=timezone.now().year
+                ).aggregate(last=Max('document_number'))
+                list(Document.objects.filter(current_status='Generated')[:50])
+
+                ProductService.get_catalogue_page()
+                ProductService.get_catalogue_page(name=product.name[:3])
+                ProductService.get_catalogue_page(ean=product.ean[:6])
+                StockService.get_product_breakdown(product)
+                # Posting looks stock buckets up and deletes the emptied ones
+                Stock.objects.filter(product=product, cell=cell, expiration_date=None, serial=None).first()
+                Stock.objects.filter(quantity__lte=0, product=product, cell=cell, expiration_date=None, serial=None).delete()
+
+                AnalyticsService.get_suspicious_operations()
+                AnalyticsService.get_daily_minus_totals()
+                AnalyticsService.get_daily_fv_totals()
+                AnalyticsService.get_product_freshness()
+
+                ScanService.resolve_scan(product.ean)
+                ScanService.resolve_scan(document.barcode)
+                if cell is not None:
+                    ScanService.resolve_scan(cell.barcode)
+                transaction.set_rollback(True)
+        ScanService._cache.clear()
+
+        return [query['sql'] for query in queries.captured_queries]
+
+    def explain(self, sql):
+        """
+        Returns:
+            List of plan lines
+        """
+        prefix = 'EXPLAIN QUERY PLAN ' if connection.vendor == 'sqlite' else 'EXPLAIN '
+        with connection.cursor() as cursor:
+            cursor.execute(prefix + sql)
+            columns = [column[0] for column in cursor.description]
+            rows = cursor.fetchall()
+        if connection.vendor == 'sqlite':
+            return [row[-1] for row in rows]
+        if connection.vendor == 'postgresql':
+            return [row[0] for row in rows]
+        return [', '.join(f'{column}={value}' for column, value in zip(columns, row)) for row in rows]
+
+    def full_scans(self, plan):
+        """Tables the plan reads row by row without an index"""
+        for line in plan:
+            if connection.vendor == 'sqlite':
+                # "SCAN Documents" is a full scan, "SCAN Documents USING INDEX ..." walks an index
+                match = re.match(r'^SCAN (?:TABLE )?(\S+)(.*)$', line)
+                if match and 'USING' not in match.group(2) and match.group(1) != 'CONSTANT':
+                    yield match.group(1)
+            elif connection.vendor == 'postgresql':
+                match = re.search(r'Seq Scan on (\S+)', line)
+                if match:
+                    yield match.group(1)
+            else:
+                match = re.search(r'table=(\S+), .*type=ALL\b', line)
+                if match:
+                    yield match.group(1)
+
+    def count_rows(self, table):
+        try:
+            with connection.cursor() as cursor:
+                cursor.execute(f'SELECT COUNT(*) FROM {connection.ops.quote_name(table)}')
+                return cursor.fetchone()[0]
+        except Exception:
+            # Aliases and subqueries are not tables
+            return None
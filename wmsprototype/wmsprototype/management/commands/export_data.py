@@ -0,0 +1,69 @@
+import datetime
+from django.core.management.base import BaseCommand, CommandError
+from wmsprototype.exports import EXPORTS, ExportError
+
+class Command(BaseCommand):
+    help = 'Exports document lines, stock movements or stock by cell as CSV or XLSX, streaming rows from the database'
+
+    def add_arguments(self, parser):
+        parser.add_argument('export', choices=sorted(EXPORTS))
+        parser.add_argument(
+            '--from',
+            dest='date_from',
+            type=datetime.date.fromisoformat,
+            help='First day, YYYY-MM-DD (inclusive)'
+        )
+        parser.add_argument(
+            '--to',
+            dest='date_to',
+            type=datetime.date.fromisoformat,
+            help='Last day, YYYY-MM-DD (inclusive)'
+        )
+        parser.add_argument(
+            '--department',
+            dest='department_id',
+            type=int,
+            help='Only this department (id)'
+        )
+        parser.add_argument(
+            '--doc-type',
+            help='Only documents of this type symbol'
+        )
+        parser.add_argument(
+            '--format',
+            choices=['csv', 'xlsx'],
+            default='csv'
+        )
+        parser.add_argument(
+            '-o', '--output',
+            help='Output file (default: standard output, CSV only)'
+        )
+
+    def handle(self, *args, **options):
+        extract = EXPORTS[options['export']]
+        filters = {
+            'date_from': options['date_from'],
+            'date_to': options['date_to'],
+            'department_id': options['department_id'],
+            'doc_type': options['doc_type'],
+        }
+
+        try:
+            if options['format'] == 'xlsx':
+                if not options['output']:
+                    raise CommandError('XLSX exports need --output')
+                extract.write_xlsx(options['output'], **filters)
+            elif options['output']:
+                with open(options['output'], 'w', newline='', encoding='utf-8') as out:
+                    extract.write_csv(out, **filters)
+            else:
+                # csv lines carry their own line ending
+                for line in extract.csv_lines(**filters):
+                    self.stdout.write(line, ending='')
+        except ExportError as e:
+            raise CommandError(str(e))
+        except OSError as e:
+            raise CommandError(str(e))
+
+        if options['output']:
+            self.stdout.write(self.style.SUCCESS(f"Exported {options['export']} to {options['output']}"))
@@ -0,0 +1,80 @@
+import csv
+import sys
+from django.core.management.base import BaseCommand, CommandError
+from wmsprototype.models import AppUser
+from wmsprototype.importers import DocumentImporter
+
+class Command(BaseCommand):
+    help = 'Imports documents (e.g. PZ advance notices, FVO orders) from a CSV, NDJSON or JSON file, one line per row'
+    
+    def add_arguments(self, parser):
+        parser.add_argument('file', help='File to import, - for standard input')
+        parser.add_argument(
+            '--format',
+            choices=DocumentImporter.FORMATS,
+            help='File format (default: from the file extension, CSV otherwise)'
+        )
+        parser.add_argument(
+            '--user',
+            required=True,
+            help='Username the documents are created by'
+        )
+        parser.add_argument(
+            '--errors',
+            help='Write the per-row error report to this CSV file instead of standard output'
+        )
+        parser.add_argument(
+            '--chunk-size',
+            type=int,
+            default=DocumentImporter.CHUNK_DOCUMENTS,
+            help=f'Documents per transaction (default: {DocumentImporter.CHUNK_DOCUMENTS})'
+        )
+        parser.add_argument(
+            '--no-post',
+            action='store_true',
+            help='Create Sklád documents without posting them to stock'
+        )
+        parser.add_argument(
+            '--dry-run',
+            action='store_true',
+            help='Only validate the file'
+        )
+    
+    def handle(self, *args, **options):
+        user = AppUser.objects.filter(user__username=options['user']).first()
+        if user is None:
+            raise CommandError(f"Unknown user '{options['user']}'")
+        
+        format = options['format'] or DocumentImporter.detect_format(options['file'])
+        importer = DocumentImporter(
+            user,
+            post=not options['no_post'],
+            dry_run=options['dry_run'],
+            chunk_documents=options['chunk_size']
+        )
+        
+        if options['file'] == '-':
+            report = importer.run(sys.stdin, format)
+        else:
+            try:
+                with open(options['file'], newline='', encoding='utf-8-sig') as stream:
+                    report = importer.run(stream, format)
+            except OSError as e:
+                raise CommandError(str(e))
+        
+        if report['errors']:
+            if options['errors']:
+                with open(options['errors'], 'w', newline='', encoding='utf-8') as out:
+                    self.write_errors(out, report['errors'])
+            else:
+                self.write_errors(self.stdout, report['errors'])
+        
+        summary = f"Read {report['rows']} rows, created {len(report['created'])} documents, {len(report['errors'])} rows with errors"
+        if options['dry_run']:
+            summary += ' (dry run)'
+        self.stdout.write(self.style.SUCCESS(summary) if not report['errors'] else self.style.WARNING(summary))
+    
+    def write_errors(self, out, errors):
+        writer = csv.DictWriter(out, fieldnames=['row', 'reference', 'error'])
+        writer.writeheader()
+        writer.writerows(errors)
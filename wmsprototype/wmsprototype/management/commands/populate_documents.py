@@ -3,9 +3,9 @@ from django.utils import timezone
 from django.db import transaction
 from wmsprototype.models import (
     Document, DocumentType, DocumentProduct, Department, 
-    Product, AppUser, Cell, Address, Inventory
+    Product, AppUser, Cell, Address
 )
-from wmsprototype.services import DocumentService, TopologyService
+from wmsprototype.services import AnalyticsService, DocumentService, TopologyService
 import random
 import datetime
 from faker import Faker
@@ -14,6 +14,7 @@ from faker import Faker
 from .document_creators.operational import create_fvo_documents, create_tro_documents, create_mmo_documents
 from .document_creators.inventory import create_inventory_documents
 from .document_creators.other import create_additional_documents
+from .document_creators.bulk import create_bulk_documents
 
 # Initialize faker for Slovak addresses
 fake = Faker('sk_SK')
@@ -28,6 +29,34 @@ class Command(BaseCommand):
             default=100,
             help='Number of documents to generate for each type (default: 100)'
         )
+        parser.add_argument(
+            '--bulk',
+            action='store_true',
+            help='Generate with bulk inserts from data loaded into memory, for large histories'
+        )
+        parser.add_argument(
+            '--seed',
+            type=int,
+            help='Seed of the random generators, the same seed generates the same documents'
+        )
+        parser.add_argument(
+            '--lines',
+            type=int,
+            default=5,
+            help='Maximum lines per document in bulk mode (default: 5)'
+        )
+        parser.add_argument(
+            '--from',
+            dest='date_from',
+            type=datetime.date.fromisoformat,
+            help='First day of the generated period, YYYY-MM-DD (default: 2025-01-12)'
+        )
+        parser.add_argument(
+            '--to',
+            dest='date_to',
+            type=datetime.date.fromisoformat,
+            help='Last day of the generated period, YYYY-MM-DD (default: 2025-04-30)'
+        )
     
     def handle(self, *args, **options):
         count = options['count']
@@ -35,12 +64,28 @@ class Command(BaseCommand):
         # Define date range
         start_date = datetime.datetime(2025, 1, 12, tzinfo=timezone.get_current_timezone())
         end_date = datetime.datetime(2025, 5, 1, tzinfo=timezone.get_current_timezone())
+        if options['date_from']:
+            start_date = datetime.datetime.combine(options['date_from'], datetime.time.min, tzinfo=timezone.get_current_timezone())
+        if options['date_to']:
+            end_date = datetime.datetime.combine(options['date_to'] + datetime.timedelta(days=1), datetime.time.min, tzinfo=timezone.get_current_timezone())
+
+        if options['seed'] is not None:
+            random.seed(options['seed'])
+            fake.seed_instance(options['seed'])
         
         try:
             with transaction.atomic():
                 # Verify necessary data exists
                 self.check_prerequisites()
                 
+                if options['bulk']:
+                    documents, lines = create_bulk_documents(
+                        self, start_date, end_date, count, max_lines=options['lines'], seed=options['seed']
+                    )
+                    AnalyticsService.rebuild_facts(start_date.date(), end_date.date())
+                    self.stdout.write(self.style.SUCCESS(f'Successfully created {documents} documents with {lines} lines'))
+                    return
+                
                 # Create BO documents for each department
                 self.create_bo_documents(start_date)
                 
@@ -53,6 +98,10 @@ class Command(BaseCommand):
                 # Create other document types (RW-, NN+, NN-)
                 self.create_other_documents(start_date, end_date, count)
                 
+                # Generated documents are not all posted one by one, so
+                # recompute the analytics facts for the whole period
+                AnalyticsService.rebuild_facts(start_date.date(), end_date.date())
+                
                 self.stdout.write(self.style.SUCCESS('Successfully created documents'))
                 
         except Exception as e:
@@ -137,7 +186,7 @@ class Command(BaseCommand):
                 document_type=bo_type,
                 document_number=doc_number,
                 current_status='Completed',
-                total_quantity=sum(random.randint(10, 100) for _ in range(len(bakery_products))),
+                total_quantity=0,  # The lines add to it as they are created
                 created_by=default_user,
                 created_at=start_date,
                 updated_at=start_date,
@@ -0,0 +1,30 @@
+import datetime
+from django.core.management.base import BaseCommand, CommandError
+from wmsprototype.services import AnalyticsService
+
+class Command(BaseCommand):
+    help = 'Recomputes the daily document facts behind the analytics dashboard, for all days or a date range'
+    
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--from',
+            dest='date_from',
+            help='First day to rebuild (YYYY-MM-DD)'
+        )
+        parser.add_argument(
+            '--to',
+            dest='date_to',
+            help='Last day to rebuild (YYYY-MM-DD)'
+        )
+    
+    def handle(self, *args, **options):
+        try:
+            date_from = datetime.date.fromisoformat(options['date_from']) if options['date_from'] else None
+            date_to = datetime.date.fromisoformat(options['date_to']) if options['date_to'] else None
+        except ValueError as e:
+            raise CommandError(f'Invalid date: {e}')
+        if date_from and date_to and date_from > date_to:
+            raise CommandError('--from must not be after --to')
+        
+        written = AnalyticsService.rebuild_facts(date_from, date_to)
+        self.stdout.write(self.style.SUCCESS(f'Wrote {written} daily fact rows'))
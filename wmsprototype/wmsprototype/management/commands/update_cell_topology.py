@@ -0,0 +1,38 @@
+from django.core.management.base import BaseCommand, CommandError
+from wmsprototype.models import Cell
+from wmsprototype.services import TopologyService
+
+class Command(BaseCommand):
+    help = 'Backfills the denormalized department, warehouse and path columns of cells, or checks them with --check'
+    
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--check',
+            action='store_true',
+            help='Only report cells whose columns disagree with the topology, without updating them'
+        )
+        parser.add_argument(
+            '--department',
+            type=int,
+            help='Limit to cells of a specific department ID'
+        )
+    
+    def handle(self, *args, **options):
+        cells = Cell.objects.all()
+        if options['department']:
+            cells = cells.filter(level__section__row__department_id=options['department'])
+        
+        if options['check']:
+            stale = TopologyService.find_inconsistent_cells(cells)
+            for row in stale:
+                self.stdout.write(
+                    f'Cell {row["id"]}: expected department={row["department_id"]}, '
+                    f'warehouse={row["warehouse_id"]}, path={row["path"]}'
+                )
+            if stale:
+                raise CommandError(f'{len(stale)} of {cells.count()} cells are out of sync')
+            self.stdout.write(self.style.SUCCESS(f'All {cells.count()} cells are consistent'))
+            return
+        
+        updated = TopologyService.sync_cells(cells)
+        self.stdout.write(self.style.SUCCESS(f'Updated {updated} of {cells.count()} cells'))
@@ -1,11 +1,15 @@
+import datetime
 from django.core.management.base import BaseCommand
-from django.db import transaction
-from wmsprototype.models import Document, DocumentProduct
-from decimal import Decimal
+from django.db.models import Q
+from django.utils import timezone
+from wmsprototype.models import Document
+from wmsprototype.services import DocumentService
 
 class Command(BaseCommand):
     help = 'Updates total_price and total_weight for all documents where these values are missing'
-    
+
+    CHUNK_SIZE = 1000
+
     def add_arguments(self, parser):
         parser.add_argument(
             '--force',
@@ -22,104 +26,60 @@ class Command(BaseCommand):
             type=str,
             help='Update specific document by barcode'
         )
-    
+        parser.add_argument(
+            '--since',
+            type=datetime.datetime.fromisoformat,
+            help='Only documents updated since this date or datetime (YYYY-MM-DD[THH:MM])'
+        )
+        parser.add_argument(
+            '--chunk-size',
+            type=int,
+            default=self.CHUNK_SIZE,
+            help=f'Documents per query and transaction (default: {self.CHUNK_SIZE})'
+        )
+
     def handle(self, *args, **options):
         force_update = options['force']
         doc_id = options['doc_id']
         doc_barcode = options['doc_barcode']
-        
+        chunk_size = options['chunk_size']
+
         # Get documents to update
         if doc_id:
-            # Update specific document by ID
             documents = Document.objects.filter(id=doc_id)
             if not documents.exists():
                 self.stdout.write(self.style.ERROR(f'Document with ID {doc_id} not found'))
                 return
         elif doc_barcode:
-            # Update specific document by barcode
             documents = Document.objects.filter(barcode=doc_barcode)
             if not documents.exists():
                 self.stdout.write(self.style.ERROR(f'Document with barcode {doc_barcode} not found'))
                 return
+        elif force_update:
+            documents = Document.objects.all()
         else:
-            # Get all documents or only those with missing values
-            if force_update:
-                documents = Document.objects.all()
-            else:
-                documents = Document.objects.filter(
-                    total_price__isnull=True
-                ) | Document.objects.filter(
-                    total_weight__isnull=True
-                )
-        
-        total_count = documents.count()
+            documents = Document.objects.filter(Q(total_price__isnull=True) | Q(total_weight__isnull=True))
+
+        since = options['since']
+        if since:
+            if timezone.is_naive(since):
+                since = timezone.make_aware(since)
+            documents = documents.filter(updated_at__gte=since)
+
+        # Ids only; totals are computed per chunk by one grouped query and
+        # written by one bulk_update, each chunk in its own transaction
+        document_ids = list(documents.order_by('id').values_list('id', flat=True))
+        total_count = len(document_ids)
         updated_count = 0
-        skipped_count = 0
-        
+
         self.stdout.write(f'Found {total_count} documents to process')
-        
-        # Process each document
-        with transaction.atomic():
-            for doc in documents:
-                try:
-                    updated = self.update_document_totals(doc, force_update)
-                    if updated:
-                        updated_count += 1
-                    else:
-                        skipped_count += 1
-                except Exception as e:
-                    self.stdout.write(self.style.ERROR(f'Error updating document {doc.barcode}: {str(e)}'))
-        
+
+        for start in range(0, total_count, chunk_size):
+            chunk = document_ids[start:start + chunk_size]
+            updated_count += DocumentService.update_totals(chunk, force=force_update)
+            self.stdout.write(f'Processed {min(start + chunk_size, total_count)}/{total_count} documents, {updated_count} updated')
+
         self.stdout.write(self.style.SUCCESS(
             f'Processed {total_count} documents: '
-            f'{updated_count} updated, {skipped_count} skipped'
+            f'{updated_count} updated, {total_count - updated_count} skipped'
         ))
-    
-    def update_document_totals(self, document, force_update):
-        """
-        Update total_price and total_weight for a document based on its products
-        Returns True if document was updated, False otherwise
-        """
-        # Check if update is needed
-        price_needs_update = document.total_price is None or force_update
-        weight_needs_update = document.total_weight is None or force_update
-        
-        if not price_needs_update and not weight_needs_update:
-            return False
-        
-        # Get all document products
-        doc_products = DocumentProduct.objects.filter(document=document)
-        if not doc_products.exists():
-            # No products to calculate from
-            return False
-        
-        # Calculate totals
-        total_price = Decimal('0.00')
-        total_weight = Decimal('0.00')
-        
-        for dp in doc_products:
-            # For price calculation
-            if dp.unit_price is not None:
-                quantity = dp.amount_added or dp.amount_required or 0
-                item_price = dp.unit_price * quantity
-                total_price += item_price
-            
-            # For weight calculation
-            if dp.product.weight is not None:
-                quantity = dp.amount_added or dp.amount_required or 0
-                item_weight = Decimal(dp.product.weight) * quantity / Decimal('1000')  # Convert to kg
-                total_weight += item_weight
-        
-        # Update the document
-        if price_needs_update and total_price > 0:
-            document.total_price = float(total_price)
-        
-        if weight_needs_update and total_weight > 0:
-            document.total_weight = total_weight
-        
-        document.save()
-        
-        self.stdout.write(f'Updated {document.barcode}: '
-                        f'Price={document.total_price}, '
-                        f'Weight={document.total_weight}')
-        return True
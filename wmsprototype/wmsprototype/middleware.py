@@ -0,0 +1,132 @@
+import logging
+import re
+import time
+from contextlib import ExitStack
+from functools import wraps
+from django.conf import settings
+from django.db import connections
+from .services import UserService
+
+logger = logging.getLogger('wmsprototype.queries')
+
+
+class WmsUserMiddleware:
+    """
+    Sets request.wms_user to the WmsUser of the logged in user (None for
+    anonymous users), resolved once per request through UserService.
+
+    Must come after AuthenticationMiddleware.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        request.wms_user = UserService.resolve(request.user)
+        return self.get_response(request)
+
+
+class QueryBudgetExceeded(Exception):
+    pass
+
+
+def query_budget(limit):
+    """
+    Decorator setting the most queries a view may run per request, checked
+    by QueryBudgetMiddleware
+
+    Args:
+        limit: Number of queries
+    """
+    def decorator(view):
+        @wraps(view)
+        def wrapper(*args, **kwargs):
+            return view(*args, **kwargs)
+        wrapper.query_budget = limit
+        return wrapper
+    return decorator
+
+
+class QueryStats:
+    """Query count, database time and executions per SQL shape of one request"""
+
+    # Collapse "IN (%s, %s, ...)" so lists of different lengths share a shape
+    IN_LIST = re.compile(r'IN \((?:%s, )*%s\)')
+
+    def __init__(self):
+        self.count = 0
+        self.duration = 0.0
+        self.shapes = {}
+
+    def __call__(self, execute, sql, params, many, context):
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.duration += time.perf_counter() - start
+            self.count += 1
+            shape = self.IN_LIST.sub('IN (...)', sql)
+            self.shapes[shape] = self.shapes.get(shape, 0) + 1
+
+    def repeated(self, threshold):
+        """(shape, executions) of the statements run at least threshold times, most frequent first"""
+        return sorted(
+            ((shape, count) for shape, count in self.shapes.items() if count >= threshold),
+            key=lambda item: -item[1]
+        )
+
+
+class QueryBudgetMiddleware:
+    """
+    Counts the queries and database time of every request, on all database
+    connections, through execute_wrapper so it works without DEBUG.
+
+    - Adds Server-Timing and X-DB-Queries headers
+    - Logs SQL shapes run WMS_QUERY_REPEAT_THRESHOLD times or more, the
+      signature of an N+1 loop over lazily loaded foreign keys
+    - Checks the budget set with @query_budget (or WMS_QUERY_BUDGET for all
+      views); exceeding it is logged, or raises QueryBudgetExceeded with
+      WMS_QUERY_BUDGET_STRICT, which makes the test client fail
+
+    Enabled by WMS_QUERY_INSTRUMENTATION, which defaults to DEBUG; the test
+    runner turns DEBUG off, so wmsprototype.test_settings enables it together
+    with strict mode. Queries of streamed responses run after the view
+    returns and are not counted.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.enabled = getattr(settings, 'WMS_QUERY_INSTRUMENTATION', settings.DEBUG)
+        self.strict = getattr(settings, 'WMS_QUERY_BUDGET_STRICT', False)
+        self.default_budget = getattr(settings, 'WMS_QUERY_BUDGET', None)
+        self.repeat_threshold = getattr(settings, 'WMS_QUERY_REPEAT_THRESHOLD', 5)
+
+    def __call__(self, request):
+        if not self.enabled:
+            return self.get_response(request)
+
+        stats = QueryStats()
+        request.query_budget = self.default_budget
+        with ExitStack() as stack:
+            for connection in connections.all():
+                stack.enter_context(connection.execute_wrapper(stats))
+            response = self.get_response(request)
+
+        response['X-DB-Queries'] = str(stats.count)
+        response['Server-Timing'] = f'db;dur={stats.duration * 1000:.1f};desc="{stats.count} queries"'
+
+        for shape, count in stats.repeated(self.repeat_threshold):
+            logger.warning('Possible N+1 on %s: %d executions of %s', request.path, count, shape)
+
+        budget = request.query_budget
+        if budget is not None and stats.count > budget:
+            message = f'{request.path} ran {stats.count} queries, over its budget of {budget}'
+            if self.strict:
+                raise QueryBudgetExceeded(message)
+            logger.warning(message)
+        return response
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        budget = getattr(view_func, 'query_budget', None)
+        if budget is not None:
+            request.query_budget = budget
@@ -0,0 +1,96 @@
+# Generated by Django 4.2.8 on 2026-10-18 20:42
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def fold_inventory_into_stock(apps, schema_editor):
+    """
+    Collapse the one-row-per-unit Inventories table into quantity buckets
+    keyed by (product, cell, expiration_date, serial).
+    """
+    Inventory = apps.get_model('wmsprototype', 'Inventory')
+    Stock = apps.get_model('wmsprototype', 'Stock')
+
+    buckets = Inventory.objects.values(
+        'product_id', 'cell_id', 'expiration_date', 'serial'
+    ).annotate(
+        quantity=models.Count('id'),
+        first_placed_at=models.Min('placed_at'),
+        last_moved_at=models.Max('moved_at'),
+        last_checked_at=models.Max('checked_at'),
+    ).order_by()
+
+    Stock.objects.bulk_create(
+        (
+            Stock(
+                product_id=bucket['product_id'],
+                cell_id=bucket['cell_id'],
+                expiration_date=bucket['expiration_date'],
+                serial=bucket['serial'],
+                quantity=bucket['quantity'],
+                placed_at=bucket['first_placed_at'],
+                moved_at=bucket['last_moved_at'],
+                checked_at=bucket['last_checked_at'],
+            )
+            for bucket in buckets.iterator()
+        ),
+        batch_size=1000,
+    )
+
+
+def expand_stock_into_inventory(apps, schema_editor):
+    """Recreate one Inventories row per unit held in each Stock bucket."""
+    Inventory = apps.get_model('wmsprototype', 'Inventory')
+    Stock = apps.get_model('wmsprototype', 'Stock')
+
+    Inventory.objects.bulk_create(
+        (
+            Inventory(
+                product_id=stock.product_id,
+                cell_id=stock.cell_id,
+                expiration_date=stock.expiration_date,
+                serial=stock.serial,
+                placed_at=stock.placed_at,
+                moved_at=stock.moved_at,
+                checked_at=stock.checked_at,
+            )
+            for stock in Stock.objects.filter(quantity__gt=0).iterator()
+            for _ in range(stock.quantity)
+        ),
+        batch_size=1000,
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('wmsprototype', '0007_alter_cell_level_alter_department_default_cell_and_more'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Stock',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('expiration_date', models.DateField(blank=True, null=True)),
+                ('serial', models.CharField(blank=True, max_length=255, null=True)),
+                ('quantity', models.IntegerField(default=0)),
+                ('placed_at', models.DateTimeField()),
+                ('moved_at', models.DateTimeField()),
+                ('checked_at', models.DateTimeField()),
+                ('cell', models.ForeignKey(db_column='cell_id', on_delete=django.db.models.deletion.PROTECT, to='wmsprototype.cell')),
+                ('product', models.ForeignKey(db_column='product_id', on_delete=django.db.models.deletion.PROTECT, to='wmsprototype.product')),
+            ],
+            options={
+                'verbose_name': 'Stock',
+                'verbose_name_plural': 'Stock',
+                'db_table': 'Stocks',
+                'unique_together': {('product', 'cell', 'expiration_date', 'serial')},
+            },
+        ),
+        migrations.RunPython(fold_inventory_into_stock, expand_stock_into_inventory),
+        migrations.DeleteModel(
+            name='Inventory',
+        ),
+    ]
@@ -0,0 +1,56 @@
+# Generated by Django 4.2.8 on 2026-10-18 20:44
+
+from django.db import migrations, models
+import django.db.models.deletion
+from django.db.models.functions import ExtractYear
+
+
+def seed_document_sequences(apps, schema_editor):
+    """Start every (document type, department, year) counter at the highest number already issued."""
+    Document = apps.get_model('wmsprototype', 'Document')
+    DocumentSequence = apps.get_model('wmsprototype', 'DocumentSequence')
+
+    issued = Document.objects.annotate(
+        year=ExtractYear('created_at')
+    ).values(
+        'document_type_id', 'origin_department_id', 'year'
+    ).annotate(
+        last_number=models.Max('document_number')
+    ).order_by()
+
+    DocumentSequence.objects.bulk_create([
+        DocumentSequence(
+            document_type_id=row['document_type_id'],
+            department_id=row['origin_department_id'],
+            year=row['year'],
+            last_number=row['last_number'],
+        )
+        for row in issued
+    ])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('wmsprototype', '0008_stock'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DocumentSequence',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('year', models.IntegerField()),
+                ('last_number', models.IntegerField(default=0)),
+                ('department', models.ForeignKey(db_column='department_id', on_delete=django.db.models.deletion.PROTECT, to='wmsprototype.department')),
+                ('document_type', models.ForeignKey(db_column='document_type_id', on_delete=django.db.models.deletion.PROTECT, to='wmsprototype.documenttype')),
+            ],
+            options={
+                'verbose_name': 'Document Sequence',
+                'verbose_name_plural': 'Document Sequences',
+                'db_table': 'Document_sequences',
+                'unique_together': {('document_type', 'department', 'year')},
+            },
+        ),
+        migrations.RunPython(seed_document_sequences, migrations.RunPython.noop),
+    ]
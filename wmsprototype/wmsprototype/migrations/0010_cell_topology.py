@@ -0,0 +1,55 @@
+# Generated by Django 4.2.8 on 2026-10-18 20:44
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def backfill_cell_topology(apps, schema_editor):
+    """Copy department, warehouse and the location label down onto every cell."""
+    Cell = apps.get_model('wmsprototype', 'Cell')
+
+    rows = Cell.objects.values_list(
+        'id',
+        'number',
+        'level__number',
+        'level__section__number',
+        'level__section__row__number',
+        'level__section__row__department__number',
+        'level__section__row__department_id',
+        'level__section__row__department__warehouse_id',
+    )
+    cells = []
+    for cell_id, number, level_num, section_num, row_num, dept_num, department_id, warehouse_id in rows:
+        cells.append(Cell(
+            id=cell_id,
+            department_id=department_id,
+            warehouse_id=warehouse_id,
+            path=f"{number}-{level_num}-{section_num}-{row_num}-{dept_num}",
+        ))
+    Cell.objects.bulk_update(cells, ['department', 'warehouse', 'path'], batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('wmsprototype', '0009_document_sequences'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='cell',
+            name='department',
+            field=models.ForeignKey(blank=True, db_column='department_id', editable=False, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='cells', to='wmsprototype.department'),
+        ),
+        migrations.AddField(
+            model_name='cell',
+            name='path',
+            field=models.CharField(blank=True, default='', editable=False, max_length=255),
+        ),
+        migrations.AddField(
+            model_name='cell',
+            name='warehouse',
+            field=models.ForeignKey(blank=True, db_column='warehouse_id', editable=False, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='cells', to='wmsprototype.warehouse'),
+        ),
+        migrations.RunPython(backfill_cell_topology, migrations.RunPython.noop),
+    ]
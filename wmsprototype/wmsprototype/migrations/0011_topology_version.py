@@ -0,0 +1,31 @@
+# Generated by Django 4.2.8 on 2026-10-18 20:45
+
+from django.db import migrations, models
+
+
+def create_topology_version(apps, schema_editor):
+    TopologyVersion = apps.get_model('wmsprototype', 'TopologyVersion')
+    TopologyVersion.objects.create(version=1)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('wmsprototype', '0010_cell_topology'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='TopologyVersion',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('version', models.BigIntegerField(default=0)),
+            ],
+            options={
+                'verbose_name': 'Topology Version',
+                'verbose_name_plural': 'Topology Version',
+                'db_table': 'Topology_version',
+            },
+        ),
+        migrations.RunPython(create_topology_version, migrations.RunPython.noop),
+    ]
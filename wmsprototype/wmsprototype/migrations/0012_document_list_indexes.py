@@ -0,0 +1,25 @@
+# Generated by Django 4.2.8 on 2026-10-18 20:46
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('wmsprototype', '0011_topology_version'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='document',
+            index=models.Index(fields=['-created_at', '-id'], name='documents_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='document',
+            index=models.Index(fields=['document_type', '-created_at', '-id'], name='documents_type_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='document',
+            index=models.Index(fields=['origin_department', '-created_at', '-id'], name='documents_dept_created_idx'),
+        ),
+    ]
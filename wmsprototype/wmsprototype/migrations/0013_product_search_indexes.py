@@ -0,0 +1,43 @@
+# Generated by Django 4.2.8 on 2026-10-18 20:48
+
+from django.db import migrations, models
+
+
+def create_search_indexes(apps, schema_editor):
+    # name__icontains compiles to UPPER("name"::text) LIKE UPPER(%s) on
+    # PostgreSQL, which a trigram GIN index over the same expression serves.
+    # ean__startswith is served by a pattern_ops btree whatever the collation.
+    # Other backends keep the plain btree indexes.
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    schema_editor.execute('CREATE EXTENSION IF NOT EXISTS pg_trgm')
+    schema_editor.execute(
+        'CREATE INDEX IF NOT EXISTS products_name_trgm_idx '
+        'ON "Products" USING gin (UPPER("name"::text) gin_trgm_ops)'
+    )
+    schema_editor.execute(
+        'CREATE INDEX IF NOT EXISTS products_ean_prefix_idx '
+        'ON "Products" ("ean" varchar_pattern_ops)'
+    )
+
+
+def drop_search_indexes(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    schema_editor.execute('DROP INDEX IF EXISTS products_name_trgm_idx')
+    schema_editor.execute('DROP INDEX IF EXISTS products_ean_prefix_idx')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('wmsprototype', '0012_document_list_indexes'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='product',
+            index=models.Index(fields=['name', 'id'], name='products_name_idx'),
+        ),
+        migrations.RunPython(create_search_indexes, drop_search_indexes),
+    ]
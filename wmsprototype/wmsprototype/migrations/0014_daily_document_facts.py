@@ -0,0 +1,66 @@
+# Generated by Django 4.2.8 on 2026-10-18 20:50
+
+from django.db import migrations, models
+import django.db.models.deletion
+from django.db.models import Count, DecimalField, F, Q, Sum
+from django.db.models.functions import TruncDate
+
+
+def fill_daily_document_facts(apps, schema_editor):
+    # Same selection as AnalyticsService.fact_documents at the time of writing
+    Document = apps.get_model('wmsprototype', 'Document')
+    DailyDocumentFact = apps.get_model('wmsprototype', 'DailyDocumentFact')
+
+    rows = Document.objects.filter(
+        (Q(document_type__group='Sklád') | Q(current_status='Completed')) & ~Q(current_status='Canceled')
+    ).annotate(
+        date=TruncDate('created_at')
+    ).values('date', 'document_type_id', 'origin_department_id').annotate(
+        quantity=Sum('documentproduct__amount_required'),
+        value=Sum(
+            F('documentproduct__amount_required') * F('documentproduct__unit_price'),
+            output_field=DecimalField()
+        ),
+        document_count=Count('id', distinct=True)
+    ).order_by()
+
+    DailyDocumentFact.objects.bulk_create([
+        DailyDocumentFact(
+            date=row['date'],
+            document_type_id=row['document_type_id'],
+            department_id=row['origin_department_id'],
+            quantity=row['quantity'] or 0,
+            value=row['value'] or 0,
+            document_count=row['document_count'],
+        )
+        for row in rows
+    ], batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('wmsprototype', '0013_product_search_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DailyDocumentFact',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('date', models.DateField()),
+                ('quantity', models.IntegerField(default=0)),
+                ('value', models.DecimalField(decimal_places=2, default=0, max_digits=14)),
+                ('document_count', models.IntegerField(default=0)),
+                ('department', models.ForeignKey(db_column='department_id', on_delete=django.db.models.deletion.PROTECT, to='wmsprototype.department')),
+                ('document_type', models.ForeignKey(db_column='document_type_id', on_delete=django.db.models.deletion.PROTECT, to='wmsprototype.documenttype')),
+            ],
+            options={
+                'verbose_name': 'Daily Document Fact',
+                'verbose_name_plural': 'Daily Document Facts',
+                'db_table': 'Daily_document_facts',
+                'unique_together': {('date', 'document_type', 'department')},
+            },
+        ),
+        migrations.RunPython(fill_daily_document_facts, migrations.RunPython.noop),
+    ]
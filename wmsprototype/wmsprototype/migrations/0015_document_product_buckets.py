@@ -0,0 +1,17 @@
+# Generated by Django 4.2.8 on 2026-10-18 20:53
+
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('wmsprototype', '0014_daily_document_facts'),
+    ]
+
+    operations = [
+        migrations.AlterUniqueTogether(
+            name='documentproduct',
+            unique_together={('document', 'product', 'cell', 'expiration_date', 'serial')},
+        ),
+    ]
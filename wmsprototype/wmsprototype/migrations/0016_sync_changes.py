@@ -0,0 +1,29 @@
+# Generated by Django 4.2.8 on 2026-10-18 20:56
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('wmsprototype', '0015_document_product_buckets'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SyncChange',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('model', models.CharField(max_length=45)),
+                ('object_id', models.BigIntegerField()),
+                ('is_deleted', models.BooleanField(default=False)),
+                ('changed_at', models.DateTimeField(auto_now=True, db_index=True)),
+            ],
+            options={
+                'verbose_name': 'Sync Change',
+                'verbose_name_plural': 'Sync Changes',
+                'db_table': 'Sync_changes',
+                'unique_together': {('model', 'object_id')},
+            },
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 4.2.8 on 2026-10-18 20:57
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('wmsprototype', '0016_sync_changes'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='cell',
+            name='barcode',
+            field=models.CharField(blank=True, db_index=True, max_length=45, null=True),
+        ),
+        migrations.AlterField(
+            model_name='document',
+            name='barcode',
+            field=models.CharField(db_index=True, max_length=45),
+        ),
+    ]
@@ -0,0 +1,21 @@
+# Generated by Django 4.2.8 on 2026-10-18 21:05
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('wmsprototype', '0017_barcode_indexes'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='document',
+            index=models.Index(fields=['document_type', 'origin_department', '-created_at'], name='documents_type_dept_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='document',
+            index=models.Index(fields=['current_status'], name='documents_status_idx'),
+        ),
+    ]
@@ -0,0 +1,67 @@
+# Generated by Django 4.2.8 on 2026-10-18 22:36
+
+from django.db import migrations, models
+
+
+def merge_duplicate_buckets(apps, schema_editor):
+    """
+    Fold buckets that concurrent receipts created twice (possible while the
+    unique index ignored NULL expiration dates and serials) into the oldest one.
+    """
+    Stock = apps.get_model('wmsprototype', 'Stock')
+
+    duplicates = Stock.objects.values(
+        'product_id', 'cell_id', 'expiration_date', 'serial'
+    ).annotate(
+        buckets=models.Count('id'),
+        keep_id=models.Min('id'),
+        total=models.Sum('quantity'),
+        first_placed_at=models.Min('placed_at'),
+        last_moved_at=models.Max('moved_at'),
+        last_checked_at=models.Max('checked_at'),
+    ).filter(buckets__gt=1).order_by()
+
+    for bucket in duplicates.iterator():
+        Stock.objects.filter(
+            product_id=bucket['product_id'],
+            cell_id=bucket['cell_id'],
+            expiration_date=bucket['expiration_date'],
+            serial=bucket['serial'],
+        ).exclude(id=bucket['keep_id']).delete()
+        Stock.objects.filter(id=bucket['keep_id']).update(
+            quantity=bucket['total'],
+            placed_at=bucket['first_placed_at'],
+            moved_at=bucket['last_moved_at'],
+            checked_at=bucket['last_checked_at'],
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('wmsprototype', '0018_document_filter_indexes'),
+    ]
+
+    operations = [
+        migrations.RunPython(merge_duplicate_buckets, migrations.RunPython.noop),
+        migrations.AlterUniqueTogether(
+            name='stock',
+            unique_together=set(),
+        ),
+        migrations.AddConstraint(
+            model_name='stock',
+            constraint=models.UniqueConstraint(fields=('product', 'cell', 'expiration_date', 'serial'), name='stocks_bucket_uniq'),
+        ),
+        migrations.AddConstraint(
+            model_name='stock',
+            constraint=models.UniqueConstraint(condition=models.Q(('expiration_date__isnull', True)), fields=('product', 'cell', 'serial'), name='stocks_bucket_no_expiration_uniq'),
+        ),
+        migrations.AddConstraint(
+            model_name='stock',
+            constraint=models.UniqueConstraint(condition=models.Q(('serial__isnull', True)), fields=('product', 'cell', 'expiration_date'), name='stocks_bucket_no_serial_uniq'),
+        ),
+        migrations.AddConstraint(
+            model_name='stock',
+            constraint=models.UniqueConstraint(condition=models.Q(('expiration_date__isnull', True), ('serial__isnull', True)), fields=('product', 'cell'), name='stocks_bucket_plain_uniq'),
+        ),
+    ]
@@ -0,0 +1,28 @@
+# Generated by Django 4.2.8 on 2026-10-18 22:39
+
+from django.db import migrations, models
+
+
+def mark_stock_documents_posted(apps, schema_editor):
+    """
+    Sklád documents were posted to stock when they were created, so the
+    existing ones count as posted at their creation time.
+    """
+    Document = apps.get_model('wmsprototype', 'Document')
+    Document.objects.filter(document_type__group='Sklád').update(posted_at=models.F('created_at'))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('wmsprototype', '0019_stock_bucket_constraints'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='document',
+            name='posted_at',
+            field=models.DateTimeField(blank=True, editable=False, null=True),
+        ),
+        migrations.RunPython(mark_stock_documents_posted, migrations.RunPython.noop),
+    ]
@@ -132,25 +132,60 @@ class Level(models.Model):
 
 class Cell(models.Model):
     number = models.IntegerField()
-    barcode = models.CharField(max_length=45, null=True, blank=True)
+    barcode = models.CharField(max_length=45, null=True, blank=True, db_index=True)
     type = models.CharField(max_length=45, null=True, blank=True)
     level = models.ForeignKey(
         Level,
         on_delete=models.CASCADE,
         db_column='level_id'
     )
+    # Denormalized from level -> section -> row -> department -> warehouse,
+    # kept in sync by signals and the update_cell_topology command
+    department = models.ForeignKey(
+        Department,
+        on_delete=models.CASCADE,
+        null=True,
+        blank=True,
+        editable=False,
+        related_name='cells',
+        db_column='department_id'
+    )
+    warehouse = models.ForeignKey(
+        Warehouse,
+        on_delete=models.CASCADE,
+        null=True,
+        blank=True,
+        editable=False,
+        related_name='cells',
+        db_column='warehouse_id'
+    )
+    path = models.CharField(max_length=255, blank=True, default='', editable=False)
 
     class Meta:
         verbose_name = 'Cell'
         verbose_name_plural = 'Cells'
         db_table = 'Cells'
 
-    def __str__(self):
+    def build_path(self):
         level_num = self.level.number
         section_num = self.level.section.number
         row_num = self.level.section.row.number
         dept_num = self.level.section.row.department.number
-        return f"{self.number}-{level_num}-{section_num}-{row_num}-{dept_num} {self.barcode or ""}"
+        return f"{self.number}-{level_num}-{section_num}-{row_num}-{dept_num}"
+
+    def __str__(self):
+        return f"{self.path or self.build_path()} {self.barcode or ""}"
+
+class TopologyVersion(models.Model):
+    version = models.BigIntegerField(default=0)
+
+    class Meta:
+        verbose_name = 'Topology Version'
+        verbose_name_plural = 'Topology Version'
+        db_table = 'Topology_version'
+
+    def __str__(self):
+        return f"Topology version {self.version}"
 
 class Product(models.Model):
     name = models.CharField(max_length=255)
@@ -164,11 +199,15 @@ class Product(models.Model):
         verbose_name = 'Product'
         verbose_name_plural = 'Products'
         db_table = 'Products'
+        indexes = [
+            # Catalogue ordering; name/EAN search indexes for PostgreSQL are in migration 0013
+            models.Index(fields=['name', 'id'], name='products_name_idx'),
+        ]
 
     def __str__(self):
         return f"{self.ean} {self.name} ({self.scu or 'No SKU'})"
 
-class Inventory(models.Model):
+class Stock(models.Model):
     product = models.ForeignKey(
         Product,
         on_delete=models.PROTECT,
@@ -181,19 +220,44 @@ class Inventory(models.Model):
     )
     expiration_date = models.DateField(null=True, blank=True)
     serial = models.CharField(max_length=255, null=True, blank=True)
-    placed_at = models.DateTimeField()  
-    moved_at = models.DateTimeField()  
-    checked_at = models.DateTimeField()  
+    quantity = models.IntegerField(default=0)
+    placed_at = models.DateTimeField()
+    moved_at = models.DateTimeField()
+    checked_at = models.DateTimeField()
 
     class Meta:
-        verbose_name = 'Inventory'
-        verbose_name_plural = 'Inventories'
-        db_table = 'Inventories'
+        verbose_name = 'Stock'
+        verbose_name_plural = 'Stock'
+        db_table = 'Stocks'
+        # One bucket per (product, cell, expiration_date, serial). NULLs never
+        # compare equal in a unique index, so every combination of missing
+        # expiration date and serial gets its own partial index
+        constraints = [
+            models.UniqueConstraint(
+                fields=['product', 'cell', 'expiration_date', 'serial'],
+                name='stocks_bucket_uniq'
+            ),
+            models.UniqueConstraint(
+                fields=['product', 'cell', 'serial'],
+                condition=models.Q(expiration_date__isnull=True),
+                name='stocks_bucket_no_expiration_uniq'
+            ),
+            models.UniqueConstraint(
+                fields=['product', 'cell', 'expiration_date'],
+                condition=models.Q(serial__isnull=True),
+                name='stocks_bucket_no_serial_uniq'
+            ),
+            models.UniqueConstraint(
+                fields=['product', 'cell'],
+                condition=models.Q(expiration_date__isnull=True, serial__isnull=True),
+                name='stocks_bucket_plain_uniq'
+            ),
+        ]
 
     def __str__(self):
         prod_name = self.product.name if self.product else 'N/A'
-        cell_info = f"{self.cell.number}-{self.cell.level.number}-{self.cell.level.section.number}-{self.cell.level.section.row.number}-{self.cell.level.section.row.department.number}"
-        return f"Inventory ID {self.pk}: {prod_name} in {cell_info}"
+        cell_info = self.cell.path or self.cell.build_path()
+        return f"{self.quantity} x {prod_name} in {cell_info}"
 
 class AppUser(models.Model):
     user = models.OneToOneField(User, on_delete=models.CASCADE)
@@ -244,6 +308,30 @@ class Status(models.Model):
         return f"{self.name} (Type: {doc_type_name})"
 
 
+class DocumentSequence(models.Model):
+    document_type = models.ForeignKey(
+        DocumentType,
+        on_delete=models.PROTECT,
+        db_column='document_type_id'
+    )
+    department = models.ForeignKey(
+        Department,
+        on_delete=models.PROTECT,
+        db_column='department_id'
+    )
+    year = models.IntegerField()
+    last_number = models.IntegerField(default=0)
+
+    class Meta:
+        verbose_name = 'Document Sequence'
+        verbose_name_plural = 'Document Sequences'
+        db_table = 'Document_sequences'
+        unique_together = ('document_type', 'department', 'year')
+
+    def __str__(self):
+        return f"{self.document_type.symbol}/{self.year}/{self.department.number}: {self.last_number}"
+
+
 class Document(models.Model):
     document_type = models.ForeignKey(
         DocumentType,
@@ -251,7 +339,7 @@ class Document(models.Model):
         db_column='document_type_id'
     )
     document_number = models.IntegerField()
-    barcode = models.CharField(max_length=45)
+    barcode = models.CharField(max_length=45, db_index=True)
     origin_department = models.ForeignKey(
         Department,
         on_delete=models.PROTECT,
@@ -282,6 +370,8 @@ class Document(models.Model):
     updated_at = models.DateTimeField()
     ended_at = models.DateTimeField(null=True, blank=True)
     required_at = models.DateTimeField(null=True, blank=True)
+    # Set by DocumentService.apply_changes once a Sklád document moved the stock
+    posted_at = models.DateTimeField(null=True, blank=True, editable=False)
     created_by = models.ForeignKey(
         AppUser,
         on_delete=models.PROTECT,
@@ -332,14 +422,25 @@ class Document(models.Model):
         verbose_name = 'Document'
         verbose_name_plural = 'Documents'
         db_table = 'Documents'
+        indexes = [
+            models.Index(fields=['-created_at', '-id'], name='documents_created_idx'),
+            models.Index(fields=['document_type', '-created_at', '-id'], name='documents_type_created_idx'),
+            models.Index(fields=['origin_department', '-created_at', '-id'], name='documents_dept_created_idx'),
+            models.Index(fields=['document_type', 'origin_department', '-created_at'], name='documents_type_dept_idx'),
+            models.Index(fields=['current_status'], name='documents_status_idx'),
+        ]
 
     def __str__(self):
         doc_type_symbol = self.document_type.symbol if self.document_type else 'N/A'
         return f"{self.barcode}"
     
     def update_status(self, status):
+        from .services import AnalyticsService
+
+        previous_status = self.current_status
         self.current_status = status.name
         self.save()
+        AnalyticsService.record_status_change(self, previous_status)
 
     
 
@@ -370,7 +471,7 @@ class DocumentProduct(models.Model):
         verbose_name = 'Document Product Item'
         verbose_name_plural = 'Document Product Items'
         db_table = 'Documents_has_Products'
-        unique_together = ('document', 'product') 
+        unique_together = ('document', 'product', 'cell', 'expiration_date', 'serial')
 
     def __str__(self):
         doc_num = self.document.document_number if self.document else 'N/A'
@@ -418,3 +519,52 @@ class DocumentStatus(models.Model):
         user_name = f"{self.user.user.username}" if self.user else 'N/A'
         ts = self.created_at.strftime('%Y-%m-%d %H:%M') if self.created_at else 'N/A'
         return f"Doc {doc_num} - Status '{status_name}' set by {user_name} at {ts}"
+
+
+class DailyDocumentFact(models.Model):
+    date = models.DateField()
+    document_type = models.ForeignKey(
+        DocumentType,
+        on_delete=models.PROTECT,
+        db_column='document_type_id'
+    )
+    department = models.ForeignKey(
+        Department,
+        on_delete=models.PROTECT,
+        db_column='department_id'
+    )
+    quantity = models.IntegerField(default=0)
+    value = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+    document_count = models.IntegerField(default=0)
+
+    class Meta:
+        verbose_name = 'Daily Document Fact'
+        verbose_name_plural = 'Daily Document Facts'
+        db_table = 'Daily_document_facts'
+        unique_together = ('date', 'document_type', 'department')
+
+    def __str__(self):
+        return f"{self.date} {self.document_type.symbol}/{self.department.number}: {self.document_count} docs, {self.quantity} units"
+
+
+class SyncChange(models.Model):
+    """
+    Change log for delta sync of handheld terminals.
+
+    One row per (model, object_id), replaced on every change so that the
+    auto-increment id acts as a monotonic change sequence and the log stays
+    as small as the tracked tables. Deleted objects keep a tombstone row.
+    """
+    model = models.CharField(max_length=45)
+    object_id = models.BigIntegerField()
+    is_deleted = models.BooleanField(default=False)
+    changed_at = models.DateTimeField(auto_now=True, db_index=True)
+
+    class Meta:
+        verbose_name = 'Sync Change'
+        verbose_name_plural = 'Sync Changes'
+        db_table = 'Sync_changes'
+        unique_together = ('model', 'object_id')
+
+    def __str__(self):
+        return f"#{self.id} {self.model} {self.object_id}{' (deleted)' if self.is_deleted else ''}"
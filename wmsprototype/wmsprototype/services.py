@@ -1,127 +1,508 @@
 from django.utils import timezone
-from django.db.models import Sum, Count, F, Q, DecimalField, Case, When, Value, IntegerField
-from django.db.models.functions import TruncDate
+from django.db import IntegrityError, transaction
+from django.core.cache import cache
+from django.core.paginator import Paginator
+from django.db.models import Sum, Count, Max, F, Q, DecimalField, Case, When, Value, IntegerField, OuterRef, Subquery, ExpressionWrapper
+from django.db.models.functions import Coalesce, Round, TruncDate
+import base64
 import datetime
+import threading
+import time
+from array import array
+from bisect import bisect_left
+from collections import namedtuple
+from contextlib import contextmanager
+from decimal import Decimal
 from .models import *
+from .cache import LRUCache, WidgetCache
+
+
+# The DocumentProduct fields a line contributes to its document's totals with
+LineValues = namedtuple('LineValues', ['document_id', 'product_id', 'amount_required', 'amount_added', 'unit_price'])
+
 
 class DocumentService:
+
+    DOCUMENT_PAGE_SIZE = 50
+    INVENTORY_CHUNK_SIZE = 2000
+    # symbol -> DocumentType, see get_document_type
+    _document_types = {}
+    # Totals changes gathered by collect_totals, per thread
+    _collected_totals = threading.local()
     
     @staticmethod
-    def generate_document_number(document_type, doc_department):
-        current_year = timezone.now().year
-        # Get count of documents for this type in the current year
-        count = Document.objects.filter(
-            document_type=document_type, 
-            created_at__year=current_year,
-            origin_department=doc_department
-        ).count() + 1
+    def encode_document_cursor(document):
+        """Opaque cursor pointing just after a document in (-created_at, -id) order"""
+        raw = f"{document.created_at.isoformat()}|{document.id}"
+        return base64.urlsafe_b64encode(raw.encode()).decode()
+
+    @staticmethod
+    def decode_document_cursor(cursor):
+        """
+        Returns:
+            Tuple of (created_at, id), or None if the cursor is malformed
+        """
+        try:
+            created_at, document_id = base64.urlsafe_b64decode(cursor.encode()).decode().split('|')
+            return datetime.datetime.fromisoformat(created_at), int(document_id)
+        except (ValueError, UnicodeDecodeError):
+            return None
+
+    @staticmethod
+    def get_documents_page(doc_type_id=None, department_id=None, cursor=None, limit=DOCUMENT_PAGE_SIZE):
+        """
+        Get one page of documents, newest first, using keyset pagination on (created_at, id)
+        
+        Args:
+            doc_type_id: Only documents of this DocumentType id
+            department_id: Only documents from this origin Department id
+            cursor: Cursor returned with the previous page, None for the first page
+            limit: Page size
+            
+        Returns:
+            Tuple of (list of Documents, cursor of the next page or None)
+        """
+        documents = Document.objects.select_related(
+            'document_type', 'origin_department', 'destinate_department'
+        ).order_by('-created_at', '-id')
+
+        if doc_type_id:
+            documents = documents.filter(document_type_id=doc_type_id)
+        if department_id:
+            documents = documents.filter(origin_department_id=department_id)
+
+        position = DocumentService.decode_document_cursor(cursor) if cursor else None
+        if position:
+            created_at, document_id = position
+            documents = documents.filter(
+                Q(created_at__lt=created_at) | Q(created_at=created_at, id__lt=document_id)
+            )
+
+        # Fetch one extra row to know whether another page follows
+        page = list(documents[:limit + 1])
+        next_cursor = None
+        if len(page) > limit:
+            page = page[:limit]
+            next_cursor = DocumentService.encode_document_cursor(page[-1])
+        return page, next_cursor
+
+    @staticmethod
+    def get_open_documents(warehouse_id):
+        """
+        Get the open task documents (FVO, ICO, IPO, MMO, TRO) of a warehouse, newest first
+
+        Returns:
+            List of Documents with their type and departments loaded
+        """
+        return list(Document.objects.filter(
+            document_type__symbol__in=['FVO', 'ICO', 'IPO', 'MMO', 'TRO'],
+            origin_department__warehouse_id=warehouse_id
+        ).exclude(
+            current_status__in=[AnalyticsService.COMPLETED_STATUS, AnalyticsService.CANCELED_STATUS]
+        ).select_related(
+            'document_type', 'origin_department', 'destinate_department'
+        ).order_by('-created_at'))
+
+    @staticmethod
+    def generate_document_number(document_type, doc_department, year=None):
+        return DocumentService.reserve_document_numbers(document_type, doc_department, 1, year)[0]
+
+    @staticmethod
+    def reserve_document_numbers(document_type, doc_department, count, year=None):
+        """
+        Reserve a block of consecutive document numbers for a document type and department
         
-        return count
+        Args:
+            document_type: DocumentType of the documents being numbered
+            doc_department: Origin Department of the documents
+            count: How many numbers to hand out at once
+            year: Numbering year (default: current year)
+            
+        Returns:
+            range of the reserved numbers
+        """
+        year = year or timezone.now().year
+        sequence = DocumentSequence.objects.filter(
+            document_type=document_type,
+            department=doc_department,
+            year=year
+        )
+
+        # The UPDATE locks the counter row until the transaction ends, so
+        # concurrent callers get disjoint blocks and the read below is ours
+        with transaction.atomic():
+            updated = sequence.update(last_number=F('last_number') + count)
+            if not updated:
+                # First document of the year: continue from any numbers already issued
+                issued = Document.objects.filter(
+                    document_type=document_type,
+                    created_at__year=year,
+                    origin_department=doc_department
+                ).aggregate(last=Max('document_number'))['last'] or 0
+                try:
+                    with transaction.atomic():
+                        DocumentSequence.objects.create(
+                            document_type=document_type,
+                            department=doc_department,
+                            year=year,
+                            last_number=issued + count
+                        )
+                except IntegrityError:
+                    # A concurrent request created the counter first
+                    sequence.update(last_number=F('last_number') + count)
+            last_number = sequence.values_list('last_number', flat=True).get()
+
+        return range(last_number - count + 1, last_number + 1)
+
+    @staticmethod
+    def get_document_type(symbol):
+        """
+        DocumentType by symbol, cached per process
+
+        Document types are seeded by migrations and never change at runtime.
+        """
+        document_type = DocumentService._document_types.get(symbol)
+        if document_type is None:
+            document_type = DocumentType.objects.get(symbol=symbol)
+            DocumentService._document_types[symbol] = document_type
+        return document_type
 
     @staticmethod
     def close_inventory(document, request):
+        """
+        Close an ICO/IPO count by posting its deviations from the book stock
 
-        pd = DocumentService.prepare_document_for_first_save(Document(
-            document_type = DocumentType.objects.get(symbol="IP+") if document.document_type.symbol == "IPO" else DocumentType.objects.get(symbol="IC+"),
-            origin_department = document.origin_department,
-            created_by = request.user.appuser,
-            linked_document = document
-        ))
-        pd.save()
-        md = DocumentService.prepare_document_for_first_save(Document(
-            document_type = DocumentType.objects.get(symbol="IP-") if document.document_type.symbol == "IPO" else DocumentType.objects.get(symbol="IC-"),
-            origin_department = document.origin_department,
-            created_by = request.user.appuser,
-            linked_document = document
-        ))
-        md.save()
-
-        for dp in document.documentproduct_set.all():
-            if dp.amount_required < dp.amount_added:
-                DocumentProduct.objects.create(
-                    document = pd,
-                    product = dp.product,
-                    amount_required = dp.amount_required,
-                    amount_added = dp.amount_added - dp.amount_required,
-                    cell = dp.cell,
-                    expiration_date = dp.expiration_date,
-                    serial = dp.serial,
-                    unit_price = dp.unit_price
-                )
-            if dp.amount_required > dp.amount_added:
-                DocumentProduct.objects.create(
-                    document = md,
-                    product = dp.product,
-                    amount_required = dp.amount_required - dp.amount_added,
-                    cell = dp.cell,
-                    expiration_date = dp.expiration_date,
-                    serial = dp.serial,
-                    unit_price = dp.unit_price
+        Surplus lines (counted more than required) go to an IC+/IP+ document
+        and shortages to an IC-/IP- one, both linked to the count and posted
+        immediately. Lines that were never counted (amount_added unset) are
+        left out. Adjustment documents without lines are not created.
+
+        Returns:
+            List of the posted adjustment documents
+        """
+        plus_symbol, minus_symbol = ("IP+", "IP-") if document.document_type.symbol == "IPO" else ("IC+", "IC-")
+
+        # One pass over the count sheet, without loading model instances
+        surplus = []
+        shortage = []
+        lines = document.documentproduct_set.values_list(
+            'product_id', 'cell_id', 'expiration_date', 'serial', 'unit_price', 'amount_required', 'amount_added'
+        ).order_by('id')
+        for product_id, cell_id, expiration_date, serial, unit_price, required, added in lines.iterator(chunk_size=DocumentService.INVENTORY_CHUNK_SIZE):
+            if added is None or added == required:
+                continue
+            difference = abs(added - required)
+            line = DocumentProduct(
+                product_id = product_id,
+                amount_required = difference,
+                amount_added = difference,
+                cell_id = cell_id,
+                expiration_date = expiration_date,
+                serial = serial,
+                unit_price = unit_price
+            )
+            (surplus if added > required else shortage).append(line)
+
+        adjustments = []
+        with SyncService.collect_changes():
+            for symbol, adjustment_lines in ((plus_symbol, surplus), (minus_symbol, shortage)):
+                if not adjustment_lines:
+                    continue
+                adjustment = DocumentService.prepare_document_for_first_save(Document(
+                    document_type = DocumentService.get_document_type(symbol),
+                    origin_department = document.origin_department,
+                    created_by_id = (getattr(request, 'wms_user', None) or UserService.resolve(request.user)).id,
+                    linked_document = document
+                ), request=request)
+
+                for line in adjustment_lines:
+                    line.document = adjustment
+                DocumentProduct.objects.bulk_create(adjustment_lines, batch_size=DocumentService.INVENTORY_CHUNK_SIZE)
+                DocumentService.adjust_totals(
+                    [(DocumentService.line_values(line), 1) for line in adjustment_lines], documents=[adjustment]
                 )
-                
+                DocumentService.apply_changes(adjustment)
+                adjustments.append(adjustment)
 
-        
+        return adjustments
 
     @staticmethod
     def apply_changes(document):
-        for dp in document.documentproduct_set.all():
-            for i in range(dp.amount_required):
-                if document.document_type.symbol in ["BO", "WM+"]:
-                    inventory = Inventory.objects.create(
-                    product=dp.product,
-                    cell = document.origin_department.default_cell,
-                    expiration_date = dp.expiration_date,
-                    serial = dp.serial,
-                    placed_at = timezone.now(),
-                    moved_at = timezone.now(),
-                    checked_at = timezone.now(),
+        report = PostingEngine(document).post()
+        document.posted_at = timezone.now()
+        document.save()
+        AnalyticsService.record_posting(document)
+        WidgetCache.invalidate()
+        return report
+
+    @staticmethod
+    def line_quantity():
+        """Quantity a line counts with in totals: amount_added once set, amount_required before"""
+        return Case(
+            When(Q(amount_added__isnull=False) & ~Q(amount_added=0), then=F('amount_added')),
+            default=Coalesce(F('amount_required'), 0),
+            output_field=IntegerField()
+        )
+
+    @staticmethod
+    def line_values(line):
+        """LineValues of a DocumentProduct, e.g. to remember them before it changes"""
+        return LineValues(line.document_id, line.product_id, line.amount_required, line.amount_added, line.unit_price)
+
+    @staticmethod
+    def product_weights(product_ids):
+        """Product id -> weight in grams"""
+        return dict(Product.objects.filter(id__in=set(product_ids)).values_list('id', 'weight'))
+
+    @staticmethod
+    def line_totals(changes, weights=None):
+        """
+        Sum what lines add to or take from their documents' totals
+
+        total_quantity counts amount_required; total_price and total_weight
+        count the same quantity as line_quantity.
+
+        Args:
+            changes: Iterable of (LineValues, sign), sign 1 for a line added and -1 for one removed
+            weights: Product id -> weight; missing products are loaded with product_weights
+
+        Returns:
+            Dictionary document id -> [quantity, price, weight in kg];
+            lines of unsaved documents are summed under None
+        """
+        changes = [(values, sign) for values, sign in changes if values is not None]
+        missing = {values.product_id for values, sign in changes} - set(weights or ())
+        if missing:
+            weights = {**(weights or {}), **DocumentService.product_weights(missing)}
+
+        totals = {}
+        for values, sign in changes:
+            quantity = values.amount_added if values.amount_added else (values.amount_required or 0)
+            document_totals = totals.setdefault(values.document_id, [0, Decimal(0), Decimal(0)])
+            document_totals[0] += sign * (values.amount_required or 0)
+            if values.unit_price is not None:
+                document_totals[1] += sign * Decimal(values.unit_price) * quantity
+            if weights.get(values.product_id) is not None:
+                document_totals[2] += sign * Decimal(weights[values.product_id]) * quantity / 1000
+        return totals
+
+    @staticmethod
+    def adjust_totals(changes, documents=(), weights=None):
+        """
+        Apply line changes to document totals as deltas, with one UPDATE per
+        document, instead of recomputing them from all lines
+
+        Called through queue_totals by the DocumentProduct signals for single
+        lines; bulk paths (bulk_create, queryset update/delete) have to call
+        it themselves.
+        Totals without any priced or weighed line stay empty. Documents
+        already counted in the daily facts have their facts moved as well.
+
+        Args:
+            changes: Iterable of (LineValues, sign), see line_totals
+            documents: Document instances held in memory, updated as well so
+                that saving them later does not write the old totals back
+            weights: Product id -> weight, see line_totals
+        """
+        changes = list(changes)
+        documents = list(documents)
+        totals = DocumentService.line_totals(changes, weights)
+        in_memory = {document.pk: document for document in documents}
+        updated = []
+
+        for document_id, (quantity, price, weight) in totals.items():
+            if document_id is None:
+                continue
+            fields = {}
+            if quantity:
+                fields['total_quantity'] = F('total_quantity') + quantity
+            if price:
+                fields['total_price'] = Round(Coalesce(F('total_price'), 0.0) + float(price), 2)
+            if weight:
+                fields['total_weight'] = ExpressionWrapper(
+                    Coalesce(F('total_weight'), Value(Decimal(0))) + Value(weight),
+                    output_field=DecimalField(max_digits=10, decimal_places=2)
                 )
-                elif document.document_type.symbol in ["IC+", "IP+", "NN+", "PZ"]:
-                    inventory = Inventory.objects.create(
-                        product=dp.product,
-                        cell = dp.cell,
-                        expiration_date = dp.expiration_date,
-                        serial = dp.serial,
-                        placed_at = timezone.now(),
-                        moved_at = timezone.now(),
-                        checked_at = timezone.now(),
-                    )
-                elif document.document_type.symbol in ["IC-", "IP-", "NN-", "FV", "RW-"]:
-                    inventory_item = Inventory.objects.filter(
-                        product=dp.product,
-                        cell = dp.cell,
-                        expiration_date = dp.expiration_date,
-                        serial = dp.serial
-                    ).first()
-                    
-                    if inventory_item:
-                        inventory_item.delete()
-        document.save()    
-    
+            if not fields:
+                continue
+            Document.objects.filter(pk=document_id).update(**fields)
+            updated.append(document_id)
+
+            document = in_memory.get(document_id)
+            if document is not None:
+                if quantity:
+                    document.total_quantity = (document.total_quantity or 0) + quantity
+                if price:
+                    document.total_price = round((document.total_price or 0) + float(price), 2)
+                if weight:
+                    document.total_weight = Decimal(document.total_weight or 0) + weight
+
+        # update() sends no post_save, log the documents for terminal sync here
+        if updated:
+            SyncService.record(Document, updated)
+        AnalyticsService.record_line_changes(changes, documents)
+
+    @staticmethod
+    @contextmanager
+    def collect_totals():
+        """
+        Gather the totals changes of lines saved or deleted one by one, as a
+        formset does, and apply them when the block exits: one UPDATE and one
+        sync change per document instead of one per line
+
+        Nested blocks leave the changes to the outermost one. Nothing is
+        applied when the block raises.
+        """
+        state = DocumentService._collected_totals
+        if getattr(state, 'changes', None) is not None:
+            yield
+            return
+
+        state.changes, state.documents, state.weights = [], {}, {}
+        try:
+            yield
+            changes, documents, weights = state.changes, state.documents, state.weights
+        finally:
+            state.changes = state.documents = state.weights = None
+        if changes:
+            DocumentService.adjust_totals(changes, documents=documents.values(), weights=weights)
+
+    @staticmethod
+    def queue_totals(changes, documents=(), weights=None):
+        """
+        adjust_totals for the changes of one line, deferred to the end of the
+        enclosing collect_totals block if there is one
+
+        Args:
+            See adjust_totals
+        """
+        state = DocumentService._collected_totals
+        if getattr(state, 'changes', None) is None:
+            DocumentService.adjust_totals(changes, documents=documents, weights=weights)
+            return
+        state.changes.extend(changes)
+        for document in documents:
+            state.documents.setdefault(document.pk, document)
+        state.weights.update(weights or {})
+
+    @staticmethod
+    def calculate_totals(document_ids):
+        """
+        Compute total price and weight of documents in one grouped query
+
+        Args:
+            document_ids: Iterable of document ids
+
+        Returns:
+            Dictionary document id -> (total price, total weight in kg);
+            documents without lines are missing
+        """
+        quantity = DocumentService.line_quantity()
+        rows = DocumentProduct.objects.filter(
+            document_id__in=list(document_ids)
+        ).values('document_id').annotate(
+            price=Sum(F('unit_price') * quantity, output_field=DecimalField(max_digits=14, decimal_places=2)),
+            grams=Sum(F('product__weight') * quantity, output_field=IntegerField())
+        ).order_by().values_list('document_id', 'price', 'grams')
+
+        return {
+            document_id: (
+                Decimal(price or 0).quantize(Decimal('0.01')),
+                (Decimal(grams or 0) / 1000).quantize(Decimal('0.01'))
+            )
+            for document_id, price, grams in rows
+        }
+
+    @staticmethod
+    def update_totals(document_ids, force=False):
+        """
+        Recalculate total_price and total_weight of documents with calculate_totals
+        and save them with one bulk_update
+
+        Args:
+            document_ids: Ids of one chunk of documents
+            force: Overwrite totals that are already set; otherwise only missing ones are filled
+
+        Returns:
+            Number of documents updated
+        """
+        totals = DocumentService.calculate_totals(document_ids)
+        documents = []
+        for document in Document.objects.filter(id__in=list(totals)).only('id', 'total_price', 'total_weight'):
+            price, weight = totals[document.id]
+            changed = False
+            if (force or document.total_price is None) and price > 0:
+                document.total_price = float(price)
+                changed = True
+            if (force or document.total_weight is None) and weight > 0:
+                document.total_weight = weight
+                changed = True
+            if changed:
+                documents.append(document)
+
+        with transaction.atomic():
+            Document.objects.bulk_update(documents, ['total_price', 'total_weight'])
+            SyncService.record(Document, [document.id for document in documents])
+        return len(documents)
+
     @staticmethod
     def generate_barcode(document_type, document_number, document_year, document_month, document_department_number):
         barcode_value = f"{document_type.symbol}/{document_number}/{document_year}{document_month}/{document_department_number}"
         return barcode_value
 
     @staticmethod
-    def prepare_document_for_first_save(document, user=None, request=None):
+    def fill_new_document(document, document_number, now):
+        """
+        Set the number, barcode, initial status, address and timestamps of a new document
 
-        document.pk = Document.objects.count() + 1
-        document.document_number = DocumentService.generate_document_number(document.document_type, document.origin_department)
+        Args:
+            document: Unsaved Document with document_type and origin_department set
+            document_number: Number reserved for the document
+            now: Creation time
+        """
+        document.document_number = document_number
         
         # Temporary set 0, will change latter in views.py
-        document.total_quantity = 0
+        document.total_quantity = document.total_quantity or 0
              
         document.barcode = DocumentService.generate_barcode(
             document.document_type, 
             ("0" * (4 - len(str(document.document_number))) + str(document.document_number)),
-            str(timezone.now().year)[-2:],
-            ("0" * (2 - len(str(timezone.now().month))) + str(timezone.now().month)),
+            str(now.year)[-2:],
+            ("0" * (2 - len(str(now.month))) + str(now.month)),
             document.origin_department.number
         )
+
+        if document.document_type.symbol in ["FVO", "ICO", "IPO", "MMO", "TRO"]:
+            document.current_status = "Generated"
+        else: 
+            document.current_status = "Created"
+
+        if document.document_type.symbol == 'FVO' and document.destinate_department:
+            # Ship to the warehouse of the destination department
+            document.address_id = document.destinate_department.warehouse.address_id
+
+        if document.linked_document:
+            ld = document.linked_document
+            if document.document_type.symbol == 'TRO' or document.document_type.symbol == 'FVO':
+                document.address = ld.address
+                document.carrier = ld.carrier
+
+        document.created_at = now
+        document.updated_at = now
+
+    @staticmethod
+    def prepare_document_for_first_save(document, user=None, request=None):
+
+        now = timezone.now()
+        DocumentService.fill_new_document(
+            document,
+            DocumentService.generate_document_number(document.document_type, document.origin_department),
+            now
+        )
         
-        current_user = AppUser.objects.filter(user=request.user).first()
-        document.verified_by = current_user
+        current_user = getattr(request, 'wms_user', None) or UserService.resolve(request.user)
+        document.verified_by_id = current_user.id if current_user else None
         # if document.document_type.is_for_managers == True:
         #     current_user = AppUser.objects.filter(user=request.user).first()
         #     if current_user.role in ["ZAM", "VED", "ADM"]:
@@ -129,73 +510,616 @@ class DocumentService:
         #     else:
         #         raise ValueError("User is not authorized to create this type of document")
 
+        # Let the database assign the primary key before status history
+        # and inventory lines are attached to the document
+        document.save()
+
         if document.document_type.symbol in ["FVO", "ICO", "IPO", "MMO", "TRO"]:
-            document.current_status = "Generated"
             DocumentStatus.objects.create(
                 document=document,
                 status=Status.objects.get(name="Generated", document_type=document.document_type),
-                user=request.user.appuser if hasattr(request.user, 'appuser') else None
+                user_id=current_user.id if current_user else None
             )
-        else: 
-            document.current_status = "Created"
 
-        if document.document_type.symbol == 'FVO':
-            wh = Address.objects.filter(department=document.destinate_department).first()
-            document.address = wh.address
+        if document.document_type.symbol in ["ICO", "IPO"]:
+            # A cell fits in memory, a whole department is streamed
+            DocumentService.prepare_inventory(document, stream=document.document_type.symbol == "IPO")
+
+        if document.linked_document:
+            ld = document.linked_document
+            for dp in document.documentproduct_set.all():
+                ldp = ld.documentproduct_set.filter(product=dp.product)
+                if ldp.exists():
+                    ldpc = ldp.amount_added
+                    ldp.update(amount_added = dp.amount_required + ldpc)
+                else:
+                    raise Exception(f"Product {dp.product} not found in {ld} linked document")
+
+        return document
+
+    @staticmethod
+    def inventory_buckets(document):
+        """
+        Stock to be counted by an inventory document, summed per
+        (product, cell, expiration_date, serial) bucket in the database
+
+        ICO counts the document's origin cell, IPO and TRO every cell of
+        its origin department.
+
+        Returns:
+            values() QuerySet of bucket dicts with quantity and unit_price,
+            or None for other document types
+        """
+        symbol = document.document_type.symbol
+        stock = Stock.objects.filter(quantity__gt = 0)
+        if symbol == "ICO":
+            stock = stock.filter(cell = document.origin_cell)
+        elif symbol in ["IPO", "TRO"]:
+            stock = stock.filter(cell__department = document.origin_department)
+        else:
+            return None
+
+        return stock.values(
+            'product_id', 'cell_id', 'expiration_date', 'serial'
+        ).annotate(
+            quantity = Sum('quantity'),
+            unit_price = F('product__unit_price')
+        ).order_by('product_id', 'cell_id', 'expiration_date', 'serial')
+
+    @staticmethod
+    def prepare_inventory(document, stream=False, chunk_size=INVENTORY_CHUNK_SIZE):
+        """
+        Fill an inventory document with one line per stock bucket to be counted
+
+        Args:
+            document: Saved ICO, IPO or TRO Document
+            stream: Read the buckets with a server-side cursor and write them
+                chunk by chunk, for departments too big to hold in memory
+            chunk_size: Rows per fetch and per INSERT
+
+        Returns:
+            Number of lines created
+        """
+        buckets = DocumentService.inventory_buckets(document)
+        if buckets is None:
+            return 0
+
+        def line(bucket):
+            return DocumentProduct(
+                document = document,
+                product_id = bucket['product_id'],
+                amount_required = bucket['quantity'],
+                cell_id = bucket['cell_id'],
+                expiration_date = bucket['expiration_date'],
+                serial = bucket['serial'],
+                unit_price = bucket['unit_price']
+            )
+
+        def write(lines):
+            DocumentProduct.objects.bulk_create(lines, batch_size=chunk_size)
+            DocumentService.adjust_totals([(DocumentService.line_values(dp), 1) for dp in lines], documents=[document])
+
+        created = 0
+        with transaction.atomic():
+            if stream:
+                chunk = []
+                for bucket in buckets.iterator(chunk_size=chunk_size):
+                    chunk.append(line(bucket))
+                    if len(chunk) >= chunk_size:
+                        write(chunk)
+                        created += len(chunk)
+                        chunk = []
+                if chunk:
+                    write(chunk)
+                    created += len(chunk)
+            else:
+                lines = [line(bucket) for bucket in buckets]
+                write(lines)
+                created = len(lines)
+        return created
+
+
+class ProductService:
+
+    PRODUCT_PAGE_SIZE = 50
+
+    @staticmethod
+    def annotate_stock(products):
+        """
+        Annotate products with on_hand quantity, stock value and number of locations.
+
+        The figures are correlated subqueries over Stock rather than a JOIN +
+        GROUP BY, so the database only computes them for the rows that end up
+        on the page instead of aggregating the whole catalogue first.
+        """
+        stock = Stock.objects.filter(product=OuterRef('pk'), quantity__gt=0).order_by().values('product')
+        on_hand = stock.annotate(total=Sum('quantity')).values('total')
+        locations = stock.annotate(total=Count('cell', distinct=True)).values('total')
+
+        return products.annotate(
+            on_hand=Coalesce(Subquery(on_hand, output_field=IntegerField()), 0),
+            locations=Coalesce(Subquery(locations, output_field=IntegerField()), 0),
+        ).annotate(
+            value=ExpressionWrapper(
+                F('on_hand') * F('unit_price'),
+                output_field=DecimalField(max_digits=14, decimal_places=2)
+            )
+        )
+
+    @staticmethod
+    def get_catalogue_page(name=None, ean=None, page_number=1, per_page=PRODUCT_PAGE_SIZE):
+        """
+        Get one page of the product catalogue with stock figures
+
+        Args:
+            name: Substring of the product name (case-insensitive)
+            ean: Prefix of the EAN
+            page_number: 1-based page number, out of range values are clamped
+            per_page: Page size
+
+        Returns:
+            django.core.paginator.Page of annotated Products
+        """
+        products = Product.objects.order_by('name', 'id')
+
+        if name:
+            products = products.filter(name__icontains=name)
+        if ean:
+            products = products.filter(ean__startswith=ean)
+
+        # COUNT(*) drops the unused subquery annotations, the page slice
+        # evaluates them only for its own rows
+        paginator = Paginator(ProductService.annotate_stock(products), per_page)
+        return paginator.get_page(page_number)
+
+
+class StockService:
+
+    @staticmethod
+    def _bucket(product, cell, expiration_date, serial):
+        return {
+            'product': product,
+            'cell': cell,
+            'expiration_date': expiration_date,
+            'serial': serial,
+        }
+
+    @staticmethod
+    def increment(product, cell, quantity, expiration_date=None, serial=None):
+        """
+        Atomically add quantity units to the (product, cell, expiration_date, serial) bucket.
+
+        The bucket row is created on first receipt; afterwards a single
+        UPDATE ... SET quantity = quantity + n is issued, whatever n is.
+        """
+        if quantity <= 0:
+            return
+        bucket = StockService._bucket(product, cell, expiration_date, serial)
+        now = timezone.now()
+
+        with transaction.atomic():
+            updated = Stock.objects.filter(**bucket).update(
+                quantity = F('quantity') + quantity,
+                moved_at = now
+            )
+            if updated:
+                return
+            try:
+                with transaction.atomic():
+                    Stock.objects.create(
+                        quantity = quantity,
+                        placed_at = now,
+                        moved_at = now,
+                        checked_at = now,
+                        **bucket
+                    )
+            except IntegrityError:
+                # A concurrent receipt created the bucket first
+                Stock.objects.filter(**bucket).update(
+                    quantity = F('quantity') + quantity,
+                    moved_at = now
+                )
+
+    @staticmethod
+    def get_product_breakdown(product):
+        """
+        Stock of a product grouped by department, cell, expiration date and serial.
+
+        The grouping and the topology lookups happen in a single query; the
+        result only holds plain values, so it can be rendered or serialized as is.
+
+        Args:
+            product: Product instance or id
+
+        Returns:
+            Tuple of (total quantity, list of departments ordered by name), where
+            each department is a dict with id, name, warehouse, total_quantity and
+            locations (dicts with cell_id, cell_number, barcode, path, row, section,
+            level, expiration_date, serial and quantity)
+        """
+        rows = Stock.objects.filter(
+            product=product, quantity__gt=0
+        ).values(
+            'cell__department_id', 'cell_id', 'expiration_date', 'serial'
+        ).annotate(
+            quantity=Sum('quantity'),
+            department_name=F('cell__department__name'),
+            warehouse_name=F('cell__department__warehouse__name'),
+            cell_number=F('cell__number'),
+            barcode=F('cell__barcode'),
+            path=F('cell__path'),
+            row=F('cell__level__section__row__number'),
+            section=F('cell__level__section__number'),
+            level=F('cell__level__number'),
+        ).order_by(
+            'department_name', 'cell__department_id', 'path', 'cell_number', 'expiration_date', 'serial'
+        )
+
+        departments = {}
+        total_quantity = 0
+        for row in rows:
+            department_id = row['cell__department_id']
+            department = departments.get(department_id)
+            if department is None:
+                department = departments[department_id] = {
+                    'id': department_id,
+                    'name': row['department_name'],
+                    'warehouse': row['warehouse_name'],
+                    'total_quantity': 0,
+                    'locations': [],
+                }
+            department['locations'].append({
+                'cell_id': row['cell_id'],
+                'cell_number': row['cell_number'],
+                'barcode': row['barcode'],
+                'path': row['path'],
+                'row': row['row'],
+                'section': row['section'],
+                'level': row['level'],
+                'expiration_date': row['expiration_date'],
+                'serial': row['serial'],
+                'quantity': row['quantity'],
+            })
+            department['total_quantity'] += row['quantity']
+            total_quantity += row['quantity']
+
+        return total_quantity, list(departments.values())
+
+
+class PostingEngine:
+    """
+    Posts a Sklád document to the stock ledger in a fixed number of statements.
+
+    Lines are summed per stock bucket in Python, the affected buckets are read
+    with one SELECT and written back with one bulk_update plus one bulk_create
+    (receipts) or one DELETE (issues), however many lines and units the
+    document carries.
+    """
+
+    RECEIPT_SYMBOLS = ["BO", "WM+", "IC+", "IP+", "NN+", "PZ"]
+    ISSUE_SYMBOLS = ["IC-", "IP-", "NN-", "FV", "RW-"]
+    # Documents received into the department's default cell rather than the line cell
+    DEFAULT_CELL_SYMBOLS = ["BO", "WM+"]
+
+    def __init__(self, document):
+        self.document = document
+        self.lines = 0
+        self.rows_touched = 0
+        self.elapsed = 0.0
+
+    def post(self):
+        """
+        Apply the document's lines to Stock.
+
+        Returns:
+            Dictionary with the number of lines posted, stock rows touched and elapsed seconds
+        """
+        started = time.perf_counter()
+        symbol = self.document.document_type.symbol
+
+        if symbol in self.RECEIPT_SYMBOLS or symbol in self.ISSUE_SYMBOLS:
+            deltas = self._collect_deltas(symbol)
+            if deltas:
+                with transaction.atomic():
+                    if symbol in self.RECEIPT_SYMBOLS:
+                        self._receive(deltas)
+                    else:
+                        self._issue(deltas)
+
+        self.elapsed = time.perf_counter() - started
+        return self.report()
+
+    def report(self):
+        return {
+            'document': self.document.barcode,
+            'lines': self.lines,
+            'rows_touched': self.rows_touched,
+            'elapsed': self.elapsed,
+        }
+
+    def _collect_deltas(self, symbol):
+        """Sum line quantities per (product_id, cell_id, expiration_date, serial) bucket"""
+        default_cell_id = None
+        if symbol in self.DEFAULT_CELL_SYMBOLS:
+            default_cell_id = self.document.origin_department.default_cell_id
+
+        deltas = {}
+        lines = self.document.documentproduct_set.values_list(
+            'product_id', 'cell_id', 'expiration_date', 'serial', 'amount_required'
+        )
+        for product_id, cell_id, expiration_date, serial, amount in lines:
+            self.lines += 1
+            if not amount or amount <= 0:
+                continue
+            if symbol in self.DEFAULT_CELL_SYMBOLS:
+                cell_id = default_cell_id
+            if cell_id is None:
+                raise ValueError(f"Product {product_id} on {self.document} has no cell to post to")
+            key = (product_id, cell_id, expiration_date, serial)
+            deltas[key] = deltas.get(key, 0) + amount
+        return deltas
+
+    def _existing_buckets(self, deltas):
+        product_ids = {key[0] for key in deltas}
+        cell_ids = {key[1] for key in deltas}
+        buckets = {}
+        for stock in Stock.objects.select_for_update().filter(product_id__in=product_ids, cell_id__in=cell_ids):
+            key = (stock.product_id, stock.cell_id, stock.expiration_date, stock.serial)
+            if key in deltas:
+                buckets[key] = stock
+        return buckets
+
+    def _receive(self, deltas):
+        now = timezone.now()
+        existing = self._existing_buckets(deltas)
+        to_update = []
+        to_create = []
+
+        for key, amount in deltas.items():
+            stock = existing.get(key)
+            if stock:
+                stock.quantity += amount
+                stock.moved_at = now
+                to_update.append(stock)
+            else:
+                product_id, cell_id, expiration_date, serial = key
+                to_create.append(Stock(
+                    product_id = product_id,
+                    cell_id = cell_id,
+                    expiration_date = expiration_date,
+                    serial = serial,
+                    quantity = amount,
+                    placed_at = now,
+                    moved_at = now,
+                    checked_at = now
+                ))
+
+        if to_update:
+            Stock.objects.bulk_update(to_update, ['quantity', 'moved_at'])
+        if to_create:
+            try:
+                with transaction.atomic():
+                    Stock.objects.bulk_create(to_create)
+            except IntegrityError:
+                # A concurrent receipt created some of the buckets first
+                for stock in to_create:
+                    StockService.increment(
+                        Product(pk=stock.product_id),
+                        Cell(pk=stock.cell_id),
+                        stock.quantity,
+                        expiration_date = stock.expiration_date,
+                        serial = stock.serial
+                    )
+        self.rows_touched += len(to_update) + len(to_create)
+
+    def _issue(self, deltas):
+        now = timezone.now()
+        existing = self._existing_buckets(deltas)
+        to_update = []
+        to_delete = []
+
+        # Missing stock is ignored and buckets never go below zero
+        for key, amount in deltas.items():
+            stock = existing.get(key)
+            if not stock:
+                continue
+            if stock.quantity > amount:
+                stock.quantity -= amount
+                stock.moved_at = now
+                to_update.append(stock)
+            else:
+                to_delete.append(stock.pk)
+
+        if to_update:
+            Stock.objects.bulk_update(to_update, ['quantity', 'moved_at'])
+        if to_delete:
+            Stock.objects.filter(pk__in=to_delete).delete()
+        self.rows_touched += len(to_update) + len(to_delete)
+
+
+class AnalyticsService:
+
+    MINUS_SYMBOLS = ['IC-', 'IP-', 'NN-', 'RW-']
+    CANCELED_STATUS = 'Canceled'
+    COMPLETED_STATUS = 'Completed'
+
+    @staticmethod
+    def counts_in_facts(group, status, posted):
+        """
+        Whether a document belongs in DailyDocumentFact: Sklád documents are
+        counted once posted, task documents once completed, and neither when canceled
+        """
+        if status == AnalyticsService.CANCELED_STATUS:
+            return False
+        if group == 'Sklád':
+            return posted
+        return status == AnalyticsService.COMPLETED_STATUS
+
+    @staticmethod
+    def fact_documents():
+        """Q matching the documents counts_in_facts accepts"""
+        return (
+            Q(document_type__group='Sklád', posted_at__isnull=False)
+            | (~Q(document_type__group='Sklád') & Q(current_status=AnalyticsService.COMPLETED_STATUS))
+        ) & ~Q(current_status=AnalyticsService.CANCELED_STATUS)
+
+    @staticmethod
+    def _add_fact(date, document_type_id, department_id, quantity, value, document_count):
+        """Atomically add to the (date, document_type, department) fact row, creating it if needed"""
+        key = {
+            'date': date,
+            'document_type_id': document_type_id,
+            'department_id': department_id,
+        }
+        with transaction.atomic():
+            updated = DailyDocumentFact.objects.filter(**key).update(
+                quantity = F('quantity') + quantity,
+                value = F('value') + value,
+                document_count = F('document_count') + document_count
+            )
+            if updated:
+                if document_count < 0:
+                    # Drop the day once its last document left it
+                    DailyDocumentFact.objects.filter(document_count__lte=0, **key).delete()
+                return
+            try:
+                with transaction.atomic():
+                    DailyDocumentFact.objects.create(
+                        quantity = quantity,
+                        value = value,
+                        document_count = document_count,
+                        **key
+                    )
+            except IntegrityError:
+                # A concurrent posting created the row first
+                DailyDocumentFact.objects.filter(**key).update(
+                    quantity = F('quantity') + quantity,
+                    value = F('value') + value,
+                    document_count = F('document_count') + document_count
+                )
+
+    @staticmethod
+    def record_document(document, sign=1):
+        """
+        Add a document's lines to its day's fact row, or remove them with sign=-1
+
+        Args:
+            document: Saved Document with its lines in place
+            sign: 1 to add, -1 to subtract
+        """
+        totals = document.documentproduct_set.aggregate(
+            quantity=Sum('amount_required'),
+            value=Sum(F('amount_required') * F('unit_price'), output_field=DecimalField())
+        )
+        AnalyticsService._add_fact(
+            timezone.localdate(document.created_at),
+            document.document_type_id,
+            document.origin_department_id,
+            sign * (totals['quantity'] or 0),
+            sign * (totals['value'] or 0),
+            sign
+        )
+
+    @staticmethod
+    def record_posting(document):
+        """Count a freshly posted document in the daily facts"""
+        if AnalyticsService.counts_in_facts(document.document_type.group, document.current_status, document.posted_at is not None):
+            AnalyticsService.record_document(document)
+
+    @staticmethod
+    def record_status_change(document, previous_status):
+        """Move a document into or out of the daily facts after its status changed"""
+        group = document.document_type.group
+        posted = document.posted_at is not None
+        was_counted = AnalyticsService.counts_in_facts(group, previous_status, posted)
+        is_counted = AnalyticsService.counts_in_facts(group, document.current_status, posted)
+        if was_counted != is_counted:
+            AnalyticsService.record_document(document, 1 if is_counted else -1)
+        WidgetCache.invalidate()
 
-        if document.document_type.symbol in ["ICO", "IPO"]:
-            DocumentService.prepare_inventory(document)
+    @staticmethod
+    def record_line_changes(changes, documents=()):
+        """
+        Move the facts of counted documents by what changed lines add or take away
 
-        if document.linked_document:
-            ld = document.linked_document
-            for dp in document.documentproduct_set.all():
-                ldp = ld.documentproduct_set.filter(product=dp.product)
-                if ldp.exists():
-                    ldpc = ldp.amount_added
-                    ldp.update(amount_added = dp.amount_required + ldpc)
-                else:
-                    raise Exception(f"Product {dp.product} not found in {ld} linked document")
-            if document.document_type.symbol == 'TRO' or document.document_type.symbol == 'FVO':
-                document.address = ld.address
-                document.carrier = ld.carrier
+        Args:
+            changes: Iterable of (LineValues, sign), see DocumentService.line_totals
+            documents: Document instances held in memory, checked without a query
+        """
+        deltas = {}
+        for values, sign in changes:
+            if values is None or values.document_id is None:
+                continue
+            delta = deltas.setdefault(values.document_id, [0, Decimal(0)])
+            delta[0] += sign * (values.amount_required or 0)
+            if values.unit_price is not None:
+                delta[1] += sign * Decimal(values.unit_price) * (values.amount_required or 0)
+        deltas = {document_id: delta for document_id, delta in deltas.items() if delta[0] or delta[1]}
+        if not deltas:
+            return
 
-        document.created_at = timezone.now()
-        document.updated_at = timezone.now()
+        counted = []
+        unknown = set(deltas)
+        for document in documents:
+            if document.pk in unknown and Document.document_type.is_cached(document):
+                unknown.discard(document.pk)
+                if AnalyticsService.counts_in_facts(document.document_type.group, document.current_status, document.posted_at is not None):
+                    counted.append((document.pk, document.created_at, document.document_type_id, document.origin_department_id))
+        if unknown:
+            counted.extend(Document.objects.filter(
+                AnalyticsService.fact_documents(), id__in=list(unknown)
+            ).values_list('id', 'created_at', 'document_type_id', 'origin_department_id'))
 
-        return document
+        for document_id, created_at, document_type_id, department_id in counted:
+            quantity, value = deltas[document_id]
+            AnalyticsService._add_fact(timezone.localdate(created_at), document_type_id, department_id, quantity, value, 0)
 
     @staticmethod
-    def prepare_inventory(document):
-        if document.document_type.symbol == "ICO":
-            for i in Inventory.objects.filter(cell = document.origin_cell):
-                if DocumentProduct.objects.filter(document = document, product = i.product, cell = i.cell, expiration_date = i.expiration_date, serial = i.serial).exists():
-                    DocumentProduct.objects.filter(document = document, product = i.product, cell = i.cell, expiration_date = i.expiration_date, serial = i.serial).update(amount_required = F('amount_required') + i.amount)
-                else:
-                    DocumentProduct.objects.create(
-                        document = document,
-                        product = i.product,
-                        amount_required = i.amount,
-                        cell = i.cell,
-                        expiration_date = i.expiration_date,
-                        serial = i.serial,
-                        unit_price = i.product.unit_price
-                    )
-        if document.document_type.symbol == "TRO":
-            for i in Inventory.objects.filter(cell__in = TopologyService.get_cells_by_department(document.origin_department)):
-                if DocumentProduct.objects.filter(document = document, product = i.product, cell = i.cell, expiration_date = i.expiration_date, serial = i.serial).exists():
-                    DocumentProduct.objects.filter(document = document, product = i.product, cell = i.cell, expiration_date = i.expiration_date, serial = i.serial).update(amount_required = F('amount_required') + i.amount)
-                else:
-                    DocumentProduct.objects.create(
-                        document = document,
-                        product = i.product,
-                        amount_required = i.amount,
-                        cell = i.cell,
-                        expiration_date = i.expiration_date,
-                        serial = i.serial,
-                        unit_price = i.product.unit_price
-                    )
-                
-class AnalyticsService:
+    def rebuild_facts(date_from=None, date_to=None):
+        """
+        Recompute DailyDocumentFact from the documents, for all days or an inclusive range
+
+        Args:
+            date_from: First day to rebuild, None for no lower bound
+            date_to: Last day to rebuild, None for no upper bound
+
+        Returns:
+            Number of fact rows written
+        """
+        facts = DailyDocumentFact.objects.all()
+        documents = Document.objects.filter(AnalyticsService.fact_documents())
+        if date_from:
+            facts = facts.filter(date__gte=date_from)
+            documents = documents.filter(created_at__date__gte=date_from)
+        if date_to:
+            facts = facts.filter(date__lte=date_to)
+            documents = documents.filter(created_at__date__lte=date_to)
+
+        rows = documents.annotate(
+            date=TruncDate('created_at')
+        ).values('date', 'document_type_id', 'origin_department_id').annotate(
+            quantity=Sum('documentproduct__amount_required'),
+            value=Sum(
+                F('documentproduct__amount_required') * F('documentproduct__unit_price'),
+                output_field=DecimalField()
+            ),
+            document_count=Count('id', distinct=True)
+        ).order_by()
+
+        with transaction.atomic():
+            facts.delete()
+            created = DailyDocumentFact.objects.bulk_create([
+                DailyDocumentFact(
+                    date = row['date'],
+                    document_type_id = row['document_type_id'],
+                    department_id = row['origin_department_id'],
+                    quantity = row['quantity'] or 0,
+                    value = row['value'] or 0,
+                    document_count = row['document_count']
+                )
+                for row in rows
+            ], batch_size=500)
+        return len(created)
     
     @staticmethod
     def get_suspicious_operations(price_threshold=20.0, limit=10):
@@ -209,60 +1133,61 @@ class AnalyticsService:
             QuerySet of suspicious Document objects
         """
         # Get document types with symbols IC-, IP-, NN-, RW-
-        suspicious_symbols = ['IC-', 'IP-', 'NN-', 'RW-']
-        suspicious_types = DocumentType.objects.filter(symbol__in=suspicious_symbols)
+        suspicious_types = DocumentType.objects.filter(symbol__in=AnalyticsService.MINUS_SYMBOLS)
         
-        # Get documents with total price > threshold
+        # Get documents with total price > threshold, newest first along
+        # the (document_type, created_at) index
         suspicious_docs = Document.objects.filter(
             document_type__in=suspicious_types,
             total_price__gt=price_threshold
-        ).order_by('-created_at')[:limit]
+        ).select_related('document_type', 'origin_department').order_by('-created_at')[:limit]
         
         return suspicious_docs
     
     @staticmethod
-    def get_daily_minus_totals(days=30):
+    def _daily_fact_totals(symbols, field, days):
         """
-        Get daily minus document totals for the last specified days
-        
-        Args:
-            days: Number of days to look back (default: 30)
-            
+        Sum a DailyDocumentFact field per day over document types, zero-filling missing days
+
         Returns:
-            Dictionary with dates and total amounts
+            Dictionary with dates and totals
         """
         # Calculate the date range
-        end_date = timezone.now().date()
+        end_date = timezone.localdate()
         start_date = end_date - datetime.timedelta(days=days-1)
-        
-        # Get document types with symbols IC-, IP-, NN-, RW-
-        minus_symbols = ['IC-', 'IP-', 'NN-', 'RW-']
-        minus_types = DocumentType.objects.filter(symbol__in=minus_symbols)
-        
-        # Get documents within date range
-        minus_docs = Document.objects.filter(
-            document_type__in=minus_types,
-            created_at__date__gte=start_date,
-            created_at__date__lte=end_date
-        ).annotate(
-            date=TruncDate('created_at')
-        ).values('date').annotate(
-            total_amount=Sum('documentproduct__amount_required')
-        ).order_by('date')
-        
+
+        facts = DailyDocumentFact.objects.filter(
+            document_type__symbol__in=symbols,
+            date__gte=start_date,
+            date__lte=end_date
+        ).values('date').annotate(total=Sum(field)).order_by('date')
+
         # Fill in missing dates with zeros
         result = {}
         current_date = start_date
         while current_date <= end_date:
             result[current_date] = 0
             current_date += datetime.timedelta(days=1)
-        
+
         # Update with actual data
-        for entry in minus_docs:
+        for entry in facts:
             if entry['date'] in result:
-                result[entry['date']] = entry['total_amount'] or 0
-        
+                result[entry['date']] = entry['total'] or 0
+
         return result
+
+    @staticmethod
+    def get_daily_minus_totals(days=30):
+        """
+        Get daily minus document totals for the last specified days
+        
+        Args:
+            days: Number of days to look back (default: 30)
+            
+        Returns:
+            Dictionary with dates and total amounts
+        """
+        return AnalyticsService._daily_fact_totals(AnalyticsService.MINUS_SYMBOLS, 'quantity', days)
     
     @staticmethod
     def get_daily_fv_totals(days=30):
@@ -275,43 +1200,8 @@ class AnalyticsService:
         Returns:
             Dictionary with dates and total prices
         """
-        # Calculate the date range
-        end_date = timezone.now().date()
-        start_date = end_date - datetime.timedelta(days=days-1)
-        
-        # Get FV document type
-        fv_type = DocumentType.objects.filter(symbol='FV').first()
-        
-        # Get FV documents within date range
-        if fv_type:
-            fv_docs = Document.objects.filter(
-                document_type=fv_type,
-                created_at__date__gte=start_date,
-                created_at__date__lte=end_date
-            ).annotate(
-                date=TruncDate('created_at')
-            ).values('date').annotate(
-                calculated_total_price=Sum(
-                    F('documentproduct__amount_required') * F('documentproduct__unit_price'),
-                    output_field=DecimalField()
-                )
-            ).order_by('date')
-        else:
-            fv_docs = []
-        
-        # Fill in missing dates with zeros
-        result = {}
-        current_date = start_date
-        while current_date <= end_date:
-            result[current_date] = 0
-            current_date += datetime.timedelta(days=1)
-        
-        # Update with actual data
-        for entry in fv_docs:
-            if entry['date'] in result:
-                result[entry['date']] = float(entry['calculated_total_price'] or 0)
-        
-        return result
+        totals = AnalyticsService._daily_fact_totals(['FV'], 'value', days)
+        return {date: float(total) for date, total in totals.items()}
     
     @staticmethod
     def get_product_freshness():
@@ -324,36 +1214,50 @@ class AnalyticsService:
         today = timezone.now().date()
         ten_days_from_now = today + datetime.timedelta(days=10)
         
-        inventory_items = Inventory.objects.all()
-        
-        # Count items in each category
-        fresh = inventory_items.filter(expiration_date__gt=ten_days_from_now).count()
-        expiring_soon = inventory_items.filter(
-            expiration_date__lte=ten_days_from_now,
-            expiration_date__gte=today
-        ).count()
-        expired = inventory_items.filter(expiration_date__lt=today).count()
+        # Sum units in each category in a single pass over the stock buckets
+        totals = Stock.objects.aggregate(
+            fresh=Sum('quantity', filter=Q(expiration_date__gt=ten_days_from_now)),
+            expiring_soon=Sum('quantity', filter=Q(
+                expiration_date__lte=ten_days_from_now,
+                expiration_date__gte=today
+            )),
+            expired=Sum('quantity', filter=Q(expiration_date__lt=today))
+        )
         
         return {
-            '10+ days before BB': fresh,
-            'Less than 10 days to BB': expiring_soon,
-            'Expired/Moldy': expired
+            '10+ days before BB': totals['fresh'] or 0,
+            'Less than 10 days to BB': totals['expiring_soon'] or 0,
+            'Expired/Moldy': totals['expired'] or 0
         }
 
 class TopologyService:
+
+    # Lookups that rebuild the denormalized Cell columns from the real hierarchy
+    CELL_TOPOLOGY_FIELDS = [
+        'id',
+        'number',
+        'level__number',
+        'level__section__number',
+        'level__section__row__number',
+        'level__section__row__department__number',
+        'level__section__row__department_id',
+        'level__section__row__department__warehouse_id',
+        'department_id',
+        'warehouse_id',
+        'path',
+    ]
     
     @staticmethod
     def get_department_by_cell(cell):
         try:
-            return cell.level.section.row.department
+            return TopologyCache.get().department_of(cell.pk) or cell.department
         except AttributeError:
             return None
 
     @staticmethod
     def is_cell_in_department(cell, department):
         try:
-            cell_department = TopologyService.get_department_by_cell(cell)
-            return cell_department == department
+            return TopologyCache.get().department_id_of(cell.pk) == department.id
         except Exception:
             return False
 
@@ -368,22 +1272,736 @@ class TopologyService:
         Returns:
             QuerySet of Cell objects belonging to the Department
         """
-        # Use Django's nested relationships to find all cells
-        # Department -> Row -> Section -> Level -> Cell
-        try:
-            # Get all rows in the department
-            rows = department.row_set.all()
-            all_cells = []
-            
-            # For each row, get all sections, then levels, then cells
-            for row in rows:
-                sections = row.section_set.all()
-                for section in sections:
-                    levels = section.level_set.all()
-                    for level in levels:
-                        cells = level.cell_set.all()
-                        all_cells.extend(cells)
+        # Composed into other queries, so filter on the indexed column rather
+        # than inlining the cached id list
+        return Cell.objects.filter(department=department)
+
+    @staticmethod
+    def fill_cell_topology(cell):
+        """Set department, warehouse and path on an unsaved or re-parented Cell"""
+        level = Level.objects.filter(pk=cell.level_id).values_list(
+            'number',
+            'section__number',
+            'section__row__number',
+            'section__row__department__number',
+            'section__row__department_id',
+            'section__row__department__warehouse_id',
+        ).first()
+        if level is None:
+            return
+        level_num, section_num, row_num, dept_num, department_id, warehouse_id = level
+        cell.department_id = department_id
+        cell.warehouse_id = warehouse_id
+        cell.path = f"{cell.number}-{level_num}-{section_num}-{row_num}-{dept_num}"
+
+    @staticmethod
+    def cells_below(node):
+        """QuerySet of the Cells under a Department, Row, Section or Level, following the real hierarchy"""
+        if isinstance(node, Department):
+            return Cell.objects.filter(level__section__row__department=node)
+        if isinstance(node, Row):
+            return Cell.objects.filter(level__section__row=node)
+        if isinstance(node, Section):
+            return Cell.objects.filter(level__section=node)
+        if isinstance(node, Level):
+            return Cell.objects.filter(level=node)
+        return Cell.objects.none()
+
+    @staticmethod
+    def find_inconsistent_cells(cells=None):
+        """
+        Compare the denormalized Cell columns with the hierarchy they are copied from
+        
+        Args:
+            cells: QuerySet of Cells to check (default: all cells)
             
-            return all_cells
-        except Exception:
-            return []
\ No newline at end of file
+        Returns:
+            List of dictionaries with the expected department_id, warehouse_id and path of every stale cell
+        """
+        cells = Cell.objects.all() if cells is None else cells
+        stale = []
+        for row in cells.values_list(*TopologyService.CELL_TOPOLOGY_FIELDS).iterator():
+            (cell_id, number, level_num, section_num, row_num, dept_num,
+             department_id, warehouse_id, current_department_id, current_warehouse_id, current_path) = row
+            path = f"{number}-{level_num}-{section_num}-{row_num}-{dept_num}"
+            if (department_id, warehouse_id, path) != (current_department_id, current_warehouse_id, current_path):
+                stale.append({
+                    'id': cell_id,
+                    'department_id': department_id,
+                    'warehouse_id': warehouse_id,
+                    'path': path,
+                })
+        return stale
+
+    @staticmethod
+    def sync_cells(cells=None):
+        """
+        Rewrite the denormalized columns of stale Cells
+        
+        Returns:
+            Number of Cells updated
+        """
+        stale = TopologyService.find_inconsistent_cells(cells)
+        Cell.objects.bulk_update(
+            [Cell(**row) for row in stale],
+            ['department_id', 'warehouse_id', 'path'],
+            batch_size=500
+        )
+        # bulk_update sends no post_save, log the change for terminals here
+        SyncService.record(Cell, [row['id'] for row in stale])
+        return len(stale)
+
+
+class CellChoice(namedtuple('CellChoice', ['id', 'label', 'department_id'])):
+    __slots__ = ()
+
+    def __str__(self):
+        return self.label
+
+
+class TopologyCache:
+    """
+    Process-wide snapshot of the warehouse topology.
+
+    The whole Warehouse/Department/Row/Section/Level/Cell tree is read once
+    into arrays sorted by cell id. The snapshot is rebuilt when the version
+    in TopologyVersion, bumped on every save or delete of a topology model,
+    no longer matches; other processes notice the bump within
+    VERSION_CHECK_INTERVAL seconds.
+    """
+
+    # Seconds a process trusts its snapshot before re-reading the version counter
+    VERSION_CHECK_INTERVAL = 5.0
+
+    _instance = None
+    _checked_at = 0.0
+    _lock = threading.Lock()
+
+    def __init__(self, version):
+        self.version = version
+        self.cell_ids = array('q')
+        self.department_ids = array('q')
+        self.labels = []
+
+        rows = Cell.objects.order_by('id').values_list(
+            'id', 'level__section__row__department_id', 'path', 'barcode'
+        )
+        for cell_id, department_id, path, barcode in rows.iterator():
+            self.cell_ids.append(cell_id)
+            self.department_ids.append(department_id)
+            self.labels.append(f"{path} {barcode or ""}")
+
+        self.departments = {
+            department.id: department
+            for department in Department.objects.select_related('warehouse').order_by('name')
+        }
+
+    @classmethod
+    def get(cls):
+        """Return the current snapshot, rebuilding it if the topology version moved"""
+        now = time.monotonic()
+        if cls._instance is None or now - cls._checked_at > cls.VERSION_CHECK_INTERVAL:
+            version = TopologyVersion.objects.values_list('version', flat=True).first() or 0
+            with cls._lock:
+                if cls._instance is None or cls._instance.version != version:
+                    cls._instance = cls(version)
+                cls._checked_at = now
+        return cls._instance
+
+    @classmethod
+    def invalidate(cls):
+        cls._instance = None
+
+    @classmethod
+    def bump_version(cls):
+        """Mark every process's snapshot as stale after a topology change"""
+        if not TopologyVersion.objects.update(version=F('version') + 1):
+            TopologyVersion.objects.create(version=1)
+        cls.invalidate()
+
+    def _index(self, cell_id):
+        i = bisect_left(self.cell_ids, cell_id)
+        if i < len(self.cell_ids) and self.cell_ids[i] == cell_id:
+            return i
+        return None
+
+    def department_id_of(self, cell_id):
+        i = self._index(cell_id)
+        return self.department_ids[i] if i is not None else None
+
+    def department_of(self, cell_id):
+        return self.departments.get(self.department_id_of(cell_id))
+
+    def department_list(self):
+        """Departments with their warehouse, ordered by name"""
+        return list(self.departments.values())
+
+    def cell_choices(self, department_id=None):
+        """List of CellChoice(id, label, department_id) for select boxes"""
+        return [
+            CellChoice(self.cell_ids[i], self.labels[i], self.department_ids[i])
+            for i in range(len(self.cell_ids))
+            if department_id is None or self.department_ids[i] == department_id
+        ]
+
+
+class SyncService:
+    """
+    Delta sync of products, cells and open documents for handheld terminals.
+
+    Every save or delete of a tracked object replaces its SyncChange row, so
+    the SyncChange id is a monotonic change sequence. A client keeps the
+    token of its last sync and receives only the rows whose sequence is
+    above it, plus the ids it should drop. Without a usable token it gets a
+    full snapshot.
+    """
+
+    COLUMNS = {
+        'product': {
+            'id': 'id',
+            'ean': 'ean',
+            'name': 'name',
+            'scu': 'scu',
+            'unit_price': 'unit_price',
+            'weight': 'weight',
+        },
+        'cell': {
+            'id': 'id',
+            'barcode': 'barcode',
+            'number': 'number',
+            'type': 'type',
+            'department': 'department_id',
+            'warehouse': 'warehouse_id',
+            'path': 'path',
+        },
+        'document': {
+            'id': 'id',
+            'barcode': 'barcode',
+            'document_type': 'document_type__symbol',
+            'origin_department': 'origin_department_id',
+            'destinate_department': 'destinate_department_id',
+            'origin_cell': 'origin_cell_id',
+            'current_status': 'current_status',
+            'total_quantity': 'total_quantity',
+            'updated_at': 'updated_at',
+        },
+    }
+    MODELS = {
+        'product': Product,
+        'cell': Cell,
+        'document': Document,
+    }
+    # Changes younger than this may belong to transactions that have not
+    # committed yet, so the token never moves past them and they are resent
+    SAFETY_WINDOW = datetime.timedelta(seconds=5)
+    CHUNK_SIZE = 500
+    # Changes gathered by collect_changes, per thread
+    _collected = threading.local()
+
+    @staticmethod
+    def synced_queryset(name):
+        """Rows of a tracked model terminals keep: every product and cell, only open documents"""
+        queryset = SyncService.MODELS[name].objects.all()
+        if name == 'document':
+            queryset = queryset.exclude(
+                current_status__in=[AnalyticsService.COMPLETED_STATUS, AnalyticsService.CANCELED_STATUS]
+            )
+        return queryset
+
+    @staticmethod
+    def record(model, object_ids, deleted=False):
+        """
+        Log a change of objects of a tracked model
+
+        Args:
+            model: Product, Cell or Document class
+            object_ids: Iterable of primary keys
+            deleted: Whether the objects were deleted
+        """
+        name = model._meta.model_name
+        collected = getattr(SyncService._collected, 'changes', None)
+        if collected is not None:
+            for object_id in object_ids:
+                collected[(name, object_id)] = deleted
+            return
+
+        object_ids = list(object_ids)
+        for start in range(0, len(object_ids), SyncService.CHUNK_SIZE):
+            chunk = object_ids[start:start + SyncService.CHUNK_SIZE]
+            for attempt in range(2):
+                try:
+                    with transaction.atomic():
+                        SyncChange.objects.filter(model=name, object_id__in=chunk).delete()
+                        SyncChange.objects.bulk_create([
+                            SyncChange(model=name, object_id=object_id, is_deleted=deleted)
+                            for object_id in chunk
+                        ])
+                    break
+                except IntegrityError:
+                    # A concurrent change of the same object got in between
+                    if attempt:
+                        raise
+
+    @staticmethod
+    @contextmanager
+    def collect_changes():
+        """
+        Gather the changes recorded inside the block and log each object once
+        when it exits, with its last state, instead of once per save
+
+        Use it inside the transaction that makes the changes. Nested blocks
+        leave the changes to the outermost one. Nothing is logged when the
+        block raises.
+        """
+        state = SyncService._collected
+        if getattr(state, 'changes', None) is not None:
+            yield
+            return
+
+        state.changes = {}
+        try:
+            yield
+            changes = state.changes
+        finally:
+            state.changes = None
+
+        groups = {}
+        for (name, object_id), deleted in changes.items():
+            groups.setdefault((name, deleted), []).append(object_id)
+        for (name, deleted), object_ids in groups.items():
+            SyncService.record(SyncService.MODELS[name], object_ids, deleted=deleted)
+
+    @staticmethod
+    def current_token():
+        """Highest sequence every client can safely have seen"""
+        cutoff = timezone.now() - SyncService.SAFETY_WINDOW
+        recent = SyncChange.objects.filter(changed_at__gt=cutoff).order_by('id').values_list('id', flat=True).first()
+        if recent is not None:
+            return recent - 1
+        return SyncChange.objects.aggregate(last=Max('id'))['last'] or 0
+
+    @staticmethod
+    def _rows(name, queryset):
+        lookups = list(SyncService.COLUMNS[name].values())
+        return [list(row) for row in queryset.values_list(*lookups).order_by('id')]
+
+    @staticmethod
+    def get_changes(since=None):
+        """
+        Rows changed after a sync token, or a full snapshot
+
+        Args:
+            since: Token returned by the previous sync, None for a snapshot
+
+        Returns:
+            Dictionary with the next token, whether this is a full snapshot,
+            and per model its columns, changed rows and deleted ids
+        """
+        token = SyncService.current_token()
+        last = SyncChange.objects.aggregate(last=Max('id'))['last'] or 0
+        # A token from the future means the log was reset: start over
+        full = since is None or since > last
+
+        payload = {'token': str(token), 'full': full}
+        if full:
+            for name in SyncService.MODELS:
+                payload[name + 's'] = {
+                    'columns': list(SyncService.COLUMNS[name]),
+                    'rows': SyncService._rows(name, SyncService.synced_queryset(name)),
+                    'deleted': [],
+                }
+            return payload
+
+        changed = {name: [] for name in SyncService.MODELS}
+        deleted = {name: [] for name in SyncService.MODELS}
+        for name, object_id, is_deleted in SyncChange.objects.filter(id__gt=since).values_list('model', 'object_id', 'is_deleted'):
+            if name in changed:
+                (deleted if is_deleted else changed)[name].append(object_id)
+
+        for name in SyncService.MODELS:
+            rows = []
+            for start in range(0, len(changed[name]), SyncService.CHUNK_SIZE):
+                chunk = changed[name][start:start + SyncService.CHUNK_SIZE]
+                rows.extend(SyncService._rows(name, SyncService.synced_queryset(name).filter(id__in=chunk)))
+            # Objects that left the synced set (e.g. completed documents) are dropped too
+            kept = {row[0] for row in rows}
+            deleted[name].extend(object_id for object_id in changed[name] if object_id not in kept)
+            payload[name + 's'] = {
+                'columns': list(SyncService.COLUMNS[name]),
+                'rows': rows,
+                'deleted': sorted(deleted[name]),
+            }
+        return payload
+
+
+class ScanService:
+    """
+    Resolves a scanned code to the product (EAN), cell or document it names.
+
+    Lookups go through indexed columns only and the results, misses included,
+    are kept in a per-process LRU cache, so a repeated scan is a dictionary
+    lookup. Saving or deleting a product, cell or document evicts what was
+    cached for it in this process; the TTL bounds how long other processes
+    may serve a code that changed elsewhere.
+    """
+
+    CACHE_SIZE = 20000
+    CACHE_TTL = 60.0
+    _cache = LRUCache(maxsize=CACHE_SIZE, ttl=CACHE_TTL)
+    # Cached marker for codes that resolve to nothing
+    _MISS = {}
+
+    @staticmethod
+    def _first(kind, queryset, columns):
+        """First row of queryset as a result dict, columns maps result keys to lookups"""
+        row = queryset.values_list(*columns.values()).first()
+        return row and {'type': kind, **dict(zip(columns, row))}
+
+    @staticmethod
+    def _product(code):
+        return ScanService._first('product', Product.objects.filter(ean=code), {
+            'id': 'id', 'ean': 'ean', 'name': 'name', 'scu': 'scu', 'unit_price': 'unit_price',
+        })
+
+    @staticmethod
+    def _cell(code):
+        return ScanService._first('cell', Cell.objects.filter(barcode=code).order_by('id'), {
+            'id': 'id', 'barcode': 'barcode', 'number': 'number', 'path': 'path',
+            'department': 'department_id', 'warehouse': 'warehouse_id',
+        })
+
+    @staticmethod
+    def _document(code):
+        # Barcodes are not unique across years of numbering, the newest document wins
+        return ScanService._first('document', Document.objects.filter(barcode=code).order_by('-id'), {
+            'id': 'id', 'barcode': 'barcode', 'document_type': 'document_type__symbol',
+            'current_status': 'current_status', 'origin_department': 'origin_department_id',
+        })
+
+    @staticmethod
+    def _lookup_order(code):
+        # Try the most likely kind first: document barcodes look like BO/0001/2501/134901,
+        # EANs are all digits, anything else is most likely a cell label
+        if '/' in code:
+            return (ScanService._document, ScanService._cell, ScanService._product)
+        if code.isdigit():
+            return (ScanService._product, ScanService._cell, ScanService._document)
+        return (ScanService._cell, ScanService._product, ScanService._document)
+
+    @staticmethod
+    def resolve_scan(code):
+        """
+        Identify a scanned code
+
+        Args:
+            code: Scanned EAN, cell barcode or document barcode
+
+        Returns:
+            Dictionary with 'type' ('product', 'cell' or 'document'), 'id' and
+            the main attributes of the object, or None if nothing matches
+        """
+        code = (code or '').strip()
+        if not code:
+            return None
+
+        result = ScanService._cache.get(code)
+        if result is None:
+            for lookup in ScanService._lookup_order(code):
+                result = lookup(code)
+                if result:
+                    break
+            if result:
+                ScanService._cache.set(code, result, tag=(result['type'], result['id']))
+            else:
+                result = ScanService._MISS
+                ScanService._cache.set(code, result)
+
+        return dict(result) if result is not ScanService._MISS else None
+
+    @staticmethod
+    def evict(instance):
+        """Forget cached scans of a product, cell or document, and of its current code"""
+        ScanService._cache.delete_tag((instance._meta.model_name, instance.pk))
+        code = instance.ean if isinstance(instance, Product) else instance.barcode
+        if code:
+            ScanService._cache.delete(code.strip())
+
+
+class BulkDocumentWriter:
+    """
+    Creates documents with their lines in a fixed number of statements per batch.
+
+    Numbers are reserved in one block per (document type, department), and
+    documents, lines and initial statuses are each written with one
+    bulk_create. Sklád documents are then posted through apply_changes,
+    i.e. the set-based PostingEngine. Bulk inserts send no post_save, so the
+    sync log is written here.
+    """
+
+    TASK_SYMBOLS = ["FVO", "ICO", "IPO", "MMO", "TRO"]
+
+    def __init__(self, user, post=True):
+        """
+        Args:
+            user: AppUser recorded as creator, verifier and status author
+            post: Post Sklád documents to stock right away
+        """
+        self.user = user
+        self.post = post
+        # document_type_id -> initial Status
+        self._initial_statuses = {}
+
+    def _initial_status(self, document_type):
+        status = self._initial_statuses.get(document_type.id)
+        if status is None:
+            status = Status.objects.get(name="Generated", document_type=document_type)
+            self._initial_statuses[document_type.id] = status
+        return status
+
+    def write(self, documents, now=None):
+        """
+        Save a batch of new documents in one transaction
+
+        Args:
+            documents: List of (Document, list of DocumentProduct) pairs, both unsaved;
+                documents need document_type and origin_department set
+            now: Creation time (default: now)
+
+        Returns:
+            List of the saved Documents
+        """
+        if not documents:
+            return []
+        now = now or timezone.now()
+
+        with transaction.atomic():
+            # One block of numbers per document type and department
+            groups = {}
+            for document, lines in documents:
+                groups.setdefault((document.document_type_id, document.origin_department_id), []).append(document)
+            for group in groups.values():
+                numbers = DocumentService.reserve_document_numbers(
+                    group[0].document_type, group[0].origin_department, len(group), year=now.year
+                )
+                for document, number in zip(group, numbers):
+                    DocumentService.fill_new_document(document, number, now)
+
+            # Totals are summed before the insert, the lines of an unsaved document have no document_id yet
+            weights = DocumentService.product_weights(line.product_id for document, lines in documents for line in lines)
+            for document, lines in documents:
+                document.created_by = document.created_by if document.created_by_id else self.user
+                document.verified_by = self.user
+                quantity, price, weight = DocumentService.line_totals(
+                    [(DocumentService.line_values(line), 1) for line in lines], weights
+                ).get(None, (0, 0, 0))
+                document.total_quantity = quantity
+                document.total_price = float(price) if price else None
+                document.total_weight = weight.quantize(Decimal('0.01')) if weight else None
+
+            saved = Document.objects.bulk_create([document for document, lines in documents])
+
+            for document, lines in documents:
+                for line in lines:
+                    line.document = document
+            DocumentProduct.objects.bulk_create(
+                [line for document, lines in documents for line in lines],
+                batch_size=1000
+            )
+
+            DocumentStatus.objects.bulk_create([
+                DocumentStatus(document=document, status=self._initial_status(document.document_type), user=self.user)
+                for document in saved
+                if document.document_type.symbol in self.TASK_SYMBOLS
+            ])
+            SyncService.record(Document, [document.pk for document in saved])
+
+            if self.post:
+                for document in saved:
+                    if document.document_type.group == 'Sklád':
+                        DocumentService.apply_changes(document)
+
+        WidgetCache.invalidate()
+        return saved
+
+
+class LookupService:
+    """
+    Typeahead search behind the selectors of the document forms, which load
+    their options as the user types instead of rendering whole tables.
+
+    Each search returns at most `limit` dicts of id and label, read with
+    values_list; cells are searched in the cached topology without a query.
+    """
+
+    LIMIT = 20
+    # Document type being created -> types its linked document can be of
+    LINKED_DOCUMENT_SYMBOLS = {
+        'FV': ['FVO'],
+        'IC+': ['ICO'],
+        'IC-': ['ICO'],
+        'IP+': ['IPO'],
+        'IP-': ['IPO'],
+        'WM+': ['TRO', 'FVO'],
+        'WM-': ['TRO', 'FVO'],
+        'ZB': ['ICO', 'IPO'],
+    }
+
+    @staticmethod
+    def products(q='', limit=LIMIT):
+        """Products by EAN prefix when q is numeric, by name otherwise"""
+        products = Product.objects.order_by('name', 'id')
+        q = q.strip()
+        if q.isdigit():
+            products = products.filter(ean__startswith=q)
+        elif q:
+            products = products.filter(name__icontains=q)
+        return [
+            {'id': product_id, 'label': f"{ean} - {name}"}
+            for product_id, ean, name in products.values_list('id', 'ean', 'name')[:limit]
+        ]
+
+    @staticmethod
+    def cells(q='', department_id=None, limit=LIMIT):
+        """Cells of a department whose label contains q"""
+        q = q.strip().upper()
+        results = []
+        for cell in TopologyCache.get().cell_choices(department_id):
+            if q in cell.label.upper():
+                results.append({'id': cell.id, 'label': cell.label})
+                if len(results) >= limit:
+                    break
+        return results
+
+    @staticmethod
+    def addresses(q='', limit=LIMIT):
+        addresses = Address.objects.order_by('city', 'first_line', 'id')
+        q = q.strip()
+        if q:
+            addresses = addresses.filter(Q(first_line__icontains=q) | Q(city__icontains=q) | Q(postcode__istartswith=q))
+        return [
+            {'id': address_id, 'label': f"{first_line}, {city}, {postcode}, {country}"}
+            for address_id, first_line, city, postcode, country
+            in addresses.values_list('id', 'first_line', 'city', 'postcode', 'country')[:limit]
+        ]
+
+    @staticmethod
+    def users(q='', warehouse_id=None, limit=LIMIT):
+        """AppUsers by username prefix, optionally of one warehouse"""
+        users = AppUser.objects.order_by('user__username')
+        q = q.strip()
+        if q:
+            users = users.filter(user__username__istartswith=q)
+        if warehouse_id:
+            users = users.filter(warehouse_id=warehouse_id)
+        return [
+            {'id': user_id, 'label': f"{username} ({role})"}
+            for user_id, username, role in users.values_list('id', 'user__username', 'role')[:limit]
+        ]
+
+    @staticmethod
+    def documents(q='', for_symbol=None, department_id=None, status=None, limit=LIMIT):
+        """
+        Documents a new document can be linked to, newest first
+
+        Args:
+            q: Part of the barcode
+            for_symbol: Type of the document being created, restricts the linked types
+            department_id: Only documents of this origin department
+            status: Only documents in this status; canceled ones are always left out
+        """
+        documents = Document.objects.exclude(current_status=AnalyticsService.CANCELED_STATUS).order_by('-created_at', '-id')
+        q = q.strip()
+        if q:
+            documents = documents.filter(barcode__icontains=q)
+        symbols = LookupService.LINKED_DOCUMENT_SYMBOLS.get(for_symbol)
+        if symbols:
+            documents = documents.filter(document_type__symbol__in=symbols)
+        if department_id:
+            documents = documents.filter(origin_department_id=department_id)
+        if status:
+            documents = documents.filter(current_status=status)
+        return [
+            {'id': document_id, 'label': f"{barcode} - {symbol} ({current_status})"}
+            for document_id, barcode, symbol, current_status
+            in documents.values_list('id', 'barcode', 'document_type__symbol', 'current_status')[:limit]
+        ]
+
+
+class WmsUser(namedtuple('WmsUser', ['id', 'user_id', 'username', 'role', 'warehouse_id', 'department_ids'])):
+    """What a request needs to know about its AppUser, see UserService.resolve"""
+    __slots__ = ()
+
+    @property
+    def is_manager(self):
+        return self.role in UserService.MANAGER_ROLES
+
+    @property
+    def is_admin(self):
+        return self.role == 'ADM'
+
+
+class UserService:
+    """
+    Resolves the AppUser of a request to a WmsUser: id, role, warehouse and
+    the departments of that warehouse.
+
+    Results are kept in a per-process LRU cache keyed by user id, by the
+    topology version and by a version counter in the Django cache, which is
+    bumped whenever an AppUser is saved or deleted. Every process that shares
+    the cache backend drops its entries on its next request. With the default
+    LocMemCache the counter is per process, so other worker processes keep
+    serving the old AppUser; deployments with several processes need a shared
+    backend in CACHES (see settings).
+    """
+
+    MANAGER_ROLES = ['ZAM', 'VED', 'ADM']
+    CACHE_SIZE = 5000
+    VERSION_KEY = 'wms:appuser:version'
+    _cache = LRUCache(maxsize=CACHE_SIZE)
+    # Cached marker for users without an AppUser
+    _MISS = ()
+
+    @staticmethod
+    def version():
+        version = cache.get(UserService.VERSION_KEY)
+        if version is None:
+            cache.add(UserService.VERSION_KEY, 1, timeout=None)
+            version = cache.get(UserService.VERSION_KEY, 1)
+        return version
+
+    @staticmethod
+    def bump_version():
+        try:
+            cache.incr(UserService.VERSION_KEY)
+        except ValueError:
+            cache.set(UserService.VERSION_KEY, time.time_ns(), timeout=None)
+
+    @staticmethod
+    def resolve(user):
+        """
+        Args:
+            user: django.contrib.auth User, possibly anonymous
+
+        Returns:
+            WmsUser, or None for anonymous users and users without an AppUser
+        """
+        if user is None or not user.is_authenticated:
+            return None
+        # Moving a department to another warehouse changes department_ids too
+        topology = TopologyCache.get()
+        key = (user.pk, UserService.version(), topology.version)
+        wms_user = UserService._cache.get(key)
+        if wms_user is None:
+            row = AppUser.objects.filter(user_id=user.pk).values_list('id', 'role', 'warehouse_id').first()
+            if row is None:
+                wms_user = UserService._MISS
+            else:
+                app_user_id, role, warehouse_id = row
+                department_ids = tuple(sorted(
+                    department.id
+                    for department in topology.departments.values()
+                    if department.warehouse_id == warehouse_id
+                ))
+                wms_user = WmsUser(app_user_id, user.pk, user.get_username(), role, warehouse_id, department_ids)
+            UserService._cache.set(key, wms_user)
+        return wms_user or None
@@ -1,27 +1,147 @@
-from django.db.models.signals import pre_save, post_save
+from django.db.models.signals import post_init, pre_save, post_save, post_delete
 from django.dispatch import receiver
-from .models import Document
-from .services import DocumentService
+from .models import Warehouse, Cell, Department, Row, Section, Level, Product, Document, DocumentProduct, AppUser
+from .services import TopologyService, TopologyCache, SyncService, ScanService, DocumentService, LineValues, UserService
 
 
-@receiver(pre_save, sender=Document)
-def prepare_document(sender, instance, **kwargs):
+@receiver(pre_save, sender=Cell)
+def fill_cell_topology(sender, instance, raw=False, **kwargs):
     """
-    Signal handler to prepare a document before saving
-    - Sets document number
-    - Generates barcode
-    - Sets initial status if needed
+    Signal handler to keep the denormalized department, warehouse and path
+    columns of a cell in line with its level
     """
-    # Only run for new documents
-    if not instance.pk:
-        DocumentService.prepare_document_for_save(instance)
+    if not raw:
+        TopologyService.fill_cell_topology(instance)
 
 
+@receiver(post_save, sender=Department)
+@receiver(post_save, sender=Row)
+@receiver(post_save, sender=Section)
+@receiver(post_save, sender=Level)
+def sync_cells_below(sender, instance, created, raw=False, **kwargs):
+    """
+    Signal handler to refresh the cells under a topology node after it is
+    renumbered or moved to another parent
+    """
+    # A new node has no cells yet
+    if not created and not raw:
+        TopologyService.sync_cells(TopologyService.cells_below(instance))
+
+
+@receiver(post_save, sender=Warehouse)
+@receiver(post_save, sender=Department)
+@receiver(post_save, sender=Row)
+@receiver(post_save, sender=Section)
+@receiver(post_save, sender=Level)
+@receiver(post_save, sender=Cell)
+@receiver(post_delete, sender=Warehouse)
+@receiver(post_delete, sender=Department)
+@receiver(post_delete, sender=Row)
+@receiver(post_delete, sender=Section)
+@receiver(post_delete, sender=Level)
+@receiver(post_delete, sender=Cell)
+def bump_topology_version(sender, instance, raw=False, **kwargs):
+    """
+    Signal handler to invalidate the cached topology in every process
+    """
+    if not raw:
+        TopologyCache.bump_version()
+
+
+@receiver(post_save, sender=AppUser)
+@receiver(post_delete, sender=AppUser)
+def bump_app_user_version(sender, instance, raw=False, **kwargs):
+    """
+    Signal handler to drop the WmsUsers cached for requests in every process
+    """
+    if not raw:
+        UserService.bump_version()
+
+
+@receiver(post_save, sender=Product)
+@receiver(post_save, sender=Cell)
+@receiver(post_save, sender=Document)
+def record_sync_change(sender, instance, raw=False, **kwargs):
+    """
+    Signal handler to log changed products, cells and documents for delta sync
+    """
+    if not raw:
+        SyncService.record(sender, [instance.pk])
+
+
+@receiver(post_delete, sender=Product)
+@receiver(post_delete, sender=Cell)
+@receiver(post_delete, sender=Document)
+def record_sync_deletion(sender, instance, **kwargs):
+    """
+    Signal handler to leave a tombstone of deleted products, cells and documents for delta sync
+    """
+    SyncService.record(sender, [instance.pk], deleted=True)
+
+
+@receiver(post_save, sender=Product)
+@receiver(post_save, sender=Cell)
 @receiver(post_save, sender=Document)
-def set_document_initial_status(sender, instance, created, **kwargs):
+@receiver(post_delete, sender=Product)
+@receiver(post_delete, sender=Cell)
+@receiver(post_delete, sender=Document)
+def evict_scan_cache(sender, instance, **kwargs):
+    """
+    Signal handler to drop cached scan results of changed products, cells and documents
+    """
+    ScanService.evict(instance)
+
+
+@receiver(post_init, sender=DocumentProduct)
+def remember_line_values(sender, instance, **kwargs):
+    """
+    Signal handler to remember what a loaded line contributes to its
+    document's totals, so that saving it only applies the difference
+    """
+    if instance.pk is None or set(LineValues._fields) & instance.get_deferred_fields():
+        instance._saved_line_values = None
+    else:
+        instance._saved_line_values = DocumentService.line_values(instance)
+
+
+@receiver(pre_save, sender=DocumentProduct)
+def load_line_values(sender, instance, raw=False, **kwargs):
+    """
+    Signal handler to read the stored values of an existing line that was
+    loaded without them (deferred fields)
+    """
+    if raw or instance._state.adding or instance._saved_line_values is not None:
+        return
+    stored = DocumentProduct.objects.filter(pk=instance.pk).values_list(*LineValues._fields).first()
+    instance._saved_line_values = LineValues(*stored) if stored else None
+
+
+@receiver(post_save, sender=DocumentProduct)
+def update_totals_on_line_save(sender, instance, raw=False, **kwargs):
+    """
+    Signal handler to move the document totals by what a created or
+    changed line adds or takes away
+    """
+    if raw:
+        return
+    old = instance._saved_line_values
+    new = DocumentService.line_values(instance)
+    instance._saved_line_values = new
+    if old == new:
+        return
+
+    weights = None
+    if DocumentProduct.product.is_cached(instance) and (old is None or old.product_id == new.product_id):
+        weights = {new.product_id: instance.product.weight}
+    documents = [instance.document] if DocumentProduct.document.is_cached(instance) else []
+    DocumentService.queue_totals([(old, -1), (new, 1)], documents=documents, weights=weights)
+
+
+@receiver(post_delete, sender=DocumentProduct)
+def update_totals_on_line_delete(sender, instance, **kwargs):
     """
-    Signal handler to set the initial status after document creation
+    Signal handler to take a deleted line out of its document's totals
     """
-    if created:
-        # Set initial status in the status history
-        DocumentService.set_initial_status(instance, instance.created_by)
+    values = instance._saved_line_values or DocumentService.line_values(instance)
+    documents = [instance.document] if DocumentProduct.document.is_cached(instance) else []
+    DocumentService.queue_totals([(values, -1)], documents=documents)
@@ -0,0 +1,10 @@
+from .settings import *
+
+# The test runner forces DEBUG off; count queries anyway and fail the test
+# of any view that runs more than its @query_budget
+WMS_QUERY_INSTRUMENTATION = True
+WMS_QUERY_BUDGET_STRICT = True
+
+# The data migrations need types and statuses that only exist in the
+# shipped database, so test databases are created straight from the models
+MIGRATION_MODULES = {'wmsprototype': None}
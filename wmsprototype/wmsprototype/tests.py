@@ -0,0 +1,74 @@
+from django.contrib.auth.models import User
+from django.http import HttpResponse
+from django.test import TestCase
+from django.test.utils import override_settings
+from django.urls import path, reverse
+from .benchmarks import SyntheticWarehouse, reset_caches
+from .middleware import QueryBudgetExceeded, query_budget
+from .models import DocumentType, Status
+
+
+@query_budget(2)
+def three_queries(request):
+    for i in range(3):
+        User.objects.exists()
+    return HttpResponse()
+
+
+@query_budget(2)
+def two_queries(request):
+    for i in range(2):
+        User.objects.exists()
+    return HttpResponse()
+
+
+urlpatterns = [
+    path('three/', three_queries),
+    path('two/', two_queries),
+]
+
+
+@override_settings(ROOT_URLCONF=__name__, WMS_QUERY_INSTRUMENTATION=True, WMS_QUERY_BUDGET_STRICT=True)
+class QueryBudgetMiddlewareTests(TestCase):
+
+    def test_view_over_budget_raises(self):
+        with self.assertRaisesMessage(QueryBudgetExceeded, 'ran 3 queries, over its budget of 2'):
+            self.client.get('/three/')
+
+    def test_view_within_budget_reports_queries(self):
+        response = self.client.get('/two/')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['X-DB-Queries'], '2')
+
+
+@override_settings(WMS_QUERY_INSTRUMENTATION=True, WMS_QUERY_BUDGET_STRICT=True)
+class ViewQueryBudgetTests(TestCase):
+    """The budgeted views stay within their @query_budget on a small synthetic warehouse"""
+
+    # The types of SyntheticWarehouse.HISTORY_SYMBOLS, with the group they belong to
+    DOCUMENT_TYPES = {'PZ': 'Sklád', 'FV': 'Sklád', 'RW-': 'Sklád', 'NN+': 'Sklád', 'NN-': 'Sklád', 'IC-': 'Sklád', 'FVO': 'Príkaz'}
+
+    @classmethod
+    def setUpTestData(cls):
+        reset_caches()
+        for symbol, group in cls.DOCUMENT_TYPES.items():
+            document_type = DocumentType.objects.create(group=group, symbol=symbol, name=symbol, is_for_managers=False)
+            Status.objects.create(document_type=document_type, name='Generated')
+        cls.warehouse = SyntheticWarehouse(products=50, stock=100, documents=60, lines=5, days=10)
+        cls.warehouse.build()
+
+    def setUp(self):
+        reset_caches()
+        self.client.force_login(self.warehouse.manager.user)
+
+    def test_list_documents(self):
+        self.assertEqual(self.client.get(reverse('list_documents')).status_code, 200)
+        self.assertEqual(self.client.get(reverse('list_documents_json')).status_code, 200)
+
+    def test_list_products(self):
+        self.assertEqual(self.client.get(reverse('list_products')).status_code, 200)
+
+    def test_view_product(self):
+        product_id = self.warehouse.product_ids[0]
+        response = self.client.get(reverse('view_product', kwargs={'product_id': product_id}))
+        self.assertEqual(response.status_code, 200)
@@ -18,7 +18,7 @@ from django.contrib import admin
 from django.conf import settings
 from django.conf.urls.static import static
 from django.urls import path
-from . import views
+from . import api, views
 
 urlpatterns = [
     path('admin/', admin.site.urls),
@@ -31,6 +31,22 @@ urlpatterns = [
     path("document/new/", views.select_document_type, name="new_document"),
     path("document/new/<str:doc_type>/", views.create_specific_document, name="create_specific_document"),
     path("document/all/", views.list_documents, name="list_documents"),
+    path("document/all/json/", views.list_documents_json, name="list_documents_json"),
     path("product/<int:product_id>/", views.view_product, name="view_product"),
-    path("product/all/", views.list_products, name="list_products")
+    path("product/all/", views.list_products, name="list_products"),
+    path("api/documents/", api.documents, name="api_documents"),
+    path("api/documents/<int:document_id>/", api.document, name="api_document"),
+    path("api/documents/import/", api.import_documents, name="api_import_documents"),
+    path("api/stock/", api.stock, name="api_stock"),
+    path("api/products/", api.products, name="api_products"),
+    path("api/products/<int:product_id>/", api.product, name="api_product"),
+    path("api/warehouses/", api.warehouses, name="api_warehouses"),
+    path("api/departments/", api.departments, name="api_departments"),
+    path("api/cells/", api.cells, name="api_cells"),
+    path("api/scan/", api.scan, name="api_scan"),
+    path("api/lookup/<str:kind>/", api.lookup, name="api_lookup"),
+    path("api/export/<str:name>/", api.export, name="api_export"),
+    path("sync/", api.sync, name="sync"),
+    # Terminals call /sync?since=..., and the media catch-all pattern keeps APPEND_SLASH from redirecting
+    path("sync", api.sync),
 ] + static(settings.MEDIA_URL, document_root=settings.MEDIA_ROOT)
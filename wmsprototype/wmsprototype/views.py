@@ -11,7 +11,9 @@ from django.db import transaction
 import json
 from .models import *
 from .forms import DocumentForm, DocumentProductFormSet, LoginForm
-from .services import DocumentService, TopologyService, AnalyticsService
+from .cache import WidgetCache
+from .middleware import query_budget
+from .services import DocumentService, ProductService, StockService, TopologyService, AnalyticsService, TopologyCache, SyncService
 
 def login_view(request):
     """Handle user login"""
@@ -45,23 +47,18 @@ def logout_view(request):
 
 @login_required(login_url='login')
 def home(request):
-    # Check if the current user is a manager
-    is_admin = AppUser.objects.filter(user=request.user).first().role == "ADM"
+    app_user = request.wms_user
 
-    # For non-manager users, get open documents of specific types
+    # For non-manager users, get open documents of their warehouse; users
+    # without an AppUser have no warehouse and see none
     open_documents = []
-    if not is_admin:
-        # Get documents of types FVO, ICO, IPO, MMO, and TRO that are open
-        document_types = DocumentType.objects.filter(symbol__in=['FVO', 'ICO', 'IPO', 'MMO', 'TRO'])
-        
-        # Get documents with these types that aren't in final statuses (like 'Completed' or 'Cancelled')
-        # Assuming 'Completed' and 'Cancelled' are final statuses, adjust based on your actual status names
-        open_documents = Document.objects.filter(
-            document_type__in=document_types,
-            origin_department__in= Department.objects.filter(warehouse=AppUser.objects.filter(user=request.user).first().warehouse)
-        ).exclude(
-            current_status__in=['Completed', 'Cancelled']
-        ).order_by('-created_at')
+    if app_user is not None and not app_user.is_admin:
+        open_documents = WidgetCache.get(
+            'open_documents',
+            lambda: DocumentService.get_open_documents(app_user.warehouse_id),
+            warehouse_id=app_user.warehouse_id,
+            role=app_user.role
+        )
     
     context = {
         'open_documents': open_documents,
@@ -77,21 +74,32 @@ def actions(request):
 @login_required(login_url='login')
 def analytics(request):
     """View for analytics dashboard"""
+    app_user = request.wms_user
+    # Widgets are cached per warehouse and role, see WidgetCache; users
+    # without an AppUser share one unscoped copy
+    widget_scope = {'warehouse_id': None, 'role': None}
+    if app_user is not None:
+        widget_scope = {'warehouse_id': app_user.warehouse_id, 'role': app_user.role}
+    
     # Get suspicious operations
-    suspicious_docs = AnalyticsService.get_suspicious_operations()
+    suspicious_docs = WidgetCache.get(
+        'suspicious_operations',
+        lambda: list(AnalyticsService.get_suspicious_operations()),
+        **widget_scope
+    )
     
     # Get daily minus totals
-    minus_totals = AnalyticsService.get_daily_minus_totals()
+    minus_totals = WidgetCache.get('daily_minus_totals', AnalyticsService.get_daily_minus_totals, **widget_scope)
     minus_dates = json.dumps([date.strftime('%Y-%m-%d') for date in minus_totals.keys()])
     minus_values = json.dumps(list(minus_totals.values()))
     
     # Get FV document totals
-    fv_totals = AnalyticsService.get_daily_fv_totals()
+    fv_totals = WidgetCache.get('daily_fv_totals', AnalyticsService.get_daily_fv_totals, **widget_scope)
     fv_dates = json.dumps([date.strftime('%Y-%m-%d') for date in fv_totals.keys()])
     fv_values = json.dumps(list(fv_totals.values()))
     
     # Get product freshness
-    freshness = AnalyticsService.get_product_freshness()
+    freshness = WidgetCache.get('product_freshness', AnalyticsService.get_product_freshness, **widget_scope)
     freshness_labels = json.dumps(list(freshness.keys()))
     freshness_values = json.dumps(list(freshness.values()))
     
@@ -103,7 +111,6 @@ def analytics(request):
         'fv_values': fv_values,
         'freshness_labels': freshness_labels,
         'freshness_values': freshness_values,
-        'is_current_user_manager': AppUser.objects.filter(user=request.user).first().role in ['ZAM', 'VED', 'ADM']
     }
     
     return render(request, "analytics.html", context)
@@ -114,123 +121,115 @@ def select_document_type(request):
   document_types = DocumentType.objects.all().order_by('-group', 'symbol')
   
   context = {
-      'document_types': document_types,
-      'is_current_user_manager': AppUser.objects.filter(user=request.user).first().role in ['ZAM', 'VED', 'ADM']
+      'document_types': document_types
   }
   
   return render(request, "select_document_type.html", context)
 
 @login_required(login_url='login')
+@query_budget(10)
 def list_documents(request):
-  """View to display all documents in the system"""
-  # Get all documents, ordered by creation date (newest first)
-  documents = Document.objects.all().order_by('-created_at')
-  
-  # Filter by document type if specified in query parameters
-  doc_type_id = request.GET.get('doc_type')
-  if doc_type_id:
-    documents = documents.filter(document_type_id=doc_type_id)
-  
-  # Filter by department if specified in query parameters
-  dept_id = request.GET.get('department')
-  if dept_id:
-    documents = documents.filter(origin_department_id=dept_id)
+  """View to display documents in the system, one keyset page at a time"""
+  # Get a page of documents, ordered by creation date (newest first),
+  # filtered by document type and department if specified in query parameters
+  documents, next_cursor = DocumentService.get_documents_page(
+    doc_type_id=request.GET.get('doc_type'),
+    department_id=request.GET.get('department'),
+    cursor=request.GET.get('cursor')
+  )
     
   # Get all document types for the filter dropdown
   document_types = DocumentType.objects.all().order_by('-group', 'symbol')
   
   # Get all departments for the filter dropdown
-  departments = Department.objects.all().order_by('name')
+  departments = TopologyCache.get().department_list()
+
+  # Keep the filters when following the next page link
+  next_query = None
+  if next_cursor:
+    params = request.GET.copy()
+    params['cursor'] = next_cursor
+    next_query = params.urlencode()
   
   context = {
       'documents': documents,
       'document_types': document_types,
       'departments': departments,
-      'is_current_user_manager': AppUser.objects.filter(user=request.user).first().role in ['ZAM', 'VED', 'ADM']
+      'next_cursor': next_cursor,
+      'next_query': next_query
   }
   
   return render(request, "documents_list.html", context)
 
 @login_required(login_url='login')
+@query_budget(10)
+def list_documents_json(request):
+  """JSON variant of list_documents for infinite scroll"""
+  try:
+    limit = min(int(request.GET.get('limit', DocumentService.DOCUMENT_PAGE_SIZE)), 200)
+  except ValueError:
+    limit = DocumentService.DOCUMENT_PAGE_SIZE
+
+  documents, next_cursor = DocumentService.get_documents_page(
+    doc_type_id=request.GET.get('doc_type'),
+    department_id=request.GET.get('department'),
+    cursor=request.GET.get('cursor'),
+    limit=max(limit, 1)
+  )
+
+  results = [{
+    'id': document.id,
+    'url': reverse('view_document', kwargs={'document_id': document.id}),
+    'barcode': document.barcode,
+    'document_type': {
+      'symbol': document.document_type.symbol,
+      'name': document.document_type.name,
+    },
+    'created_at': document.created_at.isoformat(),
+    'origin_department': document.origin_department.name,
+    'destinate_department': document.destinate_department.name if document.destinate_department else None,
+    'current_status': document.current_status,
+    'total_quantity': document.total_quantity,
+  } for document in documents]
+
+  return JsonResponse({'results': results, 'next_cursor': next_cursor})
+
+@login_required(login_url='login')
+@query_budget(10)
 def list_products(request):
-  """View to display all products in the system"""
-  # Get all products
-  products = Product.objects.all().order_by('name')
-  
-  # Filter by name if specified in query parameters
-  product_name = request.GET.get('name')
-  if product_name:
-    products = products.filter(name__icontains=product_name)
-  
-  # Filter by EAN if specified
-  ean = request.GET.get('ean')
-  if ean:
-    products = products.filter(ean__icontains=ean)
-  
-  # Add inventory count to each product
-  for product in products:
-    product.inventory_count = Inventory.objects.filter(product=product).count()
+  """View to display the product catalogue with on-hand stock, one page at a time"""
+  # Filter by name substring and EAN prefix if specified in query parameters
+  page = ProductService.get_catalogue_page(
+    name=request.GET.get('name'),
+    ean=request.GET.get('ean'),
+    page_number=request.GET.get('page')
+  )
+
+  # Keep the filters when following the page links
+  params = request.GET.copy()
+  params.pop('page', None)
   
   context = {
-    'products': products,
-    'is_current_user_manager': AppUser.objects.filter(user=request.user).first().role in ['ZAM', 'VED', 'ADM']
+    'products': page.object_list,
+    'page': page,
+    'filter_query': params.urlencode()
   }
   
   return render(request, "products_list.html", context)
 
 @login_required(login_url='login')
+@query_budget(10)
 def view_product(request, product_id):
   """View a specific product with inventory balances by department"""
   product = get_object_or_404(Product, id=product_id)
   
-  # Get all inventory items for this product
-  inventory_items = Inventory.objects.filter(product=product)
-  
-  # Organize inventory by department
-  inventory_by_department = {}
-  total_quantity = 0
-  
-  for item in inventory_items:
-    # Get the department for this cell
-    department = TopologyService.get_department_by_cell(item.cell)
-    
-    if department:
-      dept_id = department.id
-      
-      # Initialize department entry if it doesn't exist
-      if dept_id not in inventory_by_department:
-        inventory_by_department[dept_id] = {
-          'department': department,
-          'total_quantity': 0,
-          'locations': []
-        }
-      
-      # Check if this cell is already in the locations list
-      cell_exists = False
-      for location in inventory_by_department[dept_id]['locations']:
-        if location['cell'].id == item.cell.id:
-          location['quantity'] += 1
-          cell_exists = True
-          break
-      
-      # If cell not in list, add it
-      if not cell_exists:
-        inventory_by_department[dept_id]['locations'].append({
-          'cell': item.cell,
-          'quantity': 1,
-          'expiration_date': item.expiration_date,
-          'serial': item.serial
-        })
-      
-      # Update department total
-      inventory_by_department[dept_id]['total_quantity'] += 1
-      total_quantity += 1
+  # Stock grouped by department, cell, expiration date and serial in one query
+  total_quantity, inventory_by_department = StockService.get_product_breakdown(product)
   
   context = {
     'product': product,
-    'inventory_by_department': inventory_by_department.values(),
-    'total_quantity': total_quantity,
-    'is_current_user_manager': AppUser.objects.filter(user=request.user).first().role in ['ZAM', 'VED', 'ADM']
+    'inventory_by_department': inventory_by_department,
+    'total_quantity': total_quantity
   }
   
   return render(request, "view_product.html", context)
@@ -243,7 +242,7 @@ def view_document(request, document_id):
   available_statuses = Status.objects.filter(document_type=document.document_type)
   
   if request.method == 'POST' and 'change_status' in request.POST:
-    with transaction.atomic():
+    with transaction.atomic(), SyncService.collect_changes():
       new_status_id = request.POST.get('new_status')
       if new_status_id:
         try:
@@ -252,8 +251,11 @@ def view_document(request, document_id):
           if document.current_status == "Completed":
               raise ValueError("Cannot change status of a completed document")
 
+          if request.wms_user is None:
+              raise ValueError("Only warehouse users can change the status of a document")
+
           if document.document_type.symbol in ["ICO", "IPO"] and new_status.name == "Completed":
-            DocumentService.close_inventory(document)          
+            DocumentService.close_inventory(document, request)
 
           # Get user-provided description or leave it empty
           status_description = request.POST.get('status_description', '')
@@ -262,7 +264,7 @@ def view_document(request, document_id):
           DocumentStatus.objects.create(
             document=document,
             status=new_status,
-            user=request.user.appuser,
+            user_id=request.wms_user.id,
             description=status_description
           )
           
@@ -298,11 +300,11 @@ def create_specific_document(request, doc_type):
     
     if request.method == 'POST':
       try:
-        with transaction.atomic():
+        with transaction.atomic(), SyncService.collect_changes():
           # Create a new Document instance but don't save it yet
           document = Document(
               document_type=document_type,
-              created_by=request.user.appuser if hasattr(request.user, 'appuser') else None
+              created_by_id=request.wms_user.id if request.wms_user else None
           )
 
           print("document created")
@@ -323,7 +325,7 @@ def create_specific_document(request, doc_type):
           
 
           # Let the service prepare the document (sets number, barcode, etc.)
-          document = DocumentService.prepare_document_for_first_save(document, request.user.appuser if hasattr(request.user, 'appuser') else None, request)
+          document = DocumentService.prepare_document_for_first_save(document, request.wms_user, request)
           print("document prepared")
           document.save()
           print("document saved")
@@ -340,13 +342,9 @@ def create_specific_document(request, doc_type):
               raise Exception("The Document could not be created because product data didn't validate.")
           
           if formset.is_valid():
-            # Save product items
-            formset.save()
-            
-            # Update document total quantity
-            total_qty = sum(form.cleaned_data.get('amount_required', 0) or 0 for form in formset.forms if form.cleaned_data and not form.cleaned_data.get('DELETE', False))
-            document.total_quantity = total_qty
-            document.save(update_fields=['total_quantity'])
+            # Save product items, the DocumentProduct signals add them to the document totals
+            with DocumentService.collect_totals():
+              formset.save()
 
             if document.document_type.group == 'Sklád':
               DocumentService.apply_changes(document)
@@ -365,45 +363,16 @@ def create_specific_document(request, doc_type):
     form = DocumentForm(document_type=document_type)
     formset = DocumentProductFormSet()
     
-    # Get all the necessary data for dropdowns
-    departments = Department.objects.all()
-    products = Product.objects.all()
-    
-    # Get users for user selections
-    from django.contrib.auth.models import User
-    users = User.objects.all()
-    appusers = AppUser.objects.all()
-    
-    # Get cells for cell selection dropdowns
-    cells = Cell.objects.all()
-    
-    # Get potential linked documents depending on document type
-    potential_linked_documents = Document.objects.all()
-
-    # Get rows, sections, and levels for cell selection
-    rows = Row.objects.all()
-    sections = Section.objects.all()
-    levels = Level.objects.all()
-    
-    # Get addresses for address selection dropdown
-    addresses = Address.objects.all()
+    # Departments come from the cached topology; products, cells, users,
+    # addresses and linked documents are searched through api_lookup as the user types
+    departments = TopologyCache.get().department_list()
     
     # Context for rendering the template
     context = {
         'document_type': document_type,
         'form': form,
         'formset': formset,
-        'departments': departments,
-        'rows': rows,
-        'sections': sections,
-        'levels': levels,
-        'cells': cells,
-        'products': products,
-        'users': users,
-        'appusers': appusers,
-        'potential_linked_documents': potential_linked_documents,
-        'addresses': addresses,
-        'is_current_user_manager': AppUser.objects.filter(user=request.user).first().role in ['ZAM', 'VED', 'ADM']
+        'departments': departments
     }
     
     # Render the appropriate template based on document type
@@ -427,7 +396,7 @@ def create_specific_document(request, doc_type):
   
   if request.method == 'POST':
     try:
-      with transaction.atomic():
+      with transaction.atomic(), SyncService.collect_changes():
         form = DocumentForm(request.POST, instance=document)
         formset = DocumentProductFormSet(request.POST, instance=document)
         
@@ -442,8 +411,9 @@ def create_specific_document(request, doc_type):
           # Save form
           form.save()
           
-          # Save formset
-          formset.save()
+          # Save formset, the document totals follow the changed lines
+          with DocumentService.collect_totals():
+            formset.save()
           
           # Update document total quantity
           total_qty = sum(form.cleaned_data.get('amount_required', 0) or 0 for form in formset.forms if form.cleaned_data and not form.cleaned_data.get('DELETE', False))